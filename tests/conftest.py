@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import pytest
+
+#The toolbox scripts are plain modules in toolbox/scripts
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, 'toolbox', 'scripts')))
+
+@pytest.fixture(scope='session')
+def syntheticStudy():
+    """Import rows of a small synthetic study (split and intersected by the geometry backend) and the default parameter tables"""
+    from cmr_benchmark import importRows
+    from cmr_geometry import indexedGeometryBackend
+    from cmr_synthetic import cmrsynthetic, defaultParameterTables
+    synthetic = cmrsynthetic(600, seed=3)
+    elements, zones = synthetic.elements(), synthetic.zones()
+    segments = indexedGeometryBackend().splitElements(elements, zones)
+    rows = importRows(segments, list(range(1, len(segments)+1)), zones, 7)
+    return {'studyId': 7, 'rows': rows, 'parameterTables': defaultParameterTables()}
+
+@pytest.fixture
+def syntheticEngine(syntheticStudy):
+    from cmr_engine import cmrengine
+    return cmrengine.fromImportRows(syntheticStudy['studyId'], syntheticStudy['rows'], syntheticStudy['parameterTables'])
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from cmr_batch import readManifest
+
+def _manifest(tmp_path, manifest):
+    manifestFile = str(tmp_path / 'manifest.json')
+    with open(manifestFile, 'w') as f:
+        json.dump(manifest, f)
+    return manifestFile
+
+def _study(name, **settings):
+    study = {'studyName': name, 'hazardDatasetFilepath': 'hz_' + name, 'elementDatasetFilepath': 'ear_' + name}
+    study.update(settings)
+    return study
+
+def test_readManifestMergesDefaults(tmp_path):
+    manifestFile = _manifest(tmp_path, {'sdeConnFile': 'cmrGeo.sde', 'outputGDB': 'cmr.gdb', 'bulkLoad': True
+                                        , 'fieldMapping': {'processtype_id': 'PROC_ID', 'route_code': 'VEGNR'}
+                                        , 'studies': [_study('A')
+                                                      , _study('B', studyId=120, bulkLoad=False, fieldMapping={'route_code': 'ROUTE'})]})
+    a, b = readManifest(manifestFile)
+    assert (a['sdeConnFile'], a['outputGDB'], a['bulkLoad'], a['hazardDatasetFilepath']) == ('cmrGeo.sde', 'cmr.gdb', True, 'hz_A')
+    assert a['fieldMapping'] == {'processtype_id': 'PROC_ID', 'route_code': 'VEGNR'}
+    assert 'studyId' not in a
+    #Study settings override the defaults and the field mappings are merged
+    assert (b['studyId'], b['bulkLoad']) == (120, False)
+    assert b['fieldMapping'] == {'processtype_id': 'PROC_ID', 'route_code': 'ROUTE'}
+
+def test_readManifestRejectsBadStudies(tmp_path):
+    defaults = {'sdeConnFile': 'cmrGeo.sde', 'outputGDB': 'cmr.gdb'}
+    unknown = dict(defaults, studies=[_study('A'), _study('B', geometryBackends='indexed')])
+    with pytest.raises(Exception) as e:
+        readManifest(_manifest(tmp_path, unknown))
+    assert 'Unknown settings for study 1: geometryBackends' in str(e.value)
+    missing = dict(defaults, studies=[{'studyName': 'A', 'hazardDatasetFilepath': 'hz_A'}])
+    with pytest.raises(Exception) as e:
+        readManifest(_manifest(tmp_path, missing))
+    assert 'Study 0 is missing the setting elementDatasetFilepath' in str(e.value)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import decimal
+from cmr_bulkload import sqlLiteral, cmrbulkloader
+
+class _connection:
+    def __init__(self):
+        self.statements = []
+    def execute(self, strSQL):
+        self.statements.append(strSQL)
+
+def test_undefinedNumbersAreNull():
+    for value in [float('nan'), float('inf'), decimal.Decimal('NaN'), decimal.Decimal('-Infinity'), None]:
+        assert sqlLiteral(value) == "NULL"
+    assert sqlLiteral(decimal.Decimal('1.50')) == "1.50"
+    assert sqlLiteral(u"O'Neil") == u"N'O''Neil'"
+
+def test_loadLeavesIdToTheDatabase():
+    conn = _connection()
+    loader = cmrbulkloader(conn, 'cmrT_ImportIntersectionTable', ['study_id', 'element_size'], requiredPositive=['element_size'])
+    loader.batchSize = 2
+    stats = loader.load([[1, 2.0], [1, 0], [1, decimal.Decimal('3')], {'study_id': 1, 'element_size': 4.0}])
+    assert (stats['rows_loaded'], stats['rows_skipped']) == (3, 1)
+    assert conn.statements == ["INSERT INTO [cmrT_ImportIntersectionTable] ([study_id],[element_size]) VALUES (1,2.0),(1,3)"
+                               , "INSERT INTO [cmrT_ImportIntersectionTable] ([study_id],[element_size]) VALUES (1,4.0)"]
+
+def test_loadSkipsUndefinedNumbers():
+    conn = _connection()
+    loader = cmrbulkloader(conn, 'cmrT_ImportIntersectionTable', ['study_id', 'element_size'], requiredPositive=['element_size'])
+    stats = loader.load([[1, decimal.Decimal('NaN')], [1, float('nan')], [1, float('inf')], [1, decimal.Decimal('Infinity')], [1, 5]])
+    assert (stats['rows_loaded'], stats['rows_skipped']) == (1, 4)
+    assert conn.statements == ["INSERT INTO [cmrT_ImportIntersectionTable] ([study_id],[element_size]) VALUES (1,5)"]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from cmr_engine import cmrriskattributes
+from cmr_synthetic import scriptInserts
+
+def _round(value):
+    """CAST(... AS DECIMAL(10,4)) and CAST(... AS MONEY), the float is taken with its 15 significant digits"""
+    return float(Decimal('%.15g' % value).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP))
+
+def _mul(*values):
+    """Product where NULL (None) propagates"""
+    result = 1.0
+    for v in values:
+        if v is None:
+            return None
+        result *= v
+    return result
+
+def viewSummaries(importRows):
+    """Row by row transcription of cmrSP_updateRouteEventFrequency, cmrV_ElementHazardZone, cmrV_ElementValueDamages,
+cmrV_ElementValueDamagesPivot and the summary views, with the default parameters of the build script"""
+    t = scriptInserts()
+    categories = set(r['elementcategory_id'] for r in t['cmrT_ElementCategory'])
+    processtypes = dict((r['processtype_id'], r) for r in t['cmrT_ProcessType'] if r['processtype_id'] != 100)
+    elementtypes = dict((r['elementtype_code'].rstrip().upper(), r['elementtype_id']) for r in t['cmrT_ElementType']
+                        if r['elementcategory_id'] in categories)
+    calculations = dict((r['valuetype_calculation_id'], r) for r in t['cmrT_ValueTypeCalculation'])
+    valueCategories = set(r['valuetype_category_id'] for r in t['cmrT_ValueTypeCategory'])
+    valuetypes = {}
+    for r in t['cmrT_ValueType']:
+        if r['valuetype_calculation_id'] in calculations and r['valuetype_category_id'] in valueCategories:
+            vt = dict(calculations[r['valuetype_calculation_id']])
+            vt.update(r)
+            valuetypes[r['valuetype_id']] = vt
+    useKeys = ['use_element_event_frequency', 'use_route_event_frequency', 'use_element_impact_size'
+               , 'use_aadt_passenger', 'use_aadt_goods', 'use_diversion_time']
+    fixed = {-1: dict((k, None) for k in useKeys), 0: dict((k, None) for k in useKeys)}
+    fixed[-1].update(valuetype_id=-1, valuetype_category_id=-1, use_element_event_frequency=1)
+    fixed[0].update(valuetype_id=0, valuetype_category_id=0, use_route_event_frequency=1)
+    #cmrV_ElementValue
+    elementValues = {}
+    for r in t['cmrT_ElementValue']:
+        if r['valuetype_id'] in valuetypes:
+            elementValues.setdefault(r['elementtype_id'], []).append((valuetypes[r['valuetype_id']], r['value_mean']))
+    for etId in elementtypes.values():
+        elementValues.setdefault(etId, []).extend([(fixed[-1], 1.0), (fixed[0], 1.0)])
+    #cmrV_DamageFunction
+    damage = dict(((r['processtype_id'], r['valuetype_id']), r['damage_prob']*r['damage_max']/(r['damage_exponent']+1.0))
+                  for r in t['cmrT_DamageFunction'] if r['valuetype_id'] in valuetypes)
+    for ptId in processtypes:
+        damage[(ptId, -1)] = damage[(ptId, 0)] = 1.0
+
+    #The study tables as stored by cmrSP_importResults
+    elements, zones, pairs = {}, {}, set()
+    for row in importRows:
+        if not row.get('event_frequency') or row['event_frequency'] <= 0 or not row.get('element_size') or row['element_size'] <= 0:
+            continue
+        elements.setdefault(row['element_feature_id'], row)
+        zones.setdefault(row['hazardzone_feature_id'], row)
+        pairs.add((row['element_feature_id'], row['hazardzone_feature_id']))
+
+    #cmrSP_updateRouteEventFrequency
+    valid = []
+    for eid, zid in sorted(pairs):
+        e, z = elements[eid], zones[zid]
+        if e['elementtype_code'].rstrip().upper() not in elementtypes or z['processtype_id'] not in processtypes:
+            continue
+        pt = processtypes[z['processtype_id']]
+        fsf = pt['frequency_size_factor']
+        eventFrequency = (1.0 if fsf is None else e['element_size']*fsf)/float(z['event_frequency'])
+        valid.append((eid, zid, e['route_code'], eventFrequency, pt['event_cooccurrence_factor']))
+    partitions = {}
+    for eid, zid, route, ef, cof in valid:
+        partitions.setdefault((zid, route), []).append(ef)
+    routeEventFrequency = {}
+    for eid, zid, route, ef, cof in valid:
+        if route is None:
+            routeEventFrequency[(eid, zid)] = 0.0
+            continue
+        freqs = partitions[(zid, route)]
+        total, largest = sum(freqs), max(freqs)
+        routeEventFrequency[(eid, zid)] = (largest+(1-cof)*(total-largest))*ef/total if total else 0.0
+
+    #cmrV_ElementHazardZone, cmrV_ElementValueDamages and cmrV_ElementValueDamagesPivot
+    categoryColumns = [-1, 0, 1, 2, 3, 4, 5]
+    summaries = dict((level, {}) for level in ['element', 'route', 'processtype', 'hazardzone', 'study'])
+    cells = dict((level, {}) for level in summaries)
+    for eid, zid, route, ef, cof in valid:
+        e, z = elements[eid], zones[zid]
+        pt = processtypes[z['processtype_id']]
+        eventWidth = pt['event_width'] if pt['event_width'] is not None else (1.0/pt['frequency_size_factor'] if pt['frequency_size_factor'] else None)
+        impactSize = eventWidth if eventWidth is not None else e['element_size']
+        ref = routeEventFrequency[(eid, zid)]
+        groups = {'element': eid, 'route': route.rstrip() if route else None, 'processtype': pt['processtype_name']
+                  , 'hazardzone': zid, 'study': None}
+        for vt, valueMean in elementValues[elementtypes[e['elementtype_code'].rstrip().upper()]]:
+            V = damage.get((z['processtype_id'], vt['valuetype_id']))
+            if V is None:
+                continue
+            H = _mul(vt['use_route_event_frequency'], ref)
+            if H is None:
+                H = _mul(vt['use_element_event_frequency'], ef)
+            scaling = None
+            for alt in [_mul(vt['use_element_impact_size'], impactSize), _mul(vt['use_aadt_passenger'], e['aadt_passenger'], 1/24.0)
+                        , _mul(vt['use_aadt_goods'], e['aadt_goods'], 1/24.0), 1.0]:
+                if alt is not None:
+                    scaling = alt
+                    break
+            diversion = _mul(vt['use_diversion_time'], e['diversion_time'])
+            risk = _mul(H, valueMean*scaling*(1.0 if diversion is None else diversion), V)
+            cell = _round(risk if risk is not None else 0.0)
+            column = categoryColumns.index(vt['valuetype_category_id'])
+            for level, key in groups.items():
+                sums = summaries[level].setdefault(key, [0.0]*len(categoryColumns))
+                sums[column] += cell
+                cells[level][key] = cells[level].get(key, 0)+1
+    return summaries, cells
+
+def test_summariesMatchViews(syntheticStudy, syntheticEngine):
+    expected, cells = viewSummaries(syntheticStudy['rows'])
+    keyNames = {'element': 'element_feature_id', 'route': 'route_code', 'processtype': 'processtype_name'
+                , 'hazardzone': 'hazardzone_feature_id', 'study': None}
+    for level, keyName in keyNames.items():
+        keys, values = syntheticEngine.summaryArrays(level)
+        rowKeys = list(keys[keyName]) if keyName else [None]
+        assert sorted(rowKeys, key=str) == sorted(expected[level], key=str), level
+        #Every pivot cell is rounded, a cell that is a tie within float precision may round either way
+        for n, key in enumerate(rowKeys):
+            assert np.allclose(values[n], expected[level][key], rtol=1e-12, atol=1e-4*cells[level][key]+1e-6), (level, key)
+
+def test_riskAttributesPerFeature(syntheticEngine):
+    riskAttributes = cmrriskattributes(syntheticEngine)
+    keys, values = syntheticEngine.summaryArrays('element')
+    for fid, row in zip(keys['element_feature_id'], values.tolist()):
+        assert riskAttributes.elementValues(int(fid)) == row
+    keys, values = syntheticEngine.summaryArrays('route')
+    noValues = [None]*len(riskAttributes.names)
+    for code, row in zip(keys['route_code'], values.tolist()):
+        #Features without a route get NULL route values, trailing blanks are ignored
+        assert riskAttributes.routeValues(code + '  ' if code is not None else None) == (row if code is not None else noValues)
+    assert riskAttributes.elementValues(-1) == noValues
+    assert riskAttributes.routeValues('no such route') == noValues
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from cmr_export import cmrexporter, readManifest, readSummary, summaryLevels, hasArrow
+
+def test_npyRoundTrip(syntheticEngine, tmp_path):
+    messages = []
+    manifest = cmrexporter(str(tmp_path), formats=['npy'], msgFunc=messages.append).exportEngine(syntheticEngine)
+    assert readManifest(str(tmp_path)) == manifest
+    valueNames = [name for categoryId, name in syntheticEngine.summaryColumns]
+    for level, keyNames in summaryLevels:
+        keys, values = syntheticEngine.summaryArrays(level)
+        columns = readSummary(str(tmp_path), level)
+        assert isinstance(columns['study_id'], np.memmap)
+        assert manifest['levels'][level]['rows'] == len(values)
+        assert (columns['study_id'] == syntheticEngine.studyId).all()
+        for name in keyNames:
+            #Text keys are fixed width unicode with NULL as the empty string
+            expected = [u'' if v is None else v for v in np.asarray(keys[name]).tolist()]
+            assert columns[name].tolist() == expected
+        for n, name in enumerate(valueNames):
+            assert np.array_equal(columns[name], values[:, n])
+
+@pytest.mark.skipif(not hasArrow(), reason="pyarrow is not installed")
+def test_parquetRoundTrip(syntheticEngine, tmp_path):
+    cmrexporter(str(tmp_path), formats=['parquet']).exportEngine(syntheticEngine)
+    keys, values = syntheticEngine.summaryArrays('route')
+    columns = readSummary(str(tmp_path), 'route')
+    assert columns['route_code'].tolist() == list(keys['route_code'])
+    for n, (categoryId, name) in enumerate(syntheticEngine.summaryColumns):
+        assert np.allclose(columns[name], values[:, n], equal_nan=True)
+
+def test_parquetWithoutArrow(syntheticEngine, tmp_path):
+    if hasArrow():
+        pytest.skip("pyarrow is installed")
+    messages = []
+    manifest = cmrexporter(str(tmp_path), msgFunc=messages.append).exportEngine(syntheticEngine)
+    assert all('parquet' not in entry for entry in manifest['levels'].values())
+    assert messages[0] == "pyarrow is not installed, parquet files are not written"
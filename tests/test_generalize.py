@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+from cmr_geometry import lineLength
+from cmr_generalize import cmrgeneralizer, mergeLines, simplifyLine
+
+def _distance(point, line):
+    """Distance from a point to a polyline"""
+    best = None
+    for (x1, y1), (x2, y2) in zip(line[:-1], line[1:]):
+        dx, dy = x2-x1, y2-y1
+        t = 0.0 if dx == dy == 0 else max(0.0, min(1.0, ((point[0]-x1)*dx+(point[1]-y1)*dy)/float(dx*dx+dy*dy)))
+        d = math.hypot(point[0]-x1-t*dx, point[1]-y1-t*dy)
+        best = d if best is None else min(best, d)
+    return best
+
+def _wiggle(seed, n=200):
+    rnd = random.Random(seed)
+    return [(10.0*i, 20.0*math.sin(i/15.0)+rnd.uniform(-3, 3)) for i in range(n)]
+
+def test_simplifyLineKeepsEndsWithinTolerance():
+    coords = _wiggle(1)
+    for tolerance in [0.5, 5.0, 25.0, 1000.0]:
+        simplified = simplifyLine(coords, tolerance)
+        assert (simplified[0], simplified[-1]) == (coords[0], coords[-1])
+        assert all(c in coords for c in simplified)
+        assert max(_distance(c, simplified) for c in coords) <= tolerance
+    assert len(simplifyLine(coords, 1000.0)) == 2
+    assert simplifyLine([(0, 0), (1, 1)], 10.0) == [(0, 0), (1, 1)]
+
+def test_mergeLinesJoinsChainsEndToEnd():
+    coords = _wiggle(2, 61)
+    #A chain cut in four pieces, two of them reversed and given out of order
+    pieces = [coords[0:16], coords[15:31][::-1], coords[30:46], coords[45:61][::-1]]
+    lines = [pieces[2], pieces[0], pieces[3], pieces[1]]
+    merged = mergeLines(lines, 0.01)
+    assert len(merged) == 1
+    joined, members = merged[0]
+    assert sorted(members) == [0, 1, 2, 3]
+    assert set([joined[0], joined[-1]]) == set([coords[0], coords[-1]])
+    assert abs(lineLength(joined) - lineLength(coords)) < 1e-9
+    #Lines are not joined where a third line ends at the same point
+    star = [[(0.0, 0.0), (1.0, 0.0)], [(0.0, 0.0), (0.0, 1.0)], [(0.0, 0.0), (-1.0, 0.0)]]
+    assert [members for line, members in mergeLines(star, 0.01)] == [[0], [1], [2]]
+
+def test_generalizeKeepsLengthAndRisk():
+    coords = _wiggle(3, 401)
+    #Six neighbours on route E6 with the same risk, then four without a route and without risk
+    segments = [(n+1, [coords[40*n:40*n+41]], 'E6' if n < 6 else None, 2.5 if n < 6 else 0.0) for n in range(10)]
+    total = sum(lineLength(s[1][0]) for s in segments)
+    generalizer = cmrgeneralizer()
+    result = generalizer.generalize(segments)
+    for level, features in result.items():
+        assert abs(sum(f[4] for f in features) - total) < 1e-6
+        assert sum(f[3] for f in features) == 15.0
+        assert sum(f[5] for f in features) == len(segments)
+        assert generalizer.vertexCounts[level] <= generalizer.vertexCounts[0]
+    assert [f[6] for f in result[1]] == list(range(1, 11))
+    #The merged levels join the neighbours of the same route and risk class into one line
+    for level in [2, 3, 4]:
+        assert sorted((f[1] or '', f[2], f[5]) for f in result[level]) == [('', 0, 4), ('E6', 1, 6)]
+        for parts, route, cls, risk, length, nSegments, oid in result[level]:
+            ends = (coords[0], coords[240]) if route else (coords[240], coords[400])
+            assert set([parts[0][0], parts[0][-1]]) == set(ends)
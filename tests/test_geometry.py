@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from cmr_geometry import indexedGeometryBackend
+
+def test_segmentsAlongZoneBoundaryAreWithinBothZones():
+    #Two squares that share the edge x=10, the element runs along it and then leaves both
+    zones = [(1, [[(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]], {})
+             , (2, [[(10.0, 0.0), (20.0, 0.0), (20.0, 10.0), (10.0, 10.0), (10.0, 0.0)]], {})]
+    elements = [(1, [[(10.0, 2.0), (10.0, 8.0), (10.0, 14.0)]], {})]
+    backend = indexedGeometryBackend()
+    segments = backend.splitElements(elements, zones)
+    rows = backend.intersectElements(segments, zones)
+    assert len(segments) == 2
+    assert sorted((n, oid) for n, oid, length in rows) == [(0, 1), (0, 2)]
+    assert abs(rows[0][2]-8.0) < 1e-9
+
+def test_segmentWithinZone():
+    zones = [(5, [[(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]], {})]
+    elements = [(1, [[(-5.0, 5.0), (15.0, 5.0)]], {})]
+    backend = indexedGeometryBackend()
+    segments = backend.splitElements(elements, zones)
+    rows = backend.intersectElements(segments, zones)
+    assert [(segments[n][4], oid, length) for n, oid, length in rows] == [([(0.0, 5.0), (10.0, 5.0)], 5, 10.0)]
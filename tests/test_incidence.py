@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from cmr_incidence import cmrincidence
+
+def test_queriesMatchPairTable(syntheticEngine, tmp_path):
+    engine = syntheticEngine
+    built = cmrincidence.fromEngine(engine)
+    incidence = cmrincidence.load(built.save(str(tmp_path / 'incidence.npz')))
+    assert (incidence.routeCodes, incidence.parameterHash) == (built.routeCodes, engine.parameterHash)
+    keys, values = engine.summaryArrays('pair', rounded=False)
+    #The pair table as plain python: element and zone ids, route and risk of every intersection
+    pairs = []
+    for n, (e, z) in enumerate(zip(engine.pairElement, engine.pairZone)):
+        pairs.append((int(engine.elementIds[e]), int(engine.hazardzoneIds[z]), engine.routeCodes[engine.elementRoute[e]], values[n]))
+    elementRoutes = dict((int(engine.elementIds[e]), engine.routeCodes[r]) for e, r in enumerate(engine.elementRoute))
+    for elementId in list(elementRoutes)[::7]:
+        assert sorted(incidence.elementZones(elementId)) == sorted(z for e, z, r, v in pairs if e == elementId)
+    for zoneId in sorted(set(z for e, z, r, v in pairs)):
+        assert sorted(incidence.zoneElements(zoneId)) == sorted(e for e, z, r, v in pairs if z == zoneId)
+        assert sorted(incidence.zoneRoutes(zoneId), key=str) == sorted(set(r for e, z, r, v in pairs if z == zoneId), key=str)
+        elementIds, risk = incidence.zoneRisk(zoneId)
+        expected = dict((e, v) for e, z, r, v in pairs if z == zoneId)
+        for elementId, row in zip(elementIds, risk):
+            assert np.array_equal(row, expected[elementId])
+    for route in incidence.routeCodes:
+        assert sorted(incidence.routeElements(route)) == sorted(e for e, r in elementRoutes.items() if r == route)
+        routePairs = [(z, v) for e, z, r, v in pairs if r == route]
+        assert sorted(incidence.routeZones(route)) == sorted(set(z for z, v in routePairs))
+        zoneIds, sums = incidence.routeZoneRisk(route)
+        for zoneId, row in zip(zoneIds, sums):
+            assert np.allclose(row, np.sum([v for z, v in routePairs if z == zoneId], axis=0), equal_nan=True)
+    with pytest.raises(Exception):
+        incidence.zoneElements(-1)
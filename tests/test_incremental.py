@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from cmr_geometry import indexedGeometryBackend
+from cmr_incremental import cmrchangeset
+
+def _square(oid, xmin, ymin, xmax, ymax):
+    return (oid, [[(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)]], {'processtype_id': 3, 'event_frequency': 100})
+
+def _line(oid, x1, x2, y, aadt=1000):
+    return (oid, [[(float(x1), float(y)), (float(x2), float(y))]], {'elementtype_code': 'FV', 'aadt_passenger': aadt})
+
+def _run(previous, elements, zones):
+    """Changes since previous, the new segments with their object ids and the fingerprint rows stored by the run"""
+    changes = cmrchangeset(previous, elements, zones)
+    segments = indexedGeometryBackend().splitElements(elements, zones, changes.affectedElements)
+    oids, removedOids = changes.matchSegments(segments)
+    nextOid = max([row[1] for row in previous if row[0] == cmrchangeset.segmentType] + [0]) + 1
+    for n, oid in enumerate(oids):
+        if oid is None:
+            oids[n], nextOid = nextOid, nextOid+1
+    rows = [row[1:] for row in changes.fingerprintRows(7, segments, oids)]
+    #Fingerprints of the reset features are replaced, the others are kept
+    reset = set((row[1], row[2]) for row in changes.resetRows(7))
+    stored = [row for row in previous if (row[0], row[1]) not in reset] + rows
+    return changes, segments, oids, removedOids, stored
+
+def test_changesAndAffectedElements():
+    zones = [_square(1, 0, 0, 10, 10), _square(2, 20, 0, 30, 10), _square(3, 50, 0, 60, 10), _square(5, 100, 0, 110, 10)]
+    elements = [_line(1, -5, 15, 5), _line(2, 18, 32, 5), _line(3, 48, 62, 5), _line(4, -5, 15, 50)
+                , _line(5, 70, 80, 5), _line(7, 98, 112, 5)]
+    first, segments, oids, removedOids, previous = _run([], elements, zones)
+    assert first.addedElements == set([1, 2, 3, 4, 5, 7]) and first.addedZones == set([1, 2, 3, 5])
+    assert (len(segments), removedOids) == (14, [])
+
+    #Zone 2 grows upwards (the cuts of element 2 stay), zone 3 is removed and zone 4 is added across element 4.
+    #Element 1 gets new attributes, element 5 is removed and element 6 is added
+    zones = [_square(1, 0, 0, 10, 10), _square(2, 20, 0, 30, 12), _square(4, 0, 45, 10, 55), _square(5, 100, 0, 110, 10)]
+    elements = [_line(1, -5, 15, 5, aadt=2000), _line(2, 18, 32, 5), _line(3, 48, 62, 5), _line(4, -5, 15, 50)
+                , _line(6, 200, 210, 5), _line(7, 98, 112, 5)]
+    changes, segments, oids, removedOids, stored = _run(previous, elements, zones)
+    assert (changes.addedElements, changes.changedElements, changes.removedElements) == (set([6]), set([1]), set([5]))
+    assert (changes.addedZones, changes.changedZones, changes.removedZones) == (set([4]), set([2]), set([3]))
+    #Elements near the new and previous extents of added, changed and removed zones are split again, element 7 is not
+    assert changes.affectedElements == set([1, 2, 3, 4, 6])
+    assert not changes.isEmpty()
+
+    #The segments of element 2 are unchanged, so they keep their object ids
+    oldOids = dict((row[1], row[2]) for row in previous if row[0] == cmrchangeset.segmentType)
+    bySource = {}
+    for segment, oid in zip(segments, oids):
+        bySource.setdefault(segment[0], []).append(oid)
+    assert sorted(bySource[2]) == sorted(oid for oid, source in oldOids.items() if source == 2)
+    for source in [1, 3, 4, 6]:
+        assert not set(bySource[source]) & set(oldOids)
+    #The previous segments of the changed, split again and removed elements are gone, element 7 is untouched
+    assert removedOids == sorted(oid for oid, source in oldOids.items() if source in (1, 3, 4, 5))
+    assert [row for row in changes.resetRows(7) if row[1] == cmrchangeset.segmentType] == \
+        [(7, cmrchangeset.segmentType, oid) for oid in sorted(oid for oid, source in oldOids.items() if source != 7)]
+
+    #Nothing has changed the next time
+    again = cmrchangeset(stored, elements, zones)
+    assert again.isEmpty() and again.affectedElements == set()
+
+def test_matchSegmentsWithDuplicateFingerprints():
+    changes = cmrchangeset([], [_line(1, 0, 10, 0)], [])
+    a = (1, 0, 0.0, 1.0, [(0.0, 0.0), (5.0, 0.0)], {'elementtype_code': 'FV'})
+    b = (1, 0, 1.0, 2.0, [(5.0, 0.0), (10.0, 0.0)], {'elementtype_code': 'FV'})
+    fpA, fpB = changes.segmentFingerprint(a), changes.segmentFingerprint(b)
+    previous = [('S', 12, 1, fpA, None, None, None, None), ('S', 13, 1, fpB, None, None, None, None)
+                , ('S', 11, 1, fpA, None, None, None, None)]
+    changes = cmrchangeset(previous, [_line(1, 0, 10, 0)], [])
+    #Identical segments get the previous object ids in ascending order
+    assert changes.matchSegments([a, b, a]) == ([11, 13, 12], [])
+    assert changes.matchSegments([b, a]) == ([13, 11], [12])
+    assert changes.matchSegments([a, a, a]) == ([11, 12, None], [13])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from cmr_instrument import cmrinstrument
+
+class _connection:
+    def __init__(self):
+        self.statements = []
+    def execute(self, strSQL):
+        self.statements.append(strSQL)
+        return 1
+
+def test_spansAndDatabaseCalls(tmp_path):
+    messages = []
+    instrument = cmrinstrument(messages.append)
+    instrument.start(study_id=7, geometry_backend='indexedGeometryBackend')
+    conn = instrument.connection(_connection())
+    assert instrument.connection(conn) is conn
+    conn.execute("SELECT 1")
+    with instrument.span('split') as span:
+        span.rows = 10
+        span.set('segments', 12)
+        with instrument.span('index'):
+            conn.execute("SELECT 2")
+        conn.execute("SELECT 3")
+        conn.execute("SELECT 4")
+    with pytest.raises(ValueError):
+        with instrument.span('import'):
+            raise ValueError('bad row')
+    instrument.finish('failed', 'bad row')
+
+    report = json.load(open(instrument.writeReport(str(tmp_path / 'run.json'))))
+    assert (report['status'], report['error'], report['metadata']['study_id']) == ('failed', 'bad row', 7)
+    #Spans are reported when they end, calls go to the innermost active span
+    spans = dict((s['name'], s) for s in report['spans'])
+    assert [s['name'] for s in report['spans']] == ['index', 'split', 'import']
+    assert (spans['index']['db_calls'], spans['split']['db_calls'], report['db_calls']) == (1, 2, 3)
+    assert report['metadata']['db_calls_outside_spans'] == 1
+    assert (spans['split']['rows'], spans['split']['attributes']) == (10, {'segments': 12})
+    assert spans['import']['error'] == 'ValueError: bad row'
+    assert len(messages) == 3 and '10 rows, 2 database calls' in messages[1]
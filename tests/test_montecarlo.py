@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_montecarlo import cmrmontecarlo, frequencyFactor, frequencyFactorNorm
+
+def test_frequencyFactorHasMeanOne():
+    sigmaUp, sigmaDown = np.array([0.0, 0.4, 0.7]), np.array([0.0, 0.7, 0.2])
+    factor = frequencyFactor(np.random.RandomState(1), sigmaUp, sigmaDown, frequencyFactorNorm(sigmaUp, sigmaDown), (200000, 3))
+    assert np.allclose(factor.mean(axis=0), 1.0, atol=0.01)
+
+def test_meanLossEqualsExpectedLoss(syntheticEngine):
+    mc = cmrmontecarlo(syntheticEngine, timeframe=50, seed=5)
+    nSamples = 2000
+    result = mc.run(nSamples)
+    standardError = result['study'].std(axis=0)/np.sqrt(nSamples)
+    assert (np.abs(result['studyMean']-result['studyExpected']) < 4*standardError).all()
+
+def test_propertiesApplyToTheNextRun(syntheticEngine):
+    mc = cmrmontecarlo(syntheticEngine, timeframe=50, seed=5)
+    mc.samplesPerChunk = 100
+    sampled = mc.run(300)
+    mc.sampleValueErrors = mc.sampleFrequencyErrors = False
+    mc.histogramBins = 20
+    mc.valuesPerChunk = 20000
+    fixed = mc.run(300)
+    assert not np.array_equal(sampled['study'], fixed['study'])
+    assert np.array_equal(fixed['study'], mc.run(300, workers=2)['study'])
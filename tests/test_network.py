@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from cmr_network import cmrroadnetwork
+
+def _elements(spurs):
+    """A straight route of ten 1 km elements and a 12 km alternative between its ends, optionally with
+roads continuing from both ends (so the ends are junctions instead of a closed loop)"""
+    elements = [(n+1, [[(n*1000.0, 0.0), ((n+1)*1000.0, 0.0)]], {'elementtype_code': 'FV', 'route_code': 'R1'}) for n in range(10)]
+    elements.append((11, [[(0.0, 0.0), (0.0, 1000.0), (10000.0, 1000.0), (10000.0, 0.0)]], {'elementtype_code': 'FV', 'route_code': 'R2'}))
+    if spurs:
+        elements.append((12, [[(-1000.0, 0.0), (0.0, 0.0)]], {'elementtype_code': 'FV', 'route_code': 'R0'}))
+        elements.append((13, [[(10000.0, 0.0), (11000.0, 0.0)]], {'elementtype_code': 'FV', 'route_code': 'R3'}))
+    return elements
+
+@pytest.mark.parametrize('spurs', [False, True])
+def test_diversionIsExtraTimeBetweenRouteEnds(spurs):
+    network = cmrroadnetwork.fromElements(_elements(spurs))
+    #At 60 km/h the 12 km alternative takes 1/30 h longer than the 10 km route, closing the alternative costs nothing
+    times = network.diversionTimes('element')
+    assert all(times[oid] == pytest.approx(2.0/60, abs=1e-4) for oid in range(1, 11))
+    assert times[11] == 0.0
+    assert network.routeDiversionTimes() == {'R1': pytest.approx(0.0333, abs=1e-9), 'R2': 0.0}
+    #The roads continuing from the ends have no detour
+    assert np.isnan(network.edgeDiversionTimes()[network.edgeElement >= 12]).all()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import copy
+import random
+from cmr_params import cmrparameterpack
+from cmr_synthetic import defaultParameterTables
+
+def test_packHashIgnoresRowOrder(tmp_path):
+    tables = defaultParameterTables()
+    pack = cmrparameterpack.fromTables(tables)
+    shuffled = copy.deepcopy(tables)
+    rnd = random.Random(5)
+    for rows in shuffled.values():
+        rnd.shuffle(rows)
+    reordered = cmrparameterpack.fromTables(shuffled)
+    assert list(reordered.processtypeIds) != list(pack.processtypeIds) or list(reordered.valuetypeIds) != list(pack.valuetypeIds)
+    assert reordered.hash == pack.hash
+    assert cmrparameterpack.load(pack.save(str(tmp_path / 'pack.npz'))).hash == pack.hash
+
+def test_packHashChangesOnParameterEdit():
+    tables = defaultParameterTables()
+    pack = cmrparameterpack.fromTables(tables)
+    hashes = set([pack.hash])
+    for table, column in [('processtype', 4), ('elementvalue', 2), ('damagefunction', 3)]:
+        edited = copy.deepcopy(tables)
+        edited[table][0][column] = float(edited[table][0][column])*1.5+0.01
+        hashes.add(cmrparameterpack.fromTables(edited).hash)
+    assert len(hashes) == 4
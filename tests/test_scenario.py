@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_engine import cmrengine
+from cmr_scenario import cmrscenario
+
+def _recompute(syntheticStudy, zoneId, zoneFrequency, elementId, aadtPassenger, damageProb, valueMean):
+    """An engine of the study with the scenario changes applied to the import rows and parameter tables"""
+    rows = []
+    for row in syntheticStudy['rows']:
+        row = dict(row)
+        if row['hazardzone_feature_id'] == zoneId:
+            row['event_frequency'] = zoneFrequency
+        if row['element_feature_id'] == elementId:
+            row['aadt_passenger'] = aadtPassenger
+        rows.append(row)
+    tables = dict((name, [list(r) for r in table]) for name, table in syntheticStudy['parameterTables'].items())
+    for r in tables['damagefunction']:
+        if r[0] == 3 and r[1] == 1:
+            r[2] = damageProb
+    for r in tables['elementvalue']:
+        if r[0] == 130 and r[1] == 1:
+            r[2] = valueMean
+    return cmrengine.fromImportRows(syntheticStudy['studyId'], rows, tables)
+
+def test_deltaEqualsFullRecompute(syntheticStudy, syntheticEngine):
+    e = syntheticEngine
+    #The zone with the most pairs and an element of another zone
+    zoneId = int(e.hazardzoneIds[np.bincount(e.pairZone).argmax()])
+    elementId = int(e.elementIds[e.pairElement[np.nonzero(e.hazardzoneIds[e.pairZone] != zoneId)[0][0]]])
+    scenario = {'hazardzone': {zoneId: {'event_frequency': 7}}
+                , 'element': {elementId: {'aadt_passenger': 25000}}
+                , 'parameters': {('damage_prob', 3, 1): 0.3, ('value_mean', 130, 1): 15000}}
+    result = cmrscenario(e).evaluate(scenario)
+    full = _recompute(syntheticStudy, zoneId, 7, elementId, 25000, 0.3, 15000)
+
+    assert result['pairs'] > 0 and np.abs(result['study']['delta']).sum() > 0
+    keys, values = full.summaryArrays('study', rounded=False)
+    assert np.allclose(result['study']['scenario'], values, rtol=1e-12, atol=1e-4)
+    keys, values = full.summaryArrays('route', rounded=False)
+    assert list(keys['route_code']) == list(result['route']['keys']['route_code'])
+    assert np.allclose(result['route']['scenario'], values, rtol=1e-12, atol=1e-4)
+    keys, values = full.summaryArrays('element', rounded=False)
+    rows = dict((int(fid), n) for n, fid in enumerate(keys['element_feature_id']))
+    changed = [rows[int(fid)] for fid in result['element']['keys']['element_feature_id']]
+    assert elementId in [int(fid) for fid in result['element']['keys']['element_feature_id']]
+    assert np.allclose(result['element']['scenario'], values[changed], rtol=1e-12, atol=1e-4)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from cmr_params import cmrparameterpack
+from cmr_stream import cmrstream, importRowSource, readElements
+
+class _interrupted(Exception):
+    pass
+
+def _interruptAfter(source, nChunks):
+    """A chunk source that fails after nChunks chunks"""
+    def chunks(after=None):
+        for n, chunk in enumerate(source(after)):
+            if n == nChunks:
+                raise _interrupted()
+            yield chunk
+    return chunks
+
+def test_resumedRunEqualsFullRun(syntheticStudy, syntheticEngine, tmp_path):
+    studyId = syntheticStudy['studyId']
+    rows = sorted(syntheticStudy['rows'], key=lambda r: (r['element_feature_id'], r['hazardzone_feature_id']))
+    pack = cmrparameterpack.fromTables(syntheticStudy['parameterTables'])
+    source = importRowSource(rows, pack, 50, ordered=True)
+    full = cmrstream(studyId, pack, str(tmp_path / 'full')).run(source)
+    with pytest.raises(_interrupted):
+        cmrstream(studyId, pack, str(tmp_path / 'resumed')).run(_interruptAfter(source, 5))
+    messages = []
+    resumed = cmrstream(studyId, pack, str(tmp_path / 'resumed'), messages.append).run(source)
+    assert messages[0].startswith("Resuming study {0} after 5 chunks".format(studyId))
+
+    assert resumed['route'][0] == full['route'][0]
+    assert np.array_equal(resumed['route'][1], full['route'][1])
+    assert np.array_equal(resumed['study'][1], full['study'][1])
+    fullKeys, fullValues = readElements(str(tmp_path / 'full'))
+    keys, values = readElements(str(tmp_path / 'resumed'))
+    assert np.array_equal(keys['element_feature_id'], fullKeys['element_feature_id'])
+    assert np.array_equal(values, fullValues)
+    #The streamed summaries are those of the engine (on the whole study)
+    engineKeys, engineValues = syntheticEngine.summaryArrays('element')
+    assert np.array_equal(keys['element_feature_id'], engineKeys['element_feature_id'])
+    assert np.allclose(values, engineValues, rtol=0, atol=1e-9)
+    engineKeys, engineValues = syntheticEngine.summaryArrays('route')
+    assert list(engineKeys['route_code']) == full['route'][0]['route_code']
+    assert np.allclose(full['route'][1], engineValues, rtol=0, atol=1e-9)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import itertools
+import math
+import numpy as np
+from cmr_summary import cmrsummarycube, summaryFlags
+
+def _sum(values):
+    """SUM of sql server, NULL terms are ignored and the sum of only NULLs is NULL"""
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+def _mul(*values):
+    """Product where NULL (None) propagates"""
+    result = 1.0
+    for v in values:
+        if v is None:
+            return None
+        result *= v
+    return result
+
+def _value(x):
+    return None if x is None or np.isnan(x) else float(x)
+
+def viewRows(engine):
+    """The rows of cmrV_ElementValueDamages for the study of the engine"""
+    rows = engine.elementValueDamages()
+    views = []
+    for n, pair in enumerate(rows['pair']):
+        element, zone, vt = engine.pairElement[pair], engine.pairZone[pair], rows['valuetype'][n]
+        row = dict((name, _value(rows[name][n])) for name in ['H', 'E', 'V', 'E_PosErr', 'E_NegErr', 'V_PosErr', 'V_NegErr'])
+        row.update(hazardzone_feature_id=int(engine.hazardzoneFeatureIds[zone])
+                   , elementtype_code=engine.elementtypeCodes[engine.elementElementtype[element]]
+                   , route_code=engine.routeCodes[engine.elementRoute[element]]
+                   , processtype_name=engine.processtypeNames[engine.hazardzoneProcesstype[zone]]
+                   , valuetype_id=int(engine.valuetypeIds[vt]), valuetype_name=engine.valuetypeNames[vt]
+                   , valuetype_category_id=int(engine.valuetypeCategoryIds[vt]), valuetype_category_name=engine.valuetypeCategoryNames[vt])
+        views.append(row)
+    return views
+
+def procedureRows(views, timeframe, flags):
+    """Row by row transcription of cmrSP_resultSummary"""
+    #errorCTE
+    groups = {}
+    for row in views:
+        key = (row['valuetype_category_id'], row['valuetype_category_name']
+               , row['hazardzone_feature_id'] if flags['hazardzone'] else None
+               , row['elementtype_code'] if flags['elementtype'] else None
+               , row['route_code'] if flags['route'] else None
+               , row['processtype_name'], row['valuetype_id'], row['valuetype_name'])
+        groups.setdefault(key, []).append(row)
+    inner = {}
+    for key, group in groups.items():
+        H = _sum([r['H'] for r in group])
+        risk = _sum([_mul(r['H'], r['E'], r['V']) for r in group])
+        g = {'n': len(group), 'annual_frequency': H, 'timeframe_frequency': _mul(H, timeframe), 'risk': risk}
+        for err in ['PosErr', 'NegErr']:
+            eSum = _sum([_mul(r['H'], r['E_'+err], r['V'])**2 if _mul(r['H'], r['E_'+err], r['V']) is not None else None for r in group])
+            vSum = _sum([_mul(r['H'], r['E'], r['V_'+err]) for r in group])
+            g['E_'+err] = 0.0 if risk == 0 else (math.sqrt(eSum) if eSum is not None else None)
+            g['V_'+err] = 0.0 if risk == 0 else (math.sqrt(H*timeframe*vSum**2)/(100*H) if None not in (H, vSum) else None)
+        inner[key] = g
+    #Outer grouping
+    outer = {}
+    for key, g in inner.items():
+        (categoryId, categoryName, zone, elementtype, route, processtype, valuetypeId, valuetype) = key
+        outerKey = (zone, categoryId, categoryName, elementtype, route
+                    , processtype if flags['processtype'] else None, valuetype if flags['valuetype'] else None)
+        outer.setdefault(outerKey, []).append(g)
+    result = {}
+    for key, group in outer.items():
+        row = dict((name, _sum([g[name] for g in group])) for name in ['n', 'annual_frequency', 'timeframe_frequency', 'risk'])
+        for name in ['E_PosErr', 'E_NegErr', 'V_PosErr', 'V_NegErr']:
+            squares = _sum([g[name]**2 if g[name] is not None else None for g in group])
+            row[name] = math.sqrt(squares) if squares is not None else None
+        result[key] = row
+    return result
+
+def test_cubeMatchesProcedure(syntheticEngine):
+    timeframe = 50
+    cube = cmrsummarycube(syntheticEngine, timeframe)
+    views = viewRows(syntheticEngine)
+    values = ['n', 'annual_frequency', 'timeframe_frequency', 'risk', 'E_PosErr', 'E_NegErr', 'V_PosErr', 'V_NegErr']
+    for combination in itertools.product([False, True], repeat=len(summaryFlags)):
+        flags = dict(zip(summaryFlags, combination))
+        expected = procedureRows(views, timeframe, flags)
+        rows = cube.rows(**flags)
+        assert len(rows) == len(expected), flags
+        for row in rows:
+            key = (row[2], row[3], row[4], row[5], row[6], row[7], row[8])
+            assert key in expected, (flags, key)
+            #The cube gives 0 where the procedure sums only NULL terms
+            want = [0.0 if expected[key][name] is None else expected[key][name] for name in values]
+            assert np.allclose(row[9:], want, rtol=1e-9, atol=1e-9), (flags, key)
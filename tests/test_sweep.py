@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_sweep import cmrsweep
+
+def test_constantOutputsHaveNoSensitivity(syntheticEngine):
+    sweep = cmrsweep(syntheticEngine)
+    sets = sweep.sample(200, seed=1)
+    study = sweep.evaluate(sets)['study']
+    src, r2 = sweep.sensitivity(sets, study)
+    #The event frequencies do not depend on damage functions or element values
+    for column in ['EventFrequency', 'RouteEventFrequency']:
+        n = sweep.columns.index(column)
+        assert r2[n] == 0.0 and not src[:, n].any(), column
+    n = sweep.columns.index('ClosureCosts')
+    assert r2[n] > 0.9
+    assert np.allclose(sweep.sensitivity(sets, np.ones(len(sets)))[1], 0.0)
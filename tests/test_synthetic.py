@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_synthetic import cmrsynthetic
+
+def test_partialBlockHasZonesNearItsElements():
+    synthetic = cmrsynthetic(450, seed=1)
+    full, partial = synthetic.blockZones(0), synthetic.blockZones(1)
+    assert len(full) == synthetic.zonesPerBlock
+    assert len(partial) == int(round(50*synthetic.zonesPerElement))
+    oids = [oid for oid, rings, attrs in synthetic.zones()]
+    assert len(set(oids)) == len(oids)
+    vertices = np.array([p for oid, parts, attrs in synthetic.blockElements(1) for p in parts[0]])
+    for oid, rings, attrs in partial:
+        center = np.mean(rings[0][:-1], axis=0)
+        assert np.sqrt(((vertices-center)**2).sum(axis=1)).min() < 4*synthetic.zoneRadius[1]
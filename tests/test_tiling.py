@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import pytest
+from cmr_geometry import indexedGeometryBackend
+from cmr_synthetic import cmrsynthetic
+from cmr_tiling import cmrtiler
+
+@pytest.mark.parametrize('splitAtElementCrossings', [True, False])
+def test_tiledRunEqualsSinglePass(splitAtElementCrossings):
+    synthetic = cmrsynthetic(600, seed=3)
+    elements, zones = synthetic.elements(), synthetic.zones()
+    backend = indexedGeometryBackend(splitAtElementCrossings)
+    segments = backend.splitElements(elements, zones)
+    rows = backend.intersectElements(segments, zones)
+    for tileSize, workers in [(500, 1), (1700, 1), (5000, 2), (50000, 1)]:
+        tiler = cmrtiler(indexedGeometryBackend(splitAtElementCrossings), tileSize, workers)
+        tiledSegments, tiledRows = tiler.run(elements, zones)
+        assert tiledSegments == segments
+        #The rows are in the same order, not only the same set
+        assert tiledRows == rows
+    assert tiler.nTiles == 1
@@ -4,6 +4,8 @@ import arcpy
 from arcpy import env
 import os, sys
 import tempfile
+import time
+from cmr_instrument import cmrinstrument
 
 class cmrstudy:
     """Class for CICERO Multirisk tool
@@ -21,6 +23,52 @@ Runs the geoprocessing necessary to generate an element hazard intersection tabl
 The intersection table is then imported to the cmr database so that risk analysis can be performed.
 It also creates an output feature layer showing the original elements (but with its features split at each zone-boundary)
 The OID of the output layer can be used to join individual features to cmr risk measures
+Set geometryBackend (e.g. cmr_geometry.indexedGeometryBackend()) to split and intersect in-process with spatial indexes
+With bulkLoad (default) the intersection rows are streamed in batches straight into the import table
+With incremental (requires a geometryBackend) only elements and zones that changed since the last run are reprocessed,
+unchanged segments keep their OID in the output layer
+With tileSize (requires a geometryBackend) the extent is split into tiles that are processed in parallel worker processes,
+the output layer and intersections are identical to a single pass
+With diversionTimes (requires a geometryBackend) diversion_time is computed from detours in the element network (see cmr_network)
+Every stage is recorded as a span in instrument (wall and cpu time, rows, database round trips and memory)
+and a json run report is written next to the output geodatabase
+
+writeRunReport(filename=None)
+Writes the run report of the last hazardElementIntersection (with spans added later, e.g. for summary layers)
+
+writeRiskAttributes(featureClass=None)
+Writes the element and route summaries into fields of the output features in one update pass,
+so layers can show the risk without joins to the cmr database (the values are a snapshot of the last run)
+With riskAttributes this is done at the end of hazardElementIntersection
+
+streamSummaries(directory=None, chunkSize=None, resume=True)
+Evaluates the element, route and study summaries chunk by chunk in bounded memory (see cmr_stream), with checkpoints
+so an interrupted run continues where it stopped
+
+buildIncidence(filename=None)
+Builds the sparse element by hazard zone incidence of the study with the risk of every intersection (see cmr_incidence),
+saves it and returns it
+
+scenarios()
+Returns a cmrscenario (cmr_scenario) for the study, which evaluates what-if changes of hazard zone frequencies,
+element traffic and model parameters as deltas to the current results
+
+exportSummaries(directory=None)
+Writes the element, route, hazard zone, process type and study summaries to a columnar export (see cmr_export)
+With exportResults this is done at the end of hazardElementIntersection
+
+writeGeneralizedOutput(featureClass=None)
+Writes simplified copies of the output features for overview scales (ear<study_id>_gen<level> in the output geodatabase),
+at the coarser levels adjacent segments of the same route and risk class are merged (see cmr_generalize)
+With generalizedOutput this is done at the end of hazardElementIntersection
+
+getRiskEngine()
+Returns a cmrengine with the study loaded, the engine computes the same summaries as the cmrV_*Summary views in-process
+With parameterPack set the engine uses the compiled parameters instead of selecting the parameter tables
+
+resultSummary(timeframe=1, route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False, refresh=False)
+Returns the rows of cmrSP_resultSummary from a cached summary cube (cmr_summary), all combinations of the flags
+are computed together so changing the flags does not reload or recompute the study
     """
     ########################################
     ###        PRIVATE PROPERTIES        ###
@@ -30,31 +78,58 @@ The OID of the output layer can be used to join individual features to cmr risk
     __sdeConn = False
     #Filename pattern for output ear features
     __earOutputFilename = "{0}\\ear{1}_feat"
+    #Filename pattern for generalized output features (output gdb, study id, level)
+    __generalizedOutputFilename = "{0}\\ear{1}_gen{2}"
 
-    __cmrRequiredSPs = ["cmrSP_setStudyArea","cmrSP_defineInputData","cmrSP_importResults"]
+    __cmrRequiredSPs = ["cmrSP_setStudyArea","cmrSP_defineInputData","cmrSP_importResults","cmrSP_upsertResults"]
 
     __sqlExecInitiateStudy = """EXECUTE [cmrSP_setStudyArea] @study_id={0}
                                 , @study_name='{1}'
                                 , @hazardzone_dataset_filepath='{2}'
                                 , @element_dataset_filepath='{3}'
                                 , @study_description='{4}'
+                                , @reset={5}
                                 """
     __sqlExecImportResults = """EXECUTE [cmrSP_importResults] @study_id={0}"""
+    __sqlExecUpsertResults = """EXECUTE [cmrSP_upsertResults] @study_id={0}"""
+    __sqlSelectFingerprints = """SELECT feature_type, feature_id, source_feature_id, fingerprint, xmin, ymin, xmax, ymax
+                                FROM cmrT_FeatureFingerprint WHERE study_id={0}"""
+    __sqlCountFingerprints = """SELECT COUNT(*) FROM cmrT_FeatureFingerprint WHERE study_id={0} AND feature_type='S'"""
 
     #Table name for the import table in cmr database
     __cmrImportTable = "cmrT_ImportIntersectionTable"
+    __cmrImportTableName = "cmrT_ImportIntersectionTable"
+    #Fields and field types of the import table in cmr database
+    __cmrImportFields = [('study_id', 'LONG', None)
+                         , ('element_feature_id', 'LONG', None)
+                         , ('elementtype_code', 'TEXT', 10)
+                         , ('route_code', 'TEXT', 10)
+                         , ('aadt_passenger', 'LONG', None)
+                         , ('aadt_goods', 'LONG', None)
+                         , ('diversion_time', 'DOUBLE', None)
+                         , ('hazardzone_feature_id', 'LONG', None)
+                         , ('processtype_id', 'LONG', None)
+                         , ('event_frequency', 'LONG', None)
+                         , ('freq_interval_plus', 'LONG', None)
+                         , ('freq_interval_minus', 'LONG', None)
+                         , ('element_size', 'DOUBLE', None)]
+    #Element and zone attributes (cmrImportFieldMapping keys) that are carried through the geometry backend
+    __elementKeys = ['elementtype_code', 'route_code', 'aadt_passenger', 'aadt_goods', 'diversion_time']
+    __zoneKeys = ['processtype_id', 'event_frequency', 'freq_interval_plus', 'freq_interval_minus']
+    #Mapping from arcpy field types to AddField types
+    __fieldTypes = {'String': 'TEXT', 'Integer': 'LONG', 'SmallInteger': 'SHORT', 'Double': 'DOUBLE', 'Single': 'FLOAT', 'Date': 'DATE'}
     __oldWS = None
-
-    #Lists for storing temporary data
-    __tmpgisfiles = []
-    __tmpws = []
-    __tmpdirs = []
+    #True if the study was initiated without reset and the results are updated incrementally
+    __incrementalRun = False
+    #Engine used by resultSummary, reloaded after each run
+    __summaryEngine = None
 
 
     #######################################
     ###        PUBLIC PROPERTIES        ###
     #######################################
     #Mapping between cmrImportTable fields (keys) and input dataset fields
+    #This is the default mapping, each instance gets its own copy that can be modified
     cmrImportFieldMapping = {'element_feature_id': 'FID_element'
                              , 'hazardzone_feature_id': 'FID_zone'
                              , 'study_id': 'study_id'
@@ -73,6 +148,67 @@ The OID of the output layer can be used to join individual features to cmr risk
     #Output feature
     outputFeatures = None
 
+    #Geometry backend for splitting and intersection (e.g. cmr_geometry.indexedGeometryBackend)
+    #If None the ArcGIS geoprocessing tools FeatureToLine and Intersect are used
+    geometryBackend = None
+
+    #Stream intersection rows straight into the import table in batches
+    #If False the rows are copied to a temporary table and appended with Append_management
+    bulkLoad = True
+    #Lock (e.g. a multiprocessing.Lock shared by the workers of cmr_batch) held while rows are bulk loaded,
+    #so studies running in parallel load the import table one at a time
+    importLock = None
+
+    #Only reprocess elements and zones that changed since the last run of the study (requires a geometryBackend)
+    #The first run of a study in incremental mode is a full run that stores fingerprints of all features
+    incremental = False
+
+    #Split and intersect in square tiles of this size (in map units) in parallel worker processes (requires a geometryBackend)
+    tileSize = None
+    #Number of worker processes for the tiles (None uses all cpus)
+    tileWorkers = None
+
+    #Compute diversion_time from the fastest detours in the element network (requires a geometryBackend)
+    #'route' gives every element on a route the same value, 'element' one value per element, None keeps the input field
+    diversionTimes = None
+    #Travel speeds (km/h) per element type code for the diversion times (cmr_network.defaultSpeeds for the others)
+    diversionSpeeds = None
+
+    #Write a json run report (cmr_run_<study_id>_<timestamp>.json) next to the output geodatabase
+    runReport = True
+    #The run report of the last run
+    runReportFile = None
+    #Count the rows of the intermediate datasets for the run report (requires an extra pass with GetCount)
+    countRows = True
+
+    #Compiled parameter pack (cmr_params.cmrparameterpack) used by getRiskEngine instead of selecting the parameter tables
+    parameterPack = None
+
+    #Write the element and route summaries into fields of the output features (see writeRiskAttributes)
+    riskAttributes = False
+    #Field names of the risk attributes, formatted with the summary column name
+    riskAttributeFields = {'element': "{0}", 'route': "Route_{0}"}
+
+    #Number of intersections per chunk in streamSummaries
+    streamChunkSize = 100000
+
+    #Write the summaries to a columnar export (cmr_export_<study_id> next to the output geodatabase) after the import
+    exportResults = False
+    #Formats of the export (npy files can be memory-mapped, parquet requires pyarrow)
+    exportFormats = ['npy', 'parquet']
+    #Directory of the last export
+    exportDirectory = None
+
+    #Write generalized copies of the output features for overview scales (see writeGeneralizedOutput)
+    generalizedOutput = False
+    #Levels as (tolerance in map units, merge adjacent segments), None uses cmr_generalize.cmrgeneralizer.levels
+    generalizeLevels = None
+    #Element summary column that is classified, and the class breaks (None gives quantile classes)
+    generalizeColumn = 'ClosureCosts'
+    generalizeBreaks = None
+    #The generalized feature classes of the last run by level
+    generalizedFeatures = None
+
     #Element hazard intersections shorter than this will be ignored
     minimum_element_size = 1
     #The environment setting for extent that will be used in geoprocessing
@@ -82,8 +218,15 @@ The OID of the output layer can be used to join individual features to cmr risk
     ###          PRIVATE METHODS         ###
     ########################################
     def __init__(self, sdeConnFile, outputGDB):
+        #Each instance has its own field mapping and lists for storing temporary data
+        self.cmrImportFieldMapping = dict(cmrstudy.cmrImportFieldMapping)
+        self.__tmpgisfiles = []
+        self.__tmpws = []
+        self.__tmpdirs = []
+        #Spans of each run, database round trips are recorded through the wrapped connection
+        self.instrument = cmrinstrument(msgFunc=self.__showMsg)
         #Create the sde connection
-        self.__sdeConn = self.__sdeSqlConnect(sdeConnFile)
+        self.__sdeConn = self.instrument.connection(self.__sdeSqlConnect(sdeConnFile))
         if self.__sdeConn:
             #Define path to cmrImportTable
             self.__cmrImportTable = r"{0}\{1}".format(sdeConnFile, self.__cmrImportTable)
@@ -137,12 +280,428 @@ The OID of the output layer can be used to join individual features to cmr risk
         return sdeReturn
 
     
+    def __countRows(self, dataset):
+        """Number of rows in a dataset for the run report, None if countRows is off"""
+        if not self.countRows:
+            return None
+        return int(arcpy.GetCount_management(dataset).getOutput(0))
+
+    def __findFields(self, dataset, keys):
+        """Returns a dict with the cmrImportFieldMapping keys that exist in the dataset and the matching field objects"""
+        fields = dict((f.name.lower(), f) for f in arcpy.ListFields(dataset))
+        found = {}
+        for key in keys:
+            fld = fields.get(self.cmrImportFieldMapping[key].lower())
+            if fld is not None:
+                found[key] = fld
+        return found
+
+    def __outputRouteField(self, featureClass):
+        """The route field (arcpy Field) of the output features or None. The ear layer has the route field of the
+input dataset (or route_code if written by a geometry backend)"""
+        fields = dict((f.name.lower(), f) for f in arcpy.ListFields(featureClass))
+        return fields.get(self.cmrImportFieldMapping['route_code'].lower(), fields.get('route_code'))
+
+    def __readFeatures(self, dataset, fieldDict):
+        """Read features as (oid, parts, attributes) for the geometry backend, attributes are keyed by cmrImportFieldMapping keys"""
+        keys = list(fieldDict.keys())
+        features = []
+        with arcpy.da.SearchCursor(dataset, ["OID@", "SHAPE@"] + [fieldDict[k].name for k in keys]) as cursor:
+            for row in cursor:
+                parts = []
+                if row[1] is not None:
+                    for part in row[1]:
+                        #Null points separates the rings within a polygon part
+                        coords = []
+                        for pnt in part:
+                            if pnt is None:
+                                parts.append(coords)
+                                coords = []
+                            else:
+                                coords.append((pnt.X, pnt.Y))
+                        parts.append(coords)
+                features.append((row[0], [p for p in parts if p], dict(zip(keys, row[2:]))))
+        return features
+
+    def __writeSegments(self, segments, outEarFeats, elementDataset, fieldDict):
+        """Write segments from the geometry backend to a new feature class, returns the object ids of the new features"""
+        d, f = os.path.split(outEarFeats)
+        sr = arcpy.Describe(elementDataset).spatialReference
+        arcpy.CreateFeatureclass_management(d, f, "POLYLINE", "#", "DISABLED", "DISABLED", sr)
+        keys = list(fieldDict.keys())
+        for key in keys:
+            fld = fieldDict[key]
+            fldLength = fld.length if fld.type == 'String' else "#"
+            arcpy.AddField_management(outEarFeats, key, self.__fieldTypes.get(fld.type, 'TEXT'), "#", "#", fldLength)
+        oids = []
+        with arcpy.da.InsertCursor(outEarFeats, ["SHAPE@"] + keys) as cursor:
+            for segment in segments:
+                shape = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for x, y in segment[4]]), sr)
+                oids.append(cursor.insertRow([shape] + [segment[5].get(k) for k in keys]))
+        return oids
+
+    def __writeImportRows(self, rows, tmpTable):
+        """Write rows (dicts keyed by import table fields) to a table with the same schema as the cmr import table"""
+        d, f = os.path.split(tmpTable)
+        arcpy.CreateTable_management(d, f)
+        fieldNames = [fld[0] for fld in self.__cmrImportFields]
+        for name, fldType, fldLength in self.__cmrImportFields:
+            arcpy.AddField_management(tmpTable, name, fldType, "#", "#", fldLength if fldLength else "#")
+        with arcpy.da.InsertCursor(tmpTable, fieldNames) as cursor:
+            for row in rows:
+                cursor.insertRow([row.get(name) for name in fieldNames])
+
+    def __intersectionRows(self, intersectFeats, fields):
+        """Generator of rows (dicts keyed by import table fields) read from the intersected features"""
+        cmrFldMap = self.cmrImportFieldMapping
+        fieldNames = dict((f.name.lower(), f.name) for f in fields if not f.required)
+        fieldNames.update((f.name.lower(), f.name) for f in fields if f.name.lower() == cmrFldMap['element_size'].lower())
+        #Element attributes are renamed to the import field names in the output features
+        sources = {}
+        for key, fldType, fldLength in self.__cmrImportFields:
+            for candidate in [cmrFldMap.get(key, ''), key]:
+                if candidate.lower() in fieldNames:
+                    sources[key] = fieldNames[candidate.lower()]
+                    break
+        keys = list(sources.keys())
+        with arcpy.da.SearchCursor(intersectFeats, [sources[key] for key in keys]) as cursor:
+            for row in cursor:
+                yield dict(zip(keys, row))
+
+    def __bulkLoadImportRows(self, rows):
+        """Stream rows into the cmr import table, rows with zero or undefined event_frequency or element_size are skipped"""
+        from cmr_bulkload import cmrbulkloader
+        loader = cmrbulkloader(self.__sdeConn, self.__cmrImportTableName
+                               , [fld[0] for fld in self.__cmrImportFields]
+                               , requiredPositive=['event_frequency', 'element_size']
+                               , msgFunc=self.__showMsg)
+        if self.importLock is None:
+            return loader.load(rows)
+        with self.importLock:
+            return loader.load(rows)
+
+    def __indexedImportRows(self, segments, segmentOids, zones, intersections=None):
+        """Intersect segments with zones using the geometry backend, returns rows for the cmr import table.
+If intersections (segment_index, zone_oid, length) are given (e.g. from a tiled run) they are used instead"""
+        zoneAttrs = dict((oid, attrs) for oid, rings, attrs in zones)
+        if intersections is None:
+            intersections = self.geometryBackend.intersectElements(segments, zones)
+        rows = []
+        for n, zoneOid, length in intersections:
+            row = dict(segments[n][5])
+            row.update(zoneAttrs[zoneOid])
+            row['study_id'] = self.__studyId
+            row['element_feature_id'] = segmentOids[n]
+            row['hazardzone_feature_id'] = zoneOid
+            row['element_size'] = length
+            #Same criteria as the where clause used for the geoprocessing tools
+            if row['element_size'] > 0 and row.get('event_frequency') is not None and row['event_frequency'] > 0:
+                rows.append(row)
+        return rows
+
+    def __applyDiversionTimes(self, elements):
+        """Set diversion_time of the elements from the road network, the landmark index is cached next to the output geodatabase"""
+        from cmr_network import cmrroadnetwork
+        indexFile = os.path.join(os.path.dirname(os.path.abspath(self.outputGDB)), "cmr_network_{0}.npz".format(self.__studyId))
+        with self.instrument.span('diversion_times') as span:
+            network = cmrroadnetwork.fromElements(elements, self.diversionSpeeds, indexFile=indexFile)
+            times = network.diversionTimes(self.diversionTimes)
+            for oid, parts, attrs in elements:
+                if oid in times:
+                    attrs['diversion_time'] = times[oid]
+            span.rows = len(network.edgeTime)
+            span.set('nodes', len(network.nodes))
+            span.set('elements', len(times))
+        self.__showMsg("Computed diversion times for {0} of {1} elements".format(len(times), len(elements)))
+
+    def __stageRows(self, tableName, fields, rows):
+        """Load rows into one of the staging tables of the cmr database"""
+        from cmr_bulkload import cmrbulkloader
+        return cmrbulkloader(self.__sdeConn, tableName, fields, msgFunc=self.__showMsg).load(rows)
+
+    def __hasIncrementalState(self, studyId, outEarFeats):
+        """True if the study has stored fingerprints and the output layer of the previous run exists"""
+        from cmr_engine import fetchRows
+        if not arcpy.Exists(outEarFeats):
+            return False
+        rows = fetchRows(self.__sdeConn, self.__sqlCountFingerprints.format(studyId))
+        return len(rows) > 0 and int(rows[0][0] or 0) > 0
+
+    def __runImportProcedure(self, strSQL):
+        """Execute cmrSP_importResults or cmrSP_upsertResults and show the messages, returns True if there were no errors"""
+        sdeReturn = self.__sdeSqlExecute(strSQL)
+        if isinstance(sdeReturn, list):
+            maxRetVal = 0
+            for row in sdeReturn:
+                maxRetVal = max([maxRetVal,row[0]])
+                self.__showMsg(row[1])
+            return maxRetVal==0
+        self.__showMsg("Error: sql statement '{0}' returned unexpected results.".format(strSQL))
+        raise Exception("Failed to execute the stored procedure: {0}".format(strSQL))
+
+    def __updateSegments(self, outEarFeats, segments, segmentOids, removedOids, keys):
+        """Delete removed segments from the output layer and insert the new ones (those without an oid).
+Returns the oids of all segments"""
+        cmrFldMap = self.cmrImportFieldMapping
+        oidField = arcpy.Describe(outEarFeats).OIDFieldName
+        for n in range(0, len(removedOids), 1000):
+            whereClause = '"{0}" IN ({1})'.format(oidField, ",".join(str(oid) for oid in removedOids[n:n+1000]))
+            with arcpy.da.UpdateCursor(outEarFeats, ["OID@"], whereClause) as cursor:
+                for row in cursor:
+                    cursor.deleteRow()
+        sr = arcpy.Describe(outEarFeats).spatialReference
+        oids = list(segmentOids)
+        with arcpy.da.InsertCursor(outEarFeats, ["SHAPE@", cmrFldMap['study_id']] + keys) as cursor:
+            for n, segment in enumerate(segments):
+                if oids[n] is None:
+                    shape = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for x, y in segment[4]]), sr)
+                    oids[n] = cursor.insertRow([shape, self.__studyId] + [segment[5].get(k) for k in keys])
+        #New segments get their own oid as element feature id, like in a full run
+        whereClause = '"{0}" IS NULL'.format(cmrFldMap['element_feature_id'])
+        with arcpy.da.UpdateCursor(outEarFeats, ["OID@", cmrFldMap['element_feature_id']], whereClause) as cursor:
+            for row in cursor:
+                cursor.updateRow([row[0], row[0]])
+        return oids
+
+    def __incrementalIntersection(self, myFeats, myZones, outEarFeats):
+        """Split and intersect only the elements affected by changes since the last run and upsert the results"""
+        from cmr_engine import fetchRows
+        from cmr_incremental import cmrchangeset
+        instrument = self.instrument
+
+        self.__showMsg("Detecting changes since the last run...")
+        with instrument.span('detect_changes') as span:
+            elementFields = self.__findFields(myFeats, self.__elementKeys)
+            zoneFields = self.__findFields(myZones, self.__zoneKeys)
+            elements = self.__readFeatures(myFeats, elementFields)
+            zones = self.__readFeatures(myZones, zoneFields)
+            if self.diversionTimes:
+                self.__applyDiversionTimes(elements)
+            previous = fetchRows(self.__sdeConn, self.__sqlSelectFingerprints.format(self.__studyId))
+            changes = cmrchangeset(previous, elements, zones, self.geometryBackend.splitAtElementCrossings)
+            span.rows = len(elements)+len(zones)
+            span.set('affected_elements', len(changes.affectedElements))
+            self.__showMsg(changes.summary())
+        if changes.isEmpty():
+            self.outputFeatures = outEarFeats
+            self.__showMsg("Nothing has changed, the results are up to date!")
+            return True
+
+        self.__showMsg("Splitting affected elements at zone-boundary crossings...")
+        with instrument.span('split') as span:
+            segments = self.geometryBackend.splitElements(elements, zones, changes.affectedElements)
+            segmentOids, removedOids = changes.matchSegments(segments)
+            nKept = len([oid for oid in segmentOids if oid is not None])
+            self.__showMsg("Split {0} elements into {1} segments ({2} unchanged, {3} new, {4} removed)".format(
+                len(changes.affectedElements), len(segments), nKept, len(segments)-nKept, len(removedOids)))
+            segmentOids = self.__updateSegments(outEarFeats, segments, segmentOids, removedOids, list(elementFields.keys()))
+            self.outputFeatures = outEarFeats
+            span.rows = len(segments)
+            span.set('removed_segments', len(removedOids))
+
+        self.__showMsg("Identifying element hazard intersections...")
+        with instrument.span('intersect') as span:
+            importRows = self.__indexedImportRows(segments, segmentOids, zones)
+            span.rows = len(importRows)
+            self.__showMsg("Found {0} element hazard intersections".format(len(importRows)))
+
+        self.__showMsg("Updating element hazard intersections in cmr database...")
+        with instrument.span('import') as span:
+            stats = self.__bulkLoadImportRows(importRows)
+            span.rows = stats['rows_loaded']
+            self.__stageRows("cmrT_ImportResetFeatures", cmrchangeset.resetFields, changes.resetRows(self.__studyId))
+            self.__stageRows("cmrT_ImportFingerprint", cmrchangeset.fingerprintFields, changes.fingerprintRows(self.__studyId, segments, segmentOids))
+        with instrument.span('upsert_results'):
+            retVal = self.__runImportProcedure(self.__sqlExecUpsertResults.format(self.__studyId))
+        return retVal
+
+
     ########################################
     ###          PUBLIC METHODS          ###
     ########################################
     def getStudyId(self):
         return self.__studyId
-        
+
+    def writeRunReport(self, filename=None):
+        """Write the run report as json, by default to cmr_run_<study_id>_<timestamp>.json next to the output geodatabase.
+Returns the filename"""
+        if filename is None:
+            filename = self.runReportFile
+        if filename is None:
+            filename = os.path.join(os.path.dirname(os.path.abspath(self.outputGDB))
+                                    , "cmr_run_{0}_{1}.json".format(self.__studyId, time.strftime("%Y%m%d_%H%M%S")))
+        self.runReportFile = self.instrument.writeReport(filename)
+        return self.runReportFile
+
+    def resultSummary(self, timeframe=1, route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False, refresh=False):
+        """Rows of cmrSP_resultSummary computed in-process. The study is loaded once (use refresh=True after editing
+parameters in the database) and the summary cubes are cached by study, timeframe and parameter version"""
+        import cmr_summary
+        if refresh or self.__summaryEngine is None:
+            self.__summaryEngine = self.getRiskEngine()
+        return cmr_summary.resultSummary(self.__summaryEngine, timeframe, route, elementtype, valuetype, hazardzone, processtype)
+
+    def writeRiskAttributes(self, featureClass=None):
+        """Compute the element and route summaries once and write them into DOUBLE fields of the output features
+(by default the ear feature class of the last run). Features without results get NULL, and so do the route fields
+of features without a route (as when the route summary is joined on the route field). Returns the number of features updated"""
+        if featureClass is None:
+            featureClass = self.outputFeatures
+        if not featureClass:
+            raise Exception("No output features to write risk attributes to!")
+        from cmr_engine import cmrriskattributes
+        with self.instrument.span('risk_attributes') as span:
+            riskAttributes = cmrriskattributes(self.getRiskEngine())
+            names = riskAttributes.names
+
+            cmrFldMap = self.cmrImportFieldMapping
+            fields = dict((f.name.lower(), f.name) for f in arcpy.ListFields(featureClass))
+            featureIdField = fields.get(cmrFldMap['element_feature_id'].lower())
+            if featureIdField is None:
+                raise Exception("The output features have no {0} field!".format(cmrFldMap['element_feature_id']))
+            routeField = self.__outputRouteField(featureClass)
+            routeField = routeField.name if routeField is not None else None
+
+            elementFields = [self.riskAttributeFields['element'].format(name) for name in names]
+            routeFields = [self.riskAttributeFields['route'].format(name) for name in names] if routeField else []
+            for fld in elementFields + routeFields:
+                if fld.lower() not in fields:
+                    arcpy.AddField_management(featureClass, fld, "DOUBLE")
+
+            cursorFields = [featureIdField] + ([routeField] if routeField else []) + elementFields + routeFields
+            nRows = 0
+            with arcpy.da.UpdateCursor(featureClass, cursorFields) as cursor:
+                for row in cursor:
+                    newRow = [row[0]] + riskAttributes.elementValues(row[0])
+                    if routeField:
+                        newRow = [row[0], row[1]] + newRow[1:] + riskAttributes.routeValues(row[1])
+                    cursor.updateRow(newRow)
+                    nRows += 1
+            span.rows = nRows
+        self.__showMsg("Wrote risk attributes to {0} features".format(nRows))
+        return nRows
+
+    def streamSummaries(self, directory=None, chunkSize=None, resume=True):
+        """Evaluate the summaries of the study in chunks, by default with checkpoints and elements.csv in
+cmr_stream_<study_id> next to the output geodatabase. Returns the route and study summaries (see cmr_stream.cmrstream.run)"""
+        from cmr_params import cmrparameterpack
+        from cmr_stream import cmrstream, sdeSource
+        if not self.__studyId:
+            raise Exception("Cannot stream the summaries before the study is initiated!")
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(self.outputGDB)), "cmr_stream_{0}".format(self.__studyId))
+        with self.instrument.span('stream_summaries') as span:
+            pack = self.parameterPack if self.parameterPack is not None else cmrparameterpack.fromSde(self.__sdeConn)
+            stream = cmrstream(self.__studyId, pack, directory, self.__showMsg)
+            result = stream.run(sdeSource(self.__sdeConn, self.__studyId, chunkSize or self.streamChunkSize), resume)
+            span.rows = result['elements']
+            span.set('directory', directory)
+        return result
+
+    def buildIncidence(self, filename=None):
+        """Build and save the incidence index of the study, by default to cmr_incidence_<study_id>.npz next to the
+output geodatabase. Returns the cmrincidence"""
+        from cmr_incidence import cmrincidence
+        if filename is None:
+            filename = os.path.join(os.path.dirname(os.path.abspath(self.outputGDB)), "cmr_incidence_{0}.npz".format(self.__studyId))
+        with self.instrument.span('incidence') as span:
+            incidence = cmrincidence.fromEngine(self.getRiskEngine())
+            incidence.save(filename)
+            span.rows = len(incidence.pairElement)
+            span.set('filename', filename)
+        self.__showMsg("Incidence index written to {0}".format(filename))
+        return incidence
+
+    def scenarios(self):
+        """Returns a cmrscenario with the current results of the study as baseline"""
+        from cmr_scenario import cmrscenario
+        with self.instrument.span('scenario_baseline') as span:
+            scenario = cmrscenario(self.getRiskEngine())
+            span.rows = len(scenario.engine.pairElement)
+        return scenario
+
+    def exportSummaries(self, directory=None):
+        """Export the summaries of the study, by default to cmr_export_<study_id> next to the output geodatabase.
+Returns the manifest of the export"""
+        from cmr_export import cmrexporter
+        if directory is None:
+            directory = os.path.join(os.path.dirname(os.path.abspath(self.outputGDB)), "cmr_export_{0}".format(self.__studyId))
+        with self.instrument.span('export') as span:
+            manifest = cmrexporter(directory, self.exportFormats, self.__showMsg).exportEngine(self.getRiskEngine())
+            span.rows = sum(level['rows'] for level in manifest['levels'].values())
+            span.set('directory', directory)
+        self.exportDirectory = directory
+        return manifest
+
+    def writeGeneralizedOutput(self, featureClass=None):
+        """Write one generalized feature class per level (ear<study_id>_gen<level>) from the output features (by default
+the ear feature class of the last run) with route_code, risk_class, risk, n_segments and seg_length.
+risk is generalizeColumn of the element summary (summed for merged features), features without results get risk class 0.
+Returns a dict level -> feature class"""
+        from cmr_generalize import cmrgeneralizer
+        if featureClass is None:
+            featureClass = self.outputFeatures
+        if not featureClass:
+            raise Exception("No output features to generalize!")
+        with self.instrument.span('generalize') as span:
+            engine = self.getRiskEngine()
+            names = [name for categoryId, name in engine.summaryColumns]
+            if self.generalizeColumn not in names:
+                raise Exception("Unknown summary column {0}, use one of {1}".format(self.generalizeColumn, ", ".join(names)))
+            keys, values = engine.summaryArrays('element')
+            column = names.index(self.generalizeColumn)
+            elementValues = dict((int(fid), float(values[n, column])) for n, fid in enumerate(keys['element_feature_id']))
+
+            cmrFldMap = self.cmrImportFieldMapping
+            fields = dict((f.name.lower(), f) for f in arcpy.ListFields(featureClass))
+            fieldDict = {}
+            if cmrFldMap['element_feature_id'].lower() not in fields:
+                raise Exception("The output features have no {0} field!".format(cmrFldMap['element_feature_id']))
+            fieldDict['element_feature_id'] = fields[cmrFldMap['element_feature_id'].lower()]
+            routeField = self.__outputRouteField(featureClass)
+            if routeField is not None:
+                fieldDict['route_code'] = routeField
+
+            segments = [(oid, parts, attributes.get('route_code'), elementValues.get(attributes['element_feature_id']))
+                        for oid, parts, attributes in self.__readFeatures(featureClass, fieldDict)]
+            generalizer = cmrgeneralizer(self.generalizeLevels, self.generalizeBreaks)
+            levels = generalizer.generalize(segments)
+
+            sr = arcpy.Describe(featureClass).spatialReference
+            routeLength = routeField.length if routeField is not None and routeField.type == 'String' else 50
+            outFeatures = {}
+            for level in sorted(levels):
+                outFeats = self.__generalizedOutputFilename.format(self.outputGDB, self.__studyId, level)
+                if arcpy.Exists(outFeats):
+                    arcpy.Delete_management(outFeats)
+                d, f = os.path.split(outFeats)
+                arcpy.CreateFeatureclass_management(d, f, "POLYLINE", "#", "DISABLED", "DISABLED", sr)
+                arcpy.AddField_management(outFeats, "route_code", "TEXT", "#", "#", routeLength)
+                arcpy.AddField_management(outFeats, "risk_class", "SHORT")
+                arcpy.AddField_management(outFeats, "risk", "DOUBLE")
+                arcpy.AddField_management(outFeats, "n_segments", "LONG")
+                arcpy.AddField_management(outFeats, "seg_length", "DOUBLE")
+                with arcpy.da.InsertCursor(outFeats, ["SHAPE@", "route_code", "risk_class", "risk", "n_segments", "seg_length"]) as cursor:
+                    for parts, route, riskClass, risk, length, nSegments, oid in levels[level]:
+                        shape = arcpy.Polyline(arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in part]) for part in parts]), sr)
+                        cursor.insertRow([shape, route, riskClass, risk, nSegments, length])
+                outFeatures[level] = outFeats
+                self.__showMsg("Level {0}: {1} features, {2} of {3} vertices".format(level, len(levels[level])
+                                                                                     , generalizer.vertexCounts[level]
+                                                                                     , generalizer.vertexCounts[0]))
+            span.rows = len(segments)
+            span.set('vertices', generalizer.vertexCounts)
+            span.set('breaks', generalizer.breaks)
+        self.generalizedFeatures = outFeatures
+        return outFeatures
+
+    def getRiskEngine(self):
+        """Returns an in-process risk engine (cmrengine) with the results of the study loaded from the cmr database"""
+        from cmr_engine import cmrengine
+        if not self.__studyId:
+            raise Exception("Cannot create a risk engine before the study is initiated!")
+        return cmrengine.fromSde(self.__sdeConn, self.__studyId, self.parameterPack)
+
     def initiateStudyArea(self, studyName, hazardDatasetFilepath, elementDatasetFilepath, studyDescription=None, studyId=None):
         """Executes the stored procedure cmrSP_setStudyArea in the cmr database"""
         #Make sure studyName is s string
@@ -157,7 +716,19 @@ The OID of the output layer can be used to join individual features to cmr risk
         
         #Check if studyId is defined as an integer
         studyId = studyId if isinstance(studyId,int) else "NULL"
-        strSQL = self.__sqlExecInitiateStudy.format(studyId, studyName, hazardDatasetFilepath, elementDatasetFilepath, studyDescription)
+        if self.tileSize and self.geometryBackend is None:
+            raise Exception('Tiled mode requires a geometry backend (e.g. cmr_geometry.indexedGeometryBackend)!')
+        if self.diversionTimes and self.geometryBackend is None:
+            raise Exception('Computed diversion times require a geometry backend (e.g. cmr_geometry.indexedGeometryBackend)!')
+        #In incremental mode an existing study is only reset if the state of the previous run is missing
+        self.__incrementalRun = False
+        if self.incremental:
+            if self.geometryBackend is None:
+                raise Exception('Incremental mode requires a geometry backend (e.g. cmr_geometry.indexedGeometryBackend)!')
+            if studyId != "NULL":
+                self.__incrementalRun = self.__hasIncrementalState(studyId, self.__earOutputFilename.format(self.outputGDB, studyId))
+        reset = 0 if self.__incrementalRun else 1
+        strSQL = self.__sqlExecInitiateStudy.format(studyId, studyName, hazardDatasetFilepath, elementDatasetFilepath, studyDescription, reset)
         #Execute the sql statement 
         sdeReturn = self.__sdeSqlExecute(strSQL)
         # If the return value is a list (a list of lists), display each list as a row
@@ -240,16 +811,31 @@ The OID of the output layer can be used to join individual features to cmr risk
 
     def hazardElementIntersection(self):
         "Calculate element hazard intersection from the defined hazard and element datasets"
-        import time
-
         studyId = self.__studyId
         #Make study area is initiated
         if not studyId:
             raise Exception("Cannot call hazardElementIntersection method before the study is initiated!")
+        #The fingerprints of the segments are only known when the geometry backend splits the elements
+        if self.incremental and self.geometryBackend is None:
+            raise Exception('Incremental mode requires a geometry backend (e.g. cmr_geometry.indexedGeometryBackend)!')
 
         cmrImportTable = self.__cmrImportTable
         cmrFldMap = self.cmrImportFieldMapping
         outputGDB = self.outputGDB
+        instrument = self.instrument
+        instrument.start(study_id=studyId
+                         , study_name=self.__studyName
+                         , hazard_dataset=self.__hazardDatasetFilepath
+                         , element_dataset=self.__elementDatasetFilepath
+                         , output_gdb=outputGDB
+                         , geometry_backend=self.geometryBackend.__class__.__name__ if self.geometryBackend is not None else None
+                         , bulk_load=self.bulkLoad
+                         , incremental=self.incremental
+                         , incremental_run=self.__incrementalRun
+                         , tile_size=self.tileSize)
+        self.runReportFile = None
+        self.exportDirectory = None
+        self.__summaryEngine = None
 
         # Before we move on, make sure output geodatabase exist
         if not arcpy.Exists(outputGDB):
@@ -284,111 +870,193 @@ The OID of the output layer can be used to join individual features to cmr risk
             env.overwriteOutput = True
             env.extent = self.extent
 
+            if self.__incrementalRun:
+                #Only the changes since the last run are processed
+                retVal = self.__incrementalIntersection(myFeats, myZones, outEarFeats)
+                if retVal and self.riskAttributes:
+                    self.writeRiskAttributes()
+                if retVal and self.exportResults:
+                    self.exportSummaries()
+                if retVal and self.generalizedOutput:
+                    self.writeGeneralizedOutput()
+                instrument.finish('ok' if retVal else 'failed')
+                self.__showMsg("Finished geoprocessing!")
+                return retVal
 
             # Split elements at each zone boundary intersection
             self.__showMsg("Splitting elements at zone-boundary crossings...")
-            tic = time.clock()
-            self.prepareInputElements(myFeats, myZones, splitFeats)
-            self.__showMsg("Processing time: {0}".format(time.clock()-tic))
+            with instrument.span('split') as span:
+                if self.geometryBackend is None:
+                    self.prepareInputElements(myFeats, myZones, splitFeats)
+                    span.rows = self.__countRows(splitFeats)
+                else:
+                    #Read the input features and split them in-process using the geometry backend
+                    elementFields = self.__findFields(myFeats, self.__elementKeys)
+                    zoneFields = self.__findFields(myZones, self.__zoneKeys)
+                    elements = self.__readFeatures(myFeats, elementFields)
+                    zones = self.__readFeatures(myZones, zoneFields)
+                    if self.diversionTimes:
+                        self.__applyDiversionTimes(elements)
+                    intersections = None
+                    if self.tileSize:
+                        #Split and intersect tile by tile in worker processes
+                        from cmr_tiling import cmrtiler
+                        tiler = cmrtiler(self.geometryBackend, self.tileSize, self.tileWorkers)
+                        segments, intersections = tiler.run(elements, zones)
+                        span.set('tiles', tiler.nTiles)
+                        self.__showMsg("Processed {0} tiles".format(tiler.nTiles))
+                    else:
+                        segments = self.geometryBackend.splitElements(elements, zones)
+                    span.rows = len(segments)
+                    span.set('elements', len(elements))
+                    span.set('zones', len(zones))
+                    self.__showMsg("Split {0} elements into {1} segments".format(len(elements), len(segments)))
 
             #Save the splitted features as the output EAR
             self.__showMsg("Saving elements at risk features to {0}...".format(os.path.basename(outEarFeats)))
-            tic = time.clock()
-            if arcpy.Exists(outEarFeats):
-                #If it exists, delete it
-                try:
-                    self.__showMsg("Output feature layer {0} already exists: Deleting...".format(os.path.basename(outEarFeats)))
-                    arcpy.Delete_management(outEarFeats)
-                except:
-                    errMsg = "Failed to delete existing output feature layer."
-                    raise Exception(errMsg)
-            # Finally write the splitFeats layer as a featureclass to outEarFeats
-            arcpy.CopyFeatures_management(splitFeats, outEarFeats)
-            self.outputFeatures = outEarFeats
-            self.__showMsg("Processing time: {0}".format(time.clock()-tic))
+            with instrument.span('copy') as span:
+                if arcpy.Exists(outEarFeats):
+                    #If it exists, delete it
+                    try:
+                        self.__showMsg("Output feature layer {0} already exists: Deleting...".format(os.path.basename(outEarFeats)))
+                        arcpy.Delete_management(outEarFeats)
+                    except:
+                        errMsg = "Failed to delete existing output feature layer."
+                        raise Exception(errMsg)
+                # Finally write the splitFeats layer (or the segments from the geometry backend) as a featureclass to outEarFeats
+                if self.geometryBackend is None:
+                    arcpy.CopyFeatures_management(splitFeats, outEarFeats)
+                    span.rows = self.__countRows(outEarFeats)
+                else:
+                    segmentOids = self.__writeSegments(segments, outEarFeats, myFeats, elementFields)
+                    span.rows = len(segmentOids)
+                self.outputFeatures = outEarFeats
             
             #Add field for study_id and element_feature_id
             self.__showMsg("Adding fields to output layer")
-            flds = [cmrFldMap['study_id'],cmrFldMap['element_feature_id']]
-            vals = ["{0}".format(self.__studyId),"!OBJECTID!"]
-            for newFld, newVal in zip(flds, vals):
-                arcpy.AddField_management(outEarFeats,newFld,"LONG")
-                arcpy.CalculateField_management(outEarFeats,newFld,newVal,"PYTHON","#")
-
-
-            self.__showMsg("Identifying element hazard intersections...")
-            tic = time.clock()
-            # Perform intersection returning FID only
-            arcpy.Intersect_analysis([outEarFeats, myZones],intersectFeats,"ALL","#","INPUT")
-            self.__showMsg("Processing time: {0}".format(time.clock()-tic))
-
-            self.__showMsg("Generating element hazard intersection table...")
-            tic = time.clock()
-            # Get all fields of the intersected features and identify the fields that contains the fid for the two input features
-            fields = arcpy.ListFields(intersectFeats)
-
-            keys = ['hazardzone_feature_id']
-            feats = [myZones]
-            for key, feat in zip(keys, feats):
-                fieldCandidate = "fid_{0}".format(os.path.basename(feat))
-                fidField = [s for s in [x.name for x in fields if not x.required] if fieldCandidate.lower() == s.lower()]
-                if len(fidField)==1:
-                    cmrFldMap[key] = fidField[0]
-                else:
-                    errMsg = "Could not determine which field that contains the {0}!".format(key)
-                    raise Exception(errMsg)
-            # Create a fieldinfo object (for table view)
-            fieldinfo = arcpy.FieldInfo()
-            # Iterate through the fields and define which fields to view and what to call them
-            for field in fields:
-                oldName = field.name
-                newName = [k for k,v in cmrFldMap.items() if oldName.lower() == v.lower()]
-                if len(newName)>0:
-                    newName = newName[0]
-                    display = "VISIBLE"
-                else:
-                    newName = oldName
-                    display = "HIDDEN"
-                fieldinfo.addField(oldName, newName, display, "")
-            #Define a where clause for eliminating small elements and zero frequency elements
-            whereClause = '"{0}" > 0 AND "{1}" > 0'.format(cmrFldMap['element_size'], cmrFldMap['event_frequency'])
-            #Create a table view using the defined fieldinfo (renamed and hidden fields)
-            arcpy.MakeTableView_management(intersectFeats, intersectTbl, whereClause, tmpGDB, fieldinfo)
-            # Make sure it will be deleted upon completion of process (to avoid lock on the tmpGDB)
-            self.__tmpgisfiles.append(intersectTbl)
-            self.__showMsg("Processing time: {0}".format(time.clock()-tic))
+            with instrument.span('add_fields') as span:
+                flds = [cmrFldMap['study_id'],cmrFldMap['element_feature_id']]
+                vals = ["{0}".format(self.__studyId),"!OBJECTID!"]
+                for newFld, newVal in zip(flds, vals):
+                    arcpy.AddField_management(outEarFeats,newFld,"LONG")
+                    arcpy.CalculateField_management(outEarFeats,newFld,newVal,"PYTHON","#")
+                span.rows = self.__countRows(outEarFeats)
+
+
+            if self.geometryBackend is None:
+                self.__showMsg("Identifying element hazard intersections...")
+                with instrument.span('intersect') as span:
+                    # Perform intersection returning FID only
+                    arcpy.Intersect_analysis([outEarFeats, myZones],intersectFeats,"ALL","#","INPUT")
+                    span.rows = self.__countRows(intersectFeats)
+
+                self.__showMsg("Generating element hazard intersection table...")
+                with instrument.span('table_view') as span:
+                    # Get all fields of the intersected features and identify the fields that contains the fid for the two input features
+                    fields = arcpy.ListFields(intersectFeats)
+
+                    keys = ['hazardzone_feature_id']
+                    feats = [myZones]
+                    for key, feat in zip(keys, feats):
+                        fieldCandidate = "fid_{0}".format(os.path.basename(feat))
+                        fidField = [s for s in [x.name for x in fields if not x.required] if fieldCandidate.lower() == s.lower()]
+                        if len(fidField)==1:
+                            cmrFldMap[key] = fidField[0]
+                        else:
+                            errMsg = "Could not determine which field that contains the {0}!".format(key)
+                            raise Exception(errMsg)
+                    # Create a fieldinfo object (for table view)
+                    fieldinfo = arcpy.FieldInfo()
+                    # Iterate through the fields and define which fields to view and what to call them
+                    for field in fields:
+                        oldName = field.name
+                        newName = [k for k,v in cmrFldMap.items() if oldName.lower() == v.lower()]
+                        if len(newName)>0:
+                            newName = newName[0]
+                            display = "VISIBLE"
+                        else:
+                            newName = oldName
+                            display = "HIDDEN"
+                        fieldinfo.addField(oldName, newName, display, "")
+                    if self.bulkLoad:
+                        #Rows are filtered while they are streamed to the import table
+                        importRows = self.__intersectionRows(intersectFeats, fields)
+                    else:
+                        #Define a where clause for eliminating small elements and zero frequency elements
+                        whereClause = '"{0}" > 0 AND "{1}" > 0'.format(cmrFldMap['element_size'], cmrFldMap['event_frequency'])
+                        #Create a table view using the defined fieldinfo (renamed and hidden fields)
+                        arcpy.MakeTableView_management(intersectFeats, intersectTbl, whereClause, tmpGDB, fieldinfo)
+                        # Make sure it will be deleted upon completion of process (to avoid lock on the tmpGDB)
+                        self.__tmpgisfiles.append(intersectTbl)
+                        span.rows = self.__countRows(intersectTbl)
+            else:
+                self.__showMsg("Identifying element hazard intersections...")
+                with instrument.span('intersect') as span:
+                    importRows = self.__indexedImportRows(segments, segmentOids, zones, intersections)
+                    if not self.bulkLoad:
+                        self.__writeImportRows(importRows, os.path.join(tmpGDB, tmpImportTable))
+                    span.rows = len(importRows)
+                    self.__showMsg("Found {0} element hazard intersections".format(len(importRows)))
             
             #Append the rows in the intersection table to the import table in the cmr geodatabase
             self.__showMsg("Importing element hazard intersection table to cmr database...")
-            tic = time.clock()
-            #We must first save the table, then we can append the rows
-            arcpy.CopyRows_management(intersectTbl, tmpImportTable)
-            arcpy.Append_management(tmpImportTable,cmrImportTable,"NO_TEST")
+            with instrument.span('import') as span:
+                if self.bulkLoad:
+                    #Stream the rows straight into the import table
+                    stats = self.__bulkLoadImportRows(importRows)
+                    span.rows = stats['rows_loaded']
+                    span.set('rows_skipped', stats['rows_skipped'])
+                else:
+                    #We must first save the table, then we can append the rows (the geometry backend writes the table directly)
+                    if self.geometryBackend is None:
+                        arcpy.CopyRows_management(intersectTbl, tmpImportTable)
+                    arcpy.Append_management(tmpImportTable,cmrImportTable,"NO_TEST")
+                    span.rows = self.__countRows(tmpImportTable)
+                if self.incremental:
+                    #Store fingerprints of all features, so the next run can be incremental
+                    from cmr_incremental import cmrchangeset
+                    changes = cmrchangeset([], elements, zones, self.geometryBackend.splitAtElementCrossings)
+                    self.__stageRows("cmrT_ImportFingerprint", cmrchangeset.fingerprintFields, changes.fingerprintRows(studyId, segments, segmentOids))
+
             #Run the update procedure in sqlserver
-            strSQL = self.__sqlExecImportResults.format(studyId)
-            sdeReturn = self.__sdeSqlExecute(strSQL)
-            retVal = False
-            if isinstance(sdeReturn, list):
-                maxRetVal = 0
-                for row in sdeReturn:
-                    maxRetVal = max([maxRetVal,row[0]])
-                    self.__showMsg(row[1])
-                if maxRetVal==0:
-                    retVal = True
-            else:
-                self.__showMsg("Error: sql statement '{0}' returned unexpected results.".format(strSQL))
-                errMsg = "Failed to execute the cmrSP_importResults stored procedure"
-                raise Exception(errMsg)
-            self.__showMsg("Processing time: {0}".format(time.clock()-tic))
-            
+            with instrument.span('import_results'):
+                strSQL = self.__sqlExecImportResults.format(studyId)
+                sdeReturn = self.__sdeSqlExecute(strSQL)
+                retVal = False
+                if isinstance(sdeReturn, list):
+                    maxRetVal = 0
+                    for row in sdeReturn:
+                        maxRetVal = max([maxRetVal,row[0]])
+                        self.__showMsg(row[1])
+                    if maxRetVal==0:
+                        retVal = True
+                else:
+                    self.__showMsg("Error: sql statement '{0}' returned unexpected results.".format(strSQL))
+                    errMsg = "Failed to execute the cmrSP_importResults stored procedure"
+                    raise Exception(errMsg)
+
+            if retVal and self.riskAttributes:
+                self.writeRiskAttributes()
+            if retVal and self.exportResults:
+                self.exportSummaries()
+            if retVal and self.generalizedOutput:
+                self.writeGeneralizedOutput()
+            instrument.finish('ok' if retVal else 'failed')
             self.__showMsg("Finished geoprocessing!")
-            return True
+            return retVal
         except Exception as e:
             # If an error occurred, print line number and error message
             import traceback, sys
             tb = sys.exc_info()[2]
             strMsg = "Line {0}: {1}".format(tb.tb_lineno, e.args[0])
+            instrument.finish('failed', strMsg)
             raise Exception(strMsg)
+        finally:
+            if self.runReport:
+                try:
+                    self.__showMsg("Run report written to {0}".format(self.writeRunReport()))
+                except Exception as e:
+                    self.__showMsg("Failed to write the run report: {0}".format(e))
 
 
 
@@ -52,7 +52,8 @@ if __name__ == '__main__':
                     ,'aadt_passenger'
                     ,'aadt_goods'
                     ,'diversion_time'
-                    ,'outputGDB']
+                    ,'outputGDB'
+                    ,'risk_attributes']
 
         pams = getInputPams(pamnames)
         if not validatePams(pams):
@@ -69,6 +70,8 @@ if __name__ == '__main__':
         hazardDatasetFilepath = pams['hazard_zones_path']
         elementDatasetFilepath = pams['input_elements_path']
         outputGDB = pams['outputGDB']
+        #Optional: write the summaries into the ear features instead of joining the summary tables
+        riskAttributes = pams.get('risk_attributes', '').lower() in ('true', '1', 'yes')
 
         #Create the cmrstudy object
         myStudy = cmrstudy(sdeConnFile, outputGDB)
@@ -81,6 +84,7 @@ if __name__ == '__main__':
             myStudy.cmrImportFieldMapping['aadt_passenger'] = pams['aadt_passenger']
             myStudy.cmrImportFieldMapping['aadt_goods'] = pams['aadt_goods']
             myStudy.cmrImportFieldMapping['diversion_time'] = pams['diversion_time']
+            myStudy.riskAttributes = riskAttributes
             #Initiate the study area
             myStudy.initiateStudyArea(studyName=studyName
                                       ,hazardDatasetFilepath=hazardDatasetFilepath
@@ -93,42 +97,54 @@ if __name__ == '__main__':
                 templateDir = os.path.dirname(os.path.realpath(__file__))
                 templateDir = os.path.abspath(os.path.join(templateDir, os.path.pardir, 'templates'))
                 
-                mxd = mapping.MapDocument("CURRENT")
-                df = mapping.ListDataFrames(mxd)[0]
+                #Summary layer creation is recorded in the run report as well
+                with myStudy.instrument.span('summary_layers') as span:
+                    mxd = mapping.MapDocument("CURRENT")
+                    df = mapping.ListDataFrames(mxd)[0]
 
-                #Add the ear layer
-                lyrName = "ear_{0}".format(studyId)
-                arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
-                arcpy.ApplySymbologyFromLayer_management(lyrName, os.path.join(templateDir, "ear.lyr"))
-                myLyr = mapping.Layer(lyrName)
-                mapping.AddLayer(df, myLyr)
+                    #Add the ear layer
+                    lyrName = "ear_{0}".format(studyId)
+                    arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
+                    arcpy.ApplySymbologyFromLayer_management(lyrName, os.path.join(templateDir, "ear.lyr"))
+                    myLyr = mapping.Layer(lyrName)
+                    mapping.AddLayer(df, myLyr)
 
-                #Create an element summary table
-                tblSrc = os.path.join(sdeConnFile, "cmrV_ElementSummary")
-                tblViewName = "elementSummaryTbl_{0}".format(studyId)
-                strCond = "study_id = {0}".format(studyId)
-                arcpy.MakeTableView_management(tblSrc, tblViewName, strCond)
-                #Add a layer showing closure, repair and reopening costs by element
-                lyrName = "elementSummary_{0}".format(studyId)
-                arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
-                arcpy.AddJoin_management(lyrName,"OBJECTID",tblViewName,"element_feature_id","KEEP_ALL")
-                myLyr = mapping.Layer(lyrName)
-                mapping.AddLayer(df, myLyr)
+                    if riskAttributes:
+                        #The summaries are fields of the ear features, the layers need no joins
+                        for lyrName in ["elementSummary_{0}".format(studyId), "routeSummary_{0}".format(studyId)]:
+                            arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
+                            myLyr = mapping.Layer(lyrName)
+                            mapping.AddLayer(df, myLyr)
+                    else:
+                        #Create an element summary table (materialized by cmrSP_refreshResults)
+                        tblSrc = os.path.join(sdeConnFile, "cmrT_ElementSummary")
+                        tblViewName = "elementSummaryTbl_{0}".format(studyId)
+                        strCond = "study_id = {0}".format(studyId)
+                        arcpy.MakeTableView_management(tblSrc, tblViewName, strCond)
+                        #Add a layer showing closure, repair and reopening costs by element
+                        lyrName = "elementSummary_{0}".format(studyId)
+                        arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
+                        arcpy.AddJoin_management(lyrName,"OBJECTID",tblViewName,"element_feature_id","KEEP_ALL")
+                        myLyr = mapping.Layer(lyrName)
+                        mapping.AddLayer(df, myLyr)
                 
-                #Create a route summary table
-                tblSrc = os.path.join(sdeConnFile, "cmrV_RouteSummary")
-                tblViewName = "routeSummaryTbl_{0}".format(studyId)
-                strCond = "study_id = {0}".format(studyId)
-                arcpy.MakeTableView_management(tblSrc, tblViewName, strCond)
-                #Add a layer showing closure frequency and costs by route
-                lyrName = "routeSummary_{0}".format(studyId)
-                arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
-                arcpy.AddJoin_management(lyrName,"route_code",tblViewName,"route_code","KEEP_ALL")
-                myLyr = mapping.Layer(lyrName)
-                mapping.AddLayer(df, myLyr)
+                        #Create a route summary table (materialized by cmrSP_refreshResults)
+                        tblSrc = os.path.join(sdeConnFile, "cmrT_RouteSummary")
+                        tblViewName = "routeSummaryTbl_{0}".format(studyId)
+                        strCond = "study_id = {0}".format(studyId)
+                        arcpy.MakeTableView_management(tblSrc, tblViewName, strCond)
+                        #Add a layer showing closure frequency and costs by route
+                        lyrName = "routeSummary_{0}".format(studyId)
+                        arcpy.MakeFeatureLayer_management(myStudy.outputFeatures,lyrName)
+                        arcpy.AddJoin_management(lyrName,"route_code",tblViewName,"route_code","KEEP_ALL")
+                        myLyr = mapping.Layer(lyrName)
+                        mapping.AddLayer(df, myLyr)
+                    span.set('layers', 3)
 
                 arcpy.RefreshTOC()
                 arcpy.RefreshActiveView()
+                if myStudy.runReport:
+                    myStudy.writeRunReport()
             else:
                 arcpy.AddError("Geoprocessing failed!")
         except Exception, err:
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Run many CICERO Multirisk studies in parallel from a manifest
+
+Usage: python cmr_batch.py manifest.json [--workers N] [--report report.json]
+
+The manifest is a json file with default settings and a list of studies, any setting can be overridden per study:
+{
+    "sdeConnFile": "C:\\\\connections\\\\cmrGeo.sde",
+    "outputGDB": "C:\\\\results\\\\cmr.gdb",
+    "geometryBackend": "indexed",
+    "fieldMapping": {"processtype_id": "PROC_ID", "event_frequency": "RETURN_PER", "route_code": "VEGNR"},
+    "studies": [
+        {"studyName": "Region A", "hazardDatasetFilepath": "...", "elementDatasetFilepath": "..."},
+        {"studyName": "Region B", "studyId": 120, "studyDescription": "Scenario 2", "hazardDatasetFilepath": "...", "elementDatasetFilepath": "..."}
+    ]
+}
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+#Settings that may be given in the manifest (for all studies or per study)
+studySettings = ['sdeConnFile', 'outputGDB', 'studyName', 'studyId', 'studyDescription'
+                 , 'hazardDatasetFilepath', 'elementDatasetFilepath', 'fieldMapping', 'geometryBackend', 'bulkLoad'
+                 , 'riskAttributes', 'diversionTimes', 'generalizedOutput']
+
+#Lock shared by the workers of runBatch, serializes the bulk load into the import table
+_importLock = None
+
+def readManifest(manifestFile):
+    """Read a manifest and return a list of study settings (defaults merged into each study)"""
+    with open(manifestFile) as f:
+        manifest = json.load(f)
+    defaults = dict((k, v) for k, v in manifest.items() if k != 'studies')
+    studies = []
+    for n, study in enumerate(manifest.get('studies', [])):
+        settings = dict(defaults)
+        #Field mappings are merged, so a study only needs to give the fields that differ
+        fieldMapping = dict(defaults.get('fieldMapping', {}))
+        fieldMapping.update(study.get('fieldMapping', {}))
+        settings.update(study)
+        settings['fieldMapping'] = fieldMapping
+        unknown = [k for k in settings if k not in studySettings]
+        if unknown:
+            raise Exception("Unknown settings for study {0}: {1}".format(n, ", ".join(unknown)))
+        for required in ['sdeConnFile', 'outputGDB', 'studyName', 'hazardDatasetFilepath', 'elementDatasetFilepath']:
+            if not settings.get(required):
+                raise Exception("Study {0} is missing the setting {1}".format(n, required))
+        studies.append(settings)
+    return studies
+
+def runStudy(settings):
+    """Run one study (initiateStudyArea and hazardElementIntersection), returns a result dict.
+This is executed in a worker process, so arcpy is imported here"""
+    tic = time.time()
+    result = {'studyName': settings['studyName']
+              , 'studyId': settings.get('studyId')
+              , 'status': 'failed'
+              , 'outputFeatures': None
+              , 'error': None
+              , 'seconds': None
+              , 'pid': os.getpid()
+              , 'runReport': None}
+    myStudy = None
+    try:
+        from cmr import cmrstudy
+        myStudy = cmrstudy(settings['sdeConnFile'], settings['outputGDB'])
+        #Each instance has its own copy of the field mapping
+        for key, value in settings.get('fieldMapping', {}).items():
+            myStudy.cmrImportFieldMapping[key] = value
+        if settings.get('geometryBackend') == 'indexed':
+            from cmr_geometry import indexedGeometryBackend
+            myStudy.geometryBackend = indexedGeometryBackend()
+        if 'bulkLoad' in settings:
+            myStudy.bulkLoad = bool(settings['bulkLoad'])
+        myStudy.importLock = _importLock
+        if 'riskAttributes' in settings:
+            myStudy.riskAttributes = bool(settings['riskAttributes'])
+        if settings.get('diversionTimes'):
+            myStudy.diversionTimes = settings['diversionTimes']
+        if 'generalizedOutput' in settings:
+            myStudy.generalizedOutput = bool(settings['generalizedOutput'])
+        studyId = settings.get('studyId')
+        myStudy.initiateStudyArea(studyName=settings['studyName']
+                                  , hazardDatasetFilepath=settings['hazardDatasetFilepath']
+                                  , elementDatasetFilepath=settings['elementDatasetFilepath']
+                                  , studyDescription=settings.get('studyDescription')
+                                  , studyId=int(studyId) if studyId is not None else None)
+        result['studyId'] = myStudy.getStudyId()
+        if myStudy.hazardElementIntersection():
+            result['status'] = 'ok'
+            result['outputFeatures'] = myStudy.outputFeatures
+        else:
+            result['error'] = 'Geoprocessing failed!'
+    except Exception as e:
+        result['error'] = "{0}\n{1}".format(e, traceback.format_exc())
+    finally:
+        if myStudy is not None:
+            result['runReport'] = myStudy.runReportFile
+            myStudy.cleanup()
+        result['seconds'] = time.time()-tic
+    return result
+
+def runBatch(studies, maxWorkers=None, callback=None):
+    """Run studies in a process pool with at most maxWorkers concurrent studies.
+The studies are split and intersected in parallel, but only one worker at a time bulk loads the import table.
+Returns one result per study in the same order as the studies"""
+    if maxWorkers is None:
+        maxWorkers = multiprocessing.cpu_count()
+    maxWorkers = max(1, min(int(maxWorkers), len(studies)))
+    #When started from within ArcGIS the executable is not python, so workers must be started with python explicitly
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+    #A fresh process per study makes sure arcpy environment settings and locks are not shared between studies
+    pool = multiprocessing.Pool(processes=maxWorkers, initializer=_initWorker
+                                , initargs=(multiprocessing.Lock(),), maxtasksperchild=1)
+    try:
+        results = [None]*len(studies)
+        for n, result in pool.imap_unordered(_runIndexed, list(enumerate(studies))):
+            results[n] = result
+            if callback is not None:
+                callback(result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+def _initWorker(importLock):
+    """Initializer of the pool, gives every worker the shared import lock"""
+    global _importLock
+    _importLock = importLock
+
+def _runIndexed(item):
+    """Helper for the pool, keeps the index of the study together with the result"""
+    n, settings = item
+    return n, runStudy(settings)
+
+def showResult(result):
+    strMsg = "[{0}] {1} (study id {2}) in {3:.1f} s".format(result['status'], result['studyName'], result['studyId'], result['seconds'])
+    if result['error']:
+        strMsg += "\n    " + result['error'].strip().replace("\n", "\n    ")
+    print(strMsg)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Run CICERO Multirisk studies in parallel from a manifest")
+    parser.add_argument('manifest', help="json file with the studies to run")
+    parser.add_argument('--workers', type=int, default=None, help="maximum number of concurrent studies (default: number of cpus)")
+    parser.add_argument('--report', default=None, help="write the results as json to this file")
+    args = parser.parse_args()
+
+    studies = readManifest(args.manifest)
+    print("Running {0} studies...".format(len(studies)))
+    tic = time.time()
+    results = runBatch(studies, args.workers, callback=showResult)
+    nFailed = len([r for r in results if r['status'] != 'ok'])
+    print("Finished {0} studies in {1:.1f} s, {2} failed".format(len(results), time.time()-tic, nFailed))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if nFailed else 0)
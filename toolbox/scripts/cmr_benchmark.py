@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Scaling benchmark of the CICERO Multirisk pipeline on synthetic networks
+
+Usage: python cmr_benchmark.py [--sizes 1000 10000 100000] [--seed 0] [--history cmr_benchmark_history.jsonl] [--sde cmrGeo.sde] [--keep]
+
+For each size a synthetic network (cmr_synthetic) is generated and the stages split, intersect, import and summary
+are timed with cmr_instrument. Without --sde the import stage only generates the INSERT statements of the bulk loader
+(the client side cost); with --sde the rows are loaded into the cmr database and cmrSP_importResults is executed.
+The benchmark studies are deleted from the cmr database after each size unless --keep is given.
+Every run is appended as a json line to the history file, and throughput is compared with the previous run
+of the same size on the same host, so regressions show up across nightly runs.
+"""
+import json
+import os
+import subprocess
+import sys
+from cmr_instrument import cmrinstrument
+
+#The stages that are timed for each size
+stages = ['generate', 'split', 'intersect', 'import', 'import_results', 'summary']
+#Default sizes (number of input elements)
+defaultSizes = [1000, 10000, 100000]
+#A drop in throughput larger than this (relative) is reported as a regression
+regressionThreshold = 0.2
+
+class statementSink:
+    """Stands in for the database connection: statements are counted but not sent anywhere"""
+    def __init__(self):
+        self.statements = 0
+        self.bytes = 0
+
+    def execute(self, strSQL):
+        self.statements += 1
+        self.bytes += len(strSQL)
+        return True
+
+def gitCommit():
+    """The current commit of the repository, None if git is not available"""
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))
+                                      , stderr=subprocess.STDOUT)
+        return out.decode('ascii').strip()
+    except Exception:
+        return None
+
+def importRows(segments, segmentOids, zones, studyId):
+    """Rows for the import table from the segments and zones (as cmrstudy does with a geometry backend)"""
+    from cmr_geometry import indexedGeometryBackend
+    zoneAttrs = dict((oid, attrs) for oid, rings, attrs in zones)
+    rows = []
+    for n, zoneOid, length in indexedGeometryBackend().intersectElements(segments, zones):
+        row = dict(segments[n][5])
+        row.update(zoneAttrs[zoneOid])
+        row['study_id'] = studyId
+        row['element_feature_id'] = segmentOids[n]
+        row['hazardzone_feature_id'] = zoneOid
+        row['element_size'] = length
+        rows.append(row)
+    return rows
+
+def runSize(nElements, seed=0, sdeConn=None, studyId=None, msgFunc=None):
+    """Run all stages for one size, returns the instrument with one span per stage"""
+    from cmr_bulkload import cmrbulkloader
+    from cmr_engine import cmrengine
+    from cmr_geometry import indexedGeometryBackend
+    from cmr_synthetic import cmrsynthetic, defaultParameterTables
+    instrument = cmrinstrument(msgFunc=msgFunc)
+    instrument.start(elements=nElements, seed=seed)
+    backend = indexedGeometryBackend()
+
+    with instrument.span('generate') as span:
+        synthetic = cmrsynthetic(nElements, seed)
+        elements = synthetic.elements()
+        zones = synthetic.zones()
+        span.rows = len(elements)+len(zones)
+        span.set('zones', len(zones))
+
+    with instrument.span('split') as span:
+        segments = backend.splitElements(elements, zones)
+        segmentOids = list(range(1, len(segments)+1))
+        span.rows = len(segments)
+
+    with instrument.span('intersect') as span:
+        rows = importRows(segments, segmentOids, zones, studyId or 0)
+        span.rows = len(rows)
+
+    importFields = ['study_id', 'element_feature_id', 'elementtype_code', 'route_code', 'aadt_passenger', 'aadt_goods'
+                    , 'diversion_time', 'hazardzone_feature_id', 'processtype_id', 'event_frequency'
+                    , 'freq_interval_plus', 'freq_interval_minus', 'element_size']
+    with instrument.span('import') as span:
+        if sdeConn is None:
+            conn = statementSink()
+            loader = cmrbulkloader(conn, 'cmrT_ImportIntersectionTable', importFields, requiredPositive=['event_frequency', 'element_size'])
+            stats = loader.load(rows)
+            span.set('statements', conn.statements)
+            span.set('statement_mb', round(conn.bytes/1048576.0, 1))
+        else:
+            loader = cmrbulkloader(instrument.connection(sdeConn), 'cmrT_ImportIntersectionTable', importFields
+                                   , requiredPositive=['event_frequency', 'element_size'])
+            stats = loader.load(rows)
+        span.rows = stats['rows_loaded']
+
+    if sdeConn is not None:
+        with instrument.span('import_results') as span:
+            sdeReturn = instrument.connection(sdeConn).execute("EXECUTE [cmrSP_importResults] @study_id={0}".format(studyId))
+            if isinstance(sdeReturn, list):
+                span.set('messages', [row[1] for row in sdeReturn])
+                if max([row[0] for row in sdeReturn] + [0]) > 0:
+                    raise Exception("cmrSP_importResults failed for study {0}".format(studyId))
+            span.rows = stats['rows_loaded']
+
+    with instrument.span('summary') as span:
+        engine = cmrengine.fromImportRows(studyId or 0, rows, defaultParameterTables())
+        nElementRows = len(engine.elementSummary())
+        nRouteRows = len(engine.routeSummary())
+        engine.hazardzoneSummary()
+        engine.processtypeSummary()
+        engine.studySummary()
+        span.rows = len(engine.pairElement)
+        span.set('elements', nElementRows)
+        span.set('routes', nRouteRows)
+    instrument.finish()
+    return instrument
+
+def initiateStudy(sdeConn, nElements, seed):
+    """Create a study in the cmr database for a benchmark run, returns the study id"""
+    strSQL = """EXECUTE [cmrSP_setStudyArea] @study_id=NULL, @study_name='benchmark {0}'
+                , @hazardzone_dataset_filepath='synthetic', @element_dataset_filepath='synthetic'
+                , @study_description='cmr_benchmark, seed {1}'""".format(nElements, seed)
+    sdeReturn = sdeConn.execute(strSQL)
+    if not isinstance(sdeReturn, list) or not sdeReturn[0][0] > 0:
+        raise Exception("Failed to initiate a study for the benchmark")
+    return int(sdeReturn[0][0])
+
+def removeStudy(sdeConn, studyId, nElements, seed):
+    """Delete a benchmark study and its results from the cmr database"""
+    strSQL = """EXECUTE [cmrSP_setStudyArea] @study_id={0}, @study_name='benchmark {1}'
+                , @hazardzone_dataset_filepath='synthetic', @element_dataset_filepath='synthetic'
+                , @study_description='cmr_benchmark, seed {2}', @reset=1""".format(studyId, nElements, seed)
+    sdeConn.execute(strSQL)
+    sdeConn.execute("DELETE FROM [cmrT_StudyArea] WHERE [study_id]={0}".format(studyId))
+
+def record(instrument, nElements, seed, database):
+    """A history record of a run: throughput per stage"""
+    report = instrument.report()
+    result = {'timestamp': report['started']
+              , 'commit': gitCommit()
+              , 'host': report['host']
+              , 'python': report['python']
+              , 'elements': nElements
+              , 'seed': seed
+              , 'database': database
+              , 'status': report['status']
+              , 'stages': {}}
+    for span in report['spans']:
+        result['stages'][span['name']] = dict((k, span[k]) for k in ['wall_seconds', 'cpu_seconds', 'rows', 'rows_per_second'
+                                                                      , 'db_calls', 'db_seconds', 'peak_memory_mb'])
+    return result
+
+def readHistory(historyFile):
+    history = []
+    if historyFile and os.path.exists(historyFile):
+        with open(historyFile) as f:
+            for line in f:
+                if line.strip():
+                    history.append(json.loads(line))
+    return history
+
+def appendHistory(historyFile, result):
+    with open(historyFile, 'a') as f:
+        f.write(json.dumps(result, sort_keys=True) + "\n")
+
+def compare(result, history):
+    """Relative change in throughput of each stage compared with the previous run of the same size,
+host and database setting. Returns {stage: change} (e.g. -0.25 is 25% fewer rows per second)"""
+    previous = [h for h in history if h['elements'] == result['elements'] and h['host'] == result['host']
+                and h.get('database') == result.get('database') and h['status'] == 'ok']
+    if not previous:
+        return {}
+    last = previous[-1]
+    changes = {}
+    for name, stage in result['stages'].items():
+        old = last['stages'].get(name, {}).get('rows_per_second')
+        new = stage.get('rows_per_second')
+        if old and new:
+            changes[name] = new/old-1.0
+    return changes
+
+def showResult(result, changes):
+    print("{0} elements ({1}):".format(result['elements'], result['status']))
+    for name in stages:
+        stage = result['stages'].get(name)
+        if stage is None:
+            continue
+        strMsg = "    {0:<15}{1:>10.2f} s{2:>12} rows{3:>14.0f} rows/s{4:>9.0f} MB".format(
+            name, stage['wall_seconds'], stage['rows'] if stage['rows'] is not None else '-'
+            , stage['rows_per_second'] or 0, stage['peak_memory_mb'] or 0)
+        if name in changes:
+            strMsg += "  {0:+.0%}".format(changes[name])
+            if changes[name] < -regressionThreshold:
+                strMsg += " REGRESSION"
+        print(strMsg)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the CICERO Multirisk pipeline on synthetic networks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=defaultSizes, help="numbers of input elements")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic networks")
+    parser.add_argument('--history', default='cmr_benchmark_history.jsonl', help="json lines file with the results of previous runs")
+    parser.add_argument('--sde', default=None, help="sde connection file, the import stages then use the cmr database")
+    parser.add_argument('--keep', action='store_true', help="keep the benchmark studies in the cmr database")
+    args = parser.parse_args()
+
+    sdeConn = None
+    if args.sde:
+        import arcpy
+        sdeConn = arcpy.ArcSDESQLExecute(args.sde)
+    history = readHistory(args.history)
+    regressions = 0
+    for size in args.sizes:
+        studyId = initiateStudy(sdeConn, size, args.seed) if sdeConn is not None else None
+        try:
+            instrument = runSize(size, args.seed, sdeConn, studyId)
+        except Exception as e:
+            print("{0} elements failed: {1}".format(size, e))
+            regressions += 1
+            continue
+        finally:
+            if studyId is not None and not args.keep:
+                removeStudy(sdeConn, studyId, size, args.seed)
+        result = record(instrument, size, args.seed, bool(sdeConn))
+        changes = compare(result, history)
+        showResult(result, changes)
+        regressions += len([c for c in changes.values() if c < -regressionThreshold])
+        appendHistory(args.history, result)
+        history.append(result)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import decimal
+import math
+import numbers
+import time
+
+def _isNull(value):
+    """True for None and for numbers that have no T-SQL value (NaN and infinity)"""
+    if value is None:
+        return True
+    if isinstance(value, decimal.Decimal):
+        return value.is_nan() or value.is_infinite()
+    if isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral):
+        value = float(value)
+        return math.isnan(value) or math.isinf(value)
+    return False
+
+def sqlLiteral(value):
+    """Format a python value as a T-SQL literal"""
+    if _isNull(value):
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, numbers.Real):
+        return repr(float(value))
+    return u"N'{0}'".format(value.replace("'", "''"))
+
+
+class cmrbulkloader:
+    """Streams rows into a table in the cmr database in large batches of multi-row INSERT statements
+Methods:
+load(rows)
+Loads an iterable of rows (dicts keyed by field name or sequences in the order of fields).
+Rows where any of the requiredPositive fields is NULL (or NaN/infinite) or <= 0 are filtered out while streaming.
+Returns a dict with rows_read, rows_loaded, rows_skipped, seconds and rows_per_second
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Number of rows per INSERT statement (sql server accepts at most 1000 rows in a VALUES clause)
+    batchSize = 1000
+    #Number of INSERT statements per transaction
+    batchesPerTransaction = 50
+    #Report progress every n loaded rows
+    reportInterval = 100000
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, sdeConn, tableName, fields, requiredPositive=None, msgFunc=None):
+        """sdeConn is an ArcSDESQLExecute connection (or any object with an execute method).
+Fields not in fields get their default, the OBJECTID of cmrT_ImportIntersectionTable is allocated by a sequence
+so concurrent loads never get the same id"""
+        self.__sdeConn = sdeConn
+        self.tableName = tableName
+        self.fields = list(fields)
+        self.requiredPositive = list(requiredPositive or [])
+        self.__msgFunc = msgFunc
+        self.__positiveIndex = [self.fields.index(f) for f in self.requiredPositive]
+
+    def __showMsg(self, strMsg):
+        if self.__msgFunc:
+            self.__msgFunc(strMsg)
+
+    def __transaction(self, method):
+        """Start, commit or rollback a transaction if the connection supports it"""
+        func = getattr(self.__sdeConn, method, None)
+        if func is not None:
+            func()
+
+    def __insert(self, batch):
+        """Insert one batch of rows with a single statement"""
+        values = []
+        for row in batch:
+            values.append("(" + ",".join(sqlLiteral(v) for v in row) + ")")
+        strSQL = "INSERT INTO [{0}] ({1}) VALUES {2}".format(self.tableName
+                                                              , ",".join("[{0}]".format(f) for f in self.fields)
+                                                              , ",".join(values))
+        self.__sdeConn.execute(strSQL)
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def load(self, rows):
+        """Stream rows into the table, returns load statistics"""
+        tic = time.time()
+        nRead = nLoaded = 0
+        nextReport = self.reportInterval
+        batch = []
+        nBatches = 0
+        inTransaction = False
+        try:
+            for row in rows:
+                nRead += 1
+                if isinstance(row, dict):
+                    row = [row.get(f) for f in self.fields]
+                #Skip rows with zero or undefined values in the required fields
+                if any(_isNull(row[i]) or row[i] <= 0 for i in self.__positiveIndex):
+                    continue
+                batch.append(row)
+                if len(batch) >= self.batchSize:
+                    if not inTransaction:
+                        self.__transaction('startTransaction')
+                        inTransaction = True
+                    self.__insert(batch)
+                    nLoaded += len(batch)
+                    batch = []
+                    nBatches += 1
+                    if nBatches % self.batchesPerTransaction == 0:
+                        self.__transaction('commitTransaction')
+                        inTransaction = False
+                    if nLoaded >= nextReport:
+                        self.__showMsg("Loaded {0} rows ({1:.0f} rows/s)".format(nLoaded, nLoaded/max(time.time()-tic, 1e-9)))
+                        nextReport += self.reportInterval
+            if batch:
+                if not inTransaction:
+                    self.__transaction('startTransaction')
+                    inTransaction = True
+                self.__insert(batch)
+                nLoaded += len(batch)
+            if inTransaction:
+                self.__transaction('commitTransaction')
+                inTransaction = False
+        except Exception:
+            if inTransaction:
+                self.__transaction('rollbackTransaction')
+            raise
+        seconds = time.time()-tic
+        stats = {'rows_read': nRead
+                 , 'rows_loaded': nLoaded
+                 , 'rows_skipped': nRead-nLoaded
+                 , 'seconds': seconds
+                 , 'rows_per_second': nLoaded/seconds if seconds > 0 else float(nLoaded)}
+        self.__showMsg("Loaded {0} of {1} rows into {2} in {3:.1f} s ({4:.0f} rows/s), skipped {5} rows with zero or undefined {6}".format(
+            nLoaded, nRead, self.tableName, seconds, stats['rows_per_second'], stats['rows_skipped'], " or ".join(self.requiredPositive)))
+        return stats
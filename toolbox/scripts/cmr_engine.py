@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+def fetchRows(sdeConn, strSQL):
+    """Execute a select statement with ArcSDESQLExecute and always return a list of rows"""
+    sdeReturn = sdeConn.execute(strSQL)
+    #ArcSDESQLExecute returns True for empty resultsets, a scalar for single values and a flat list for single rows
+    if not isinstance(sdeReturn, list):
+        if sdeReturn is True or sdeReturn is None:
+            return []
+        return [[sdeReturn]]
+    if len(sdeReturn) > 0 and not isinstance(sdeReturn[0], list):
+        return [sdeReturn]
+    return sdeReturn
+
+def toFloatArray(values):
+    """Convert a sequence of database values to a float array where NULL becomes nan"""
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+def toIntArray(values):
+    """Convert a sequence of database values to an integer array"""
+    return np.array([int(v) for v in values], dtype=np.int64)
+
+def roundDecimal(values, decimals=4):
+    """Round half away from zero, the way sql server casts float to DECIMAL/MONEY"""
+    scale = 10.0**decimals
+    return np.sign(values)*np.floor(np.abs(values)*scale+0.5)/scale
+
+def damageFunctionStats(damage_prob, damage_max, damage_exponent):
+    """Returns damage_avg, damage_PosErr and damage_NegErr as calculated in cmrT_DamageFunction and cmrV_DamageFunction"""
+    damage_prob, damage_max, damage_exponent = np.broadcast_arrays(np.asarray(damage_prob, dtype=np.float64)
+                                                                   , np.asarray(damage_max, dtype=np.float64)
+                                                                   , np.asarray(damage_exponent, dtype=np.float64))
+    damage_avg = damage_prob*damage_max/(damage_exponent+1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #The damage at the upper (16%) and lower (84%) confidence limit
+        upper = damage_max*np.power((damage_prob-0.16)/damage_prob, damage_exponent)
+        lower = damage_max*np.power((damage_prob-0.84)/damage_prob, damage_exponent)
+    damage_PosErr = np.where(damage_prob <= 0.16, 0.0, np.where(upper < damage_avg, 0.0, upper-damage_avg))
+    damage_NegErr = np.where(damage_prob <= 0.84, damage_avg, np.where(lower > damage_avg, 0.0, damage_avg-lower))
+    return damage_avg, damage_PosErr, damage_NegErr
+
+def groupIndex(*keys):
+    """Factorize one or more integer key arrays into a group index.
+Returns (index, first) where index maps each row to its group and first holds the first row of each group"""
+    if len(keys) == 1:
+        combined = np.asarray(keys[0])
+    else:
+        combined = np.zeros(len(keys[0]), dtype=np.int64)
+        for key in keys:
+            key = np.asarray(key, dtype=np.int64)
+            uniq, inv = np.unique(key, return_inverse=True)
+            combined = combined*len(uniq)+inv
+    uniq, first, index = np.unique(combined, return_index=True, return_inverse=True)
+    return index.ravel(), first
+
+def routeEventFrequency(zone, route, event_frequency, cooccurrence):
+    """The contribution from each element hazard zone pair to the route event frequency, adjusted for concurrent events
+(as stored in cmrT_ElementHazardZone by cmrSP_updateRouteEventFrequency).
+zone and route are integer keys per pair (route < 0 for elements without a route), cooccurrence is the factor of the zone.
+The pairs are sorted once by (route, zone), sum and maximum are reduced per segment and scattered back"""
+    zone = np.asarray(zone, dtype=np.int64)
+    route = np.asarray(route, dtype=np.int64)
+    event_frequency = np.asarray(event_frequency, dtype=np.float64)
+    route_event_frequency = np.zeros(len(route))
+    idx = np.nonzero(route >= 0)[0]
+    if len(idx) == 0:
+        return route_event_frequency
+    order = idx[np.lexsort((zone[idx], route[idx]))]
+    sortedZone = zone[order]
+    sortedRoute = route[order]
+    freq = event_frequency[order]
+    #Start of each (route, zone) segment in the sorted pairs
+    isStart = np.ones(len(order), dtype=bool)
+    isStart[1:] = (sortedZone[1:] != sortedZone[:-1]) | (sortedRoute[1:] != sortedRoute[:-1])
+    starts = np.nonzero(isStart)[0]
+    segment = np.cumsum(isStart)-1
+    freqSum = np.add.reduceat(freq, starts)
+    freqMax = np.maximum.reduceat(freq, starts)
+    #Cooccurrence factor is constant within a segment since it belongs to the hazard zone
+    cof = np.asarray(cooccurrence, dtype=np.float64)[order][starts]
+    freqAdj = freqMax+(1-cof)*(freqSum-freqMax)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        contribution = freqAdj[segment]*freq/freqSum[segment]
+    route_event_frequency[order] = np.where(np.isfinite(contribution), contribution, 0.0)
+    return route_event_frequency
+
+
+class cmrengine:
+    """In-process vectorized risk engine for CICERO Multirisk
+The engine loads the element hazard zone intersections of a study and the model parameter tables once
+and evaluates H, E_scaling, E and V as whole-array operations. The results are identical to the views
+cmrV_ElementHazardZone, cmrV_ElementValueDamages, cmrV_ElementValueDamagesPivot and the summary views.
+Methods:
+fromSde(sdeConn, studyId, parameterPack=None)
+Creates an engine with tables loaded through an ArcSDESQLExecute connection
+With a compiled parameter pack (cmr_params.cmrparameterpack) the parameter tables are not selected
+
+fromImportRows(studyId, importRows, parameterTables=None, parameterPack=None)
+Creates an engine from import table rows (as produced by the geometry backend) and parameter tables or a parameter pack
+
+dataHash()
+Returns a hash of the study data, together with parameterHash it identifies the results
+
+elementValueDamages()
+Returns a dict of arrays with one item per row in cmrV_ElementValueDamages
+
+elementSummary(), routeSummary(), processtypeSummary(), hazardzoneSummary(), studySummary()
+Returns rows with the same columns as the corresponding cmrV_*Summary view
+
+summaryArrays(level, rounded=True)
+Returns (keys, values) where keys is a dict of key arrays and values is an array with one column per summary column
+
+pairFrequencies()
+Returns the event and route event frequency (and element and impact size) of every element hazard zone pair
+
+parameterCombos()
+Returns the joined (elementtype, processtype, valuetype) parameter combinations as a dict of arrays
+    """
+    ########################################
+    ###        PRIVATE PROPERTIES        ###
+    ########################################
+    #Select statements for the tables needed by the engine, columns must be kept in the same order as tableColumns
+    __sqlSelectTables = {'element': """SELECT element_id, element_feature_id, element_size, elementtype_code, route_code
+                                        , aadt_passenger, aadt_goods, diversion_time
+                                        FROM cmrT_Element WHERE study_id={0}"""
+                         , 'hazardzone': """SELECT hazardzone_id, hazardzone_feature_id, processtype_id, event_frequency
+                                        , freq_error_interval_plus, freq_error_interval_minus
+                                        FROM cmrT_HazardZone WHERE study_id={0}"""
+                         , 'elementhazardzone': """SELECT element_id, hazardzone_id
+                                        FROM cmrT_ElementHazardZone WHERE study_id={0}"""
+                         , 'processtype': """SELECT processtype_id, processtype_name, event_width, frequency_size_factor
+                                        , event_cooccurrence_factor
+                                        FROM cmrT_ProcessType"""
+                         , 'elementtype': """SELECT et.elementtype_id, et.elementtype_code, ec.elementcategory_id, ec.elementcategory_name
+                                        FROM cmrT_ElementType et
+                                        INNER JOIN cmrT_ElementCategory ec ON et.elementcategory_id=ec.elementcategory_id"""
+                         , 'valuetype': """SELECT vt.valuetype_id, vt.valuetype_name, vt.valuetype_category_id
+                                        , vtu.use_element_event_frequency, vtu.use_route_event_frequency, vtu.use_element_impact_size
+                                        , vtu.use_aadt_passenger, vtu.use_aadt_goods, vtu.use_diversion_time
+                                        , vta.valuetype_category_name
+                                        FROM cmrT_ValueType vt
+                                        INNER JOIN cmrT_ValueTypeCalculation vtu ON vt.valuetype_calculation_id=vtu.valuetype_calculation_id
+                                        INNER JOIN cmrT_ValueTypeCategory vta ON vt.valuetype_category_id=vta.valuetype_category_id"""
+                         , 'elementvalue': """SELECT elementtype_id, valuetype_id, value_mean, value_PosErr, value_NegErr
+                                        FROM cmrT_ElementValue"""
+                         , 'damagefunction': """SELECT processtype_id, valuetype_id, damage_prob, damage_max, damage_exponent
+                                        FROM cmrT_DamageFunction"""
+                         }
+
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Columns of the tables passed to the engine
+    tableColumns = {'element': ['element_id', 'element_feature_id', 'element_size', 'elementtype_code', 'route_code'
+                                , 'aadt_passenger', 'aadt_goods', 'diversion_time']
+                    , 'hazardzone': ['hazardzone_id', 'hazardzone_feature_id', 'processtype_id', 'event_frequency'
+                                     , 'freq_error_interval_plus', 'freq_error_interval_minus']
+                    , 'elementhazardzone': ['element_id', 'hazardzone_id']
+                    , 'processtype': ['processtype_id', 'processtype_name', 'event_width', 'frequency_size_factor'
+                                      , 'event_cooccurrence_factor']
+                    , 'elementtype': ['elementtype_id', 'elementtype_code', 'elementcategory_id', 'elementcategory_name']
+                    , 'valuetype': ['valuetype_id', 'valuetype_name', 'valuetype_category_id'
+                                    , 'use_element_event_frequency', 'use_route_event_frequency', 'use_element_impact_size'
+                                    , 'use_aadt_passenger', 'use_aadt_goods', 'use_diversion_time', 'valuetype_category_name']
+                    , 'elementvalue': ['elementtype_id', 'valuetype_id', 'value_mean', 'value_PosErr', 'value_NegErr']
+                    , 'damagefunction': ['processtype_id', 'valuetype_id', 'damage_prob', 'damage_max', 'damage_exponent']
+                    }
+
+    #The valuetype categories that are pivoted to columns in cmrV_ElementValueDamagesPivot
+    summaryColumns = [(-1, 'EventFrequency')
+                      , (0, 'RouteEventFrequency')
+                      , (1, 'ClosureFrequency')
+                      , (2, 'ClosureDuration')
+                      , (3, 'RepairCosts')
+                      , (4, 'ReopeningCosts')
+                      , (5, 'ClosureCosts')]
+
+    #Hard coded valuetypes that cmrV_ElementValue and cmrV_DamageFunction add for every element type and process type
+    fixedValueTypes = [[-1, 'Event frequency', -1, 1, None, None, None, None, None, 'Event frequency']
+                       , [0, 'Route event frequency', 0, None, 1, None, None, None, None, 'Route event frequency']]
+
+    #Process types that are excluded by cmrV_HazardZone
+    excludedProcesstypes = [100]
+
+    #Tables with the data of a study, the other tables hold the model parameters
+    studyTableNames = ['element', 'hazardzone', 'elementhazardzone']
+
+    #Cache for summary arrays keyed by parameter and study data hashes (cmr_params.cmrresultcache)
+    resultCache = None
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, studyId, tables, parameterPack=None):
+        """tables holds the study tables and, unless a compiled parameterPack (cmr_params) is given, the parameter tables"""
+        from cmr_params import cmrparameterpack
+        self.studyId = studyId
+        self.__tables = tables
+        self.__rows = None
+        self.__dataHash = None
+        self.parameterPack = parameterPack if parameterPack is not None else cmrparameterpack.fromTables(tables)
+        self.parameterHash = self.parameterPack.hash
+        self.__compileParameters()
+        self.__loadStudyData()
+
+    def __compileParameters(self):
+        """Expand the parameter pack into a list of (elementtype, processtype, valuetype) combinations"""
+        pack = self.parameterPack
+        #Process types
+        self.processtypeIds = pack.processtypeIds
+        self.processtypeNames = pack.text('processtypeNames')
+        self.eventWidth = pack.eventWidth
+        self.frequencySizeFactor = pack.frequencySizeFactor
+        self.cooccurrenceFactor = pack.cooccurrenceFactor
+
+        #Element types, codes are matched the way sql server compares char columns
+        self.elementtypeIds = pack.elementtypeIds
+        self.elementtypeCodes = pack.text('elementtypeCodes')
+        self.elementcategoryNames = pack.text('elementcategoryNames')
+        self.__etCodeIndex = dict((str(code).rstrip().upper(), n) for n, code in enumerate(self.elementtypeCodes))
+
+        #Value types including the hard coded frequency value types
+        self.valuetypeIds = pack.valuetypeIds
+        self.valuetypeNames = pack.text('valuetypeNames')
+        self.valuetypeCategoryIds = pack.valuetypeCategoryIds
+        self.valuetypeCategoryNames = pack.text('valuetypeCategoryNames')
+
+        #Inner join element values and damage functions on valuetype, nonzero returns the combos sorted
+        #by (elementtype, processtype, valuetype) so they can be expanded per element hazardzone pair
+        et, pt, vt = np.nonzero(pack.hasValue[:, np.newaxis, :] & pack.hasDamage[np.newaxis, :, :])
+        nPt = max(len(self.processtypeIds), 1)
+        c = self.__combos = {}
+        c['elementtype'] = et.astype(np.int64)
+        c['processtype'] = pt.astype(np.int64)
+        c['valuetype'] = vt.astype(np.int64)
+        for name in ['value_mean', 'value_PosErr', 'value_NegErr']:
+            c[name] = getattr(pack, name)[et, vt]
+        c['flags'] = pack.valuetypeFlags[vt] if len(vt) else np.zeros((0, 6))
+        for name in ['damage_prob', 'damage_max', 'damage_exponent', 'V', 'V_PosErr', 'V_NegErr']:
+            c[name] = getattr(pack, name)[pt, vt]
+        c['fixed'] = pack.fixedDamage[pt, vt]
+        #Start and count of combos for each (elementtype, processtype) key
+        comboKey = c['elementtype']*nPt+c['processtype']
+        nKeys = max(len(self.elementtypeIds), 1)*nPt
+        self.__comboCount = np.bincount(comboKey, minlength=nKeys)
+        self.__comboStart = np.concatenate(([0], np.cumsum(self.__comboCount)[:-1]))
+        self.__nPt = nPt
+
+    def __loadStudyData(self):
+        """Load elements, hazard zones and intersections into arrays (one item per valid element hazardzone pair)"""
+        tables = self.__tables
+        #Elements (cmrV_Element), only elements with a known element type are kept
+        eRows = [r for r in tables['element'] if str(r[3]).rstrip().upper() in self.__etCodeIndex]
+        eIndex = dict((r[0], n) for n, r in enumerate(eRows))
+        self.elementIds = toIntArray([r[0] for r in eRows])
+        self.elementFeatureIds = toIntArray([r[1] for r in eRows])
+        self.elementSize = toFloatArray([r[2] for r in eRows])
+        self.elementElementtype = toIntArray([self.__etCodeIndex[str(r[3]).rstrip().upper()] for r in eRows])
+        #Route codes are factorized, None is kept as its own code
+        routes = [None if r[4] is None else r[4].rstrip() for r in eRows]
+        self.routeCodes = sorted(set([x for x in routes if x is not None]))
+        routeIndex = dict((code, n) for n, code in enumerate(self.routeCodes))
+        if None in routes:
+            routeIndex[None] = len(self.routeCodes)
+            self.routeCodes.append(None)
+        self.elementRoute = toIntArray([routeIndex[x] for x in routes])
+        self.aadtPassenger = toFloatArray([r[5] for r in eRows])
+        self.aadtGoods = toFloatArray([r[6] for r in eRows])
+        self.diversionTime = toFloatArray([r[7] for r in eRows])
+
+        #Hazard zones (cmrV_HazardZone), only zones with a known and included processtype are kept
+        ptIndex = dict((pid, n) for n, pid in enumerate(self.processtypeIds))
+        zRows = [r for r in tables['hazardzone'] if r[2] in ptIndex and r[2] not in self.excludedProcesstypes]
+        zIndex = dict((r[0], n) for n, r in enumerate(zRows))
+        self.hazardzoneIds = toIntArray([r[0] for r in zRows])
+        self.hazardzoneFeatureIds = toIntArray([r[1] for r in zRows])
+        self.hazardzoneProcesstype = toIntArray([ptIndex[r[2]] for r in zRows])
+        self.hazardzoneFrequency = toFloatArray([r[3] for r in zRows])
+        self.hazardzoneFreqPlus = toFloatArray([r[4] for r in zRows])
+        self.hazardzoneFreqMinus = toFloatArray([r[5] for r in zRows])
+
+        #Element hazardzone pairs (inner joined with elements and zones)
+        pRows = [r for r in tables['elementhazardzone'] if r[0] in eIndex and r[1] in zIndex]
+        self.pairElement = toIntArray([eIndex[r[0]] for r in pRows])
+        self.pairZone = toIntArray([zIndex[r[1]] for r in pRows])
+        #Pairs may carry the route_event_frequency stored by cmrSP_updateRouteEventFrequency (e.g. when a study is
+        #evaluated in chunks and the other pairs on the route are not loaded), otherwise it is computed from the pairs
+        self.pairRouteEventFrequency = None
+        if pRows and all(len(r) > 2 for r in pRows):
+            ref = toFloatArray([r[2] for r in pRows])
+            self.pairRouteEventFrequency = np.where(np.isnan(ref), 0.0, ref)
+
+    def __routeEventFrequency(self, event_frequency, cooccurrence):
+        """The contribution from each pair to the route event frequency, adjusted for concurrent events (route_event_frequency in cmrV_ElementHazardZone)"""
+        if self.pairRouteEventFrequency is not None:
+            return self.pairRouteEventFrequency
+        route = self.elementRoute[self.pairElement]
+        hasRoute = np.array([self.routeCodes[r] is not None for r in route], dtype=bool) if len(route) else np.zeros(0, dtype=bool)
+        return routeEventFrequency(self.pairZone, np.where(hasRoute, route, -1), event_frequency, cooccurrence)
+
+    def __evaluate(self):
+        """Evaluate H, E and V for every (pair, valuetype) row"""
+        if self.__rows is not None:
+            return self.__rows
+        pe, pz = self.pairElement, self.pairZone
+        pt = self.hazardzoneProcesstype[pz]
+        et = self.elementElementtype[pe]
+        pairs = self.pairFrequencies()
+        elementSize = pairs['element_size']
+        impactSize = pairs['impact_size']
+        event_frequency = pairs['event_frequency']
+        route_event_frequency = pairs['route_event_frequency']
+
+        #Expand every pair into its valuetype combinations
+        key = et*self.__nPt+pt
+        cnt = self.__comboCount[key] if len(key) else np.zeros(0, dtype=np.int64)
+        rowPair = np.repeat(np.arange(len(key)), cnt)
+        offset = np.arange(len(rowPair))-np.repeat(np.cumsum(cnt)-cnt, cnt)
+        rowCombo = np.repeat(self.__comboStart[key] if len(key) else np.zeros(0, dtype=np.int64), cnt)+offset
+        c = self.__combos
+        flags = c['flags'][rowCombo]
+        useEvent, useRoute, useImpact, useAadtP, useAadtG, useDiversion = [flags[:, n] for n in range(6)]
+
+        #cmrV_ElementValueDamages
+        H = useRoute*route_event_frequency[rowPair]
+        H = np.where(np.isnan(H), useEvent*event_frequency[rowPair], H)
+        scaling = useAadtG*self.aadtGoods[pe][rowPair]/24.0
+        for alt in [useAadtP*self.aadtPassenger[pe][rowPair]/24.0, useImpact*impactSize[rowPair]]:
+            scaling = np.where(np.isnan(alt), scaling, alt)
+        scaling = np.where(np.isnan(scaling), 1.0, scaling)
+        diversion = useDiversion*self.diversionTime[pe][rowPair]
+        E_scaling = scaling*np.where(np.isnan(diversion), 1.0, diversion)
+
+        rows = {}
+        rows['pair'] = rowPair
+        rows['combo'] = rowCombo
+        rows['valuetype'] = c['valuetype'][rowCombo]
+        rows['valuetype_category_id'] = self.valuetypeCategoryIds[rows['valuetype']]
+        rows['element_size'] = elementSize[rowPair]
+        rows['impact_size'] = impactSize[rowPair]
+        rows['event_frequency'] = event_frequency[rowPair]
+        rows['route_event_frequency'] = route_event_frequency[rowPair]
+        rows['H'] = H
+        rows['E_scaling'] = E_scaling
+        rows['E'] = c['value_mean'][rowCombo]*E_scaling
+        rows['E_PosErr'] = c['value_PosErr'][rowCombo]*E_scaling
+        rows['E_NegErr'] = c['value_NegErr'][rowCombo]*E_scaling
+        rows['V'] = c['V'][rowCombo]
+        rows['V_PosErr'] = c['V_PosErr'][rowCombo]
+        rows['V_NegErr'] = c['V_NegErr'][rowCombo]
+        rows['risk'] = rows['H']*rows['E']*rows['V']
+        self.__rows = rows
+        return rows
+
+    def __pivot(self):
+        """Pivot row risks into summary columns, each value rounded as in cmrV_ElementValueDamagesPivot"""
+        rows = self.__evaluate()
+        risk = np.where(np.isnan(rows['risk']), 0.0, rows['risk'])
+        values = np.zeros((len(risk), len(self.summaryColumns)))
+        for n, (categoryId, name) in enumerate(self.summaryColumns):
+            mask = rows['valuetype_category_id'] == categoryId
+            values[mask, n] = roundDecimal(risk[mask])
+        return values
+
+    def __summaryRows(self, level, keyNames):
+        """Summary arrays converted to rows with the study id first"""
+        keys, values = self.summaryArrays(level)
+        rows = []
+        for n in range(values.shape[0]):
+            keyVals = [keys[k][n] for k in keyNames]
+            keyVals = [int(v) if isinstance(v, np.integer) else v for v in keyVals]
+            rows.append([self.studyId] + keyVals + [float(v) for v in values[n]])
+        return rows
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    @classmethod
+    def fromSde(cls, sdeConn, studyId, parameterPack=None):
+        """Load the study and parameter tables through an ArcSDESQLExecute connection.
+With a parameterPack only the study tables are selected"""
+        tables = {}
+        for name, strSQL in cls.__sqlSelectTables.items():
+            if parameterPack is None or name in cls.studyTableNames:
+                tables[name] = fetchRows(sdeConn, strSQL.format(studyId))
+        return cls(studyId, tables, parameterPack)
+
+    @classmethod
+    def fetchParameterTables(cls, sdeConn):
+        """Select the parameter tables (all tables except the study tables) through an ArcSDESQLExecute connection"""
+        return dict((name, fetchRows(sdeConn, strSQL)) for name, strSQL in cls.__sqlSelectTables.items()
+                    if name not in cls.studyTableNames)
+
+    @classmethod
+    def fromImportRows(cls, studyId, importRows, parameterTables=None, parameterPack=None):
+        """Create an engine from rows of the import table (dicts keyed by import table fields) the way cmrSP_importResults
+stores them: one element per element_feature_id and one hazard zone per hazardzone_feature_id (also used as ids).
+Rows with zero or undefined event_frequency or element_size are skipped.
+parameterTables holds the processtype, elementtype, valuetype, elementvalue and damagefunction tables
+(or give a compiled parameterPack)"""
+        elements = {}
+        zones = {}
+        pairs = set()
+        for row in importRows:
+            if not row.get('event_frequency') or row['event_frequency'] <= 0 or not row.get('element_size') or row['element_size'] <= 0:
+                continue
+            eid = row['element_feature_id']
+            zid = row['hazardzone_feature_id']
+            if eid not in elements:
+                elements[eid] = [eid, eid, row['element_size'], row.get('elementtype_code'), row.get('route_code')
+                                 , row.get('aadt_passenger') or 0, row.get('aadt_goods') or 0, row.get('diversion_time') or 0]
+            if zid not in zones:
+                zones[zid] = [zid, zid, row.get('processtype_id') or 0, row['event_frequency']
+                              , row.get('freq_interval_plus') or 0, row.get('freq_interval_minus') or 0]
+            pairs.add((eid, zid))
+        tables = dict(parameterTables or {})
+        tables['element'] = [elements[k] for k in sorted(elements)]
+        tables['hazardzone'] = [zones[k] for k in sorted(zones)]
+        tables['elementhazardzone'] = sorted(pairs)
+        return cls(studyId, tables, parameterPack)
+
+    def dataHash(self):
+        """sha1 of the study data used by the engine (elements, hazard zones and their intersections)"""
+        if self.__dataHash is None:
+            import hashlib
+            h = hashlib.sha1()
+            for arr in [self.elementIds, self.elementFeatureIds, self.elementSize, self.elementtypeIds[self.elementElementtype]
+                        , self.elementRoute, self.aadtPassenger, self.aadtGoods, self.diversionTime
+                        , self.hazardzoneIds, self.hazardzoneFeatureIds, self.processtypeIds[self.hazardzoneProcesstype]
+                        , self.hazardzoneFrequency, self.hazardzoneFreqPlus, self.hazardzoneFreqMinus
+                        , self.pairElement, self.pairZone]:
+                h.update(np.ascontiguousarray(arr).tobytes())
+            h.update(u'\n'.join(u'' if code is None else code for code in self.routeCodes).encode('utf-8'))
+            self.__dataHash = h.hexdigest()
+        return self.__dataHash
+
+    def pairFrequencies(self):
+        """element_size, impact_size, event_frequency and route_event_frequency of every element hazard zone pair
+(as in cmrV_ElementHazardZone), as a dict of arrays in the order of pairElement and pairZone"""
+        pe, pz = self.pairElement, self.pairZone
+        pt = self.hazardzoneProcesstype[pz]
+        elementSize = self.elementSize[pe]
+        eventWidth = self.eventWidth[pt]
+        fsf = self.frequencySizeFactor[pt]
+        event_frequency = np.where(np.isnan(fsf), 1.0, elementSize*fsf)/self.hazardzoneFrequency[pz]
+        return {'element_size': elementSize
+                , 'impact_size': np.where(np.isnan(eventWidth), elementSize, eventWidth)
+                , 'event_frequency': event_frequency
+                , 'route_event_frequency': self.__routeEventFrequency(event_frequency, self.cooccurrenceFactor[pt])}
+
+    def elementValueDamages(self):
+        """Returns the rows of cmrV_ElementValueDamages for the study as a dict of arrays"""
+        rows = dict(self.__evaluate())
+        pair = rows['pair']
+        rows['element_id'] = self.elementIds[self.pairElement[pair]]
+        rows['element_feature_id'] = self.elementFeatureIds[self.pairElement[pair]]
+        rows['hazardzone_id'] = self.hazardzoneIds[self.pairZone[pair]]
+        rows['hazardzone_feature_id'] = self.hazardzoneFeatureIds[self.pairZone[pair]]
+        rows['valuetype_id'] = self.valuetypeIds[rows['valuetype']]
+        return rows
+
+    def parameterCombos(self):
+        """Returns a dict of arrays with one item per (elementtype, processtype, valuetype) combination.
+elementtype, processtype and valuetype are indexes into elementtypeIds, processtypeIds and valuetypeIds,
+fixed is True for the hard coded frequency value types (their value and damage are always 1)"""
+        return dict(self.__combos)
+
+    def summaryArrays(self, level, rounded=True):
+        """Sum the pivoted risk over a summary level ('element', 'route', 'processtype', 'hazardzone', 'study' or 'pair',
+the last gives one row per element hazard zone pair in the order of pairElement and pairZone)
+With a resultCache the arrays are read from and stored in the cache.
+With rounded=False the sums are not rounded, so partial sums (e.g. of chunks of a study) can be added before rounding"""
+        if self.resultCache is not None and rounded:
+            cached = self.resultCache.get(self, level)
+            if cached is not None:
+                return cached
+        rows = self.__evaluate()
+        values = self.__pivot()
+        pair = rows['pair']
+        if level == 'element':
+            group, first = groupIndex(self.pairElement[pair])
+            ei = self.pairElement[pair][first]
+            keys = {'element_id': self.elementIds[ei], 'element_feature_id': self.elementFeatureIds[ei]}
+        elif level == 'route':
+            route = self.elementRoute[self.pairElement[pair]]
+            group, first = groupIndex(route)
+            keys = {'route_code': [self.routeCodes[r] for r in route[first]]}
+        elif level == 'processtype':
+            names = np.array([self.processtypeNames[p] for p in self.hazardzoneProcesstype[self.pairZone[pair]]], dtype=object)
+            nameIndex = dict((name, n) for n, name in enumerate(sorted(set(self.processtypeNames))))
+            group, first = groupIndex(toIntArray([nameIndex[x] for x in names]))
+            keys = {'processtype_name': list(names[first])}
+        elif level == 'hazardzone':
+            group, first = groupIndex(self.pairZone[pair])
+            zi = self.pairZone[pair][first]
+            keys = {'hazardzone_id': self.hazardzoneIds[zi], 'hazardzone_feature_id': self.hazardzoneFeatureIds[zi]}
+        elif level == 'pair':
+            group = pair
+            first = np.arange(len(self.pairElement))
+            keys = {'element_id': self.elementIds[self.pairElement], 'hazardzone_id': self.hazardzoneIds[self.pairZone]}
+        elif level == 'study':
+            group = np.zeros(len(pair), dtype=np.int64)
+            first = np.zeros(min(len(pair), 1), dtype=np.int64)
+            keys = {}
+        else:
+            raise Exception("Unknown summary level '{0}'".format(level))
+        nGroups = len(first)
+        sums = np.zeros((nGroups, values.shape[1]))
+        for n in range(values.shape[1]):
+            sums[:, n] = np.bincount(group, weights=values[:, n], minlength=nGroups)
+        if not rounded:
+            return keys, sums
+        sums = roundDecimal(sums)
+        if self.resultCache is not None:
+            self.resultCache.put(self, level, keys, sums)
+        return keys, sums
+
+    def elementSummary(self):
+        """Rows of cmrV_ElementSummary: study_id, element_id, element_feature_id and the summary columns"""
+        return self.__summaryRows('element', ['element_id', 'element_feature_id'])
+
+    def routeSummary(self):
+        """Rows of cmrV_RouteSummary: study_id, route_code and the summary columns"""
+        return self.__summaryRows('route', ['route_code'])
+
+    def processtypeSummary(self):
+        """Rows of cmrV_ProcesstypeSummary: study_id, processtype_name and the summary columns"""
+        return self.__summaryRows('processtype', ['processtype_name'])
+
+    def hazardzoneSummary(self):
+        """Rows of cmrV_HazardZoneSummary: study_id, hazardzone_id, hazardzone_feature_id and the summary columns"""
+        return self.__summaryRows('hazardzone', ['hazardzone_id', 'hazardzone_feature_id'])
+
+    def studySummary(self):
+        """Rows of cmrV_StudySummary: study_id and the summary columns"""
+        return self.__summaryRows('study', [])
+
+
+class cmrriskattributes:
+    """The element and route summaries of a cmrengine looked up per output feature, for writing risk attributes into
+fields of the output features (as cmrstudy.writeRiskAttributes does)
+Methods:
+elementValues(featureId)
+The element summary values of a feature (element_feature_id), NULLs if the feature has no results
+
+routeValues(routeCode)
+The route summary values of a route code (trailing blanks are ignored as in cmrV_Element).
+A NULL route code gets NULLs, as when the route summary is joined on the route field
+    """
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, engine):
+        self.names = [name for categoryId, name in engine.summaryColumns]
+        keys, values = engine.summaryArrays('element')
+        self.__elementRows = dict((int(fid), n) for n, fid in enumerate(keys['element_feature_id']))
+        self.__elementValues = values.tolist()
+        keys, values = engine.summaryArrays('route')
+        self.__routeRows = dict((code, n) for n, code in enumerate(keys['route_code']))
+        self.__routeValues = values.tolist()
+        self.__noValues = [None]*len(self.names)
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def elementValues(self, featureId):
+        n = self.__elementRows.get(featureId)
+        return list(self.__elementValues[n] if n is not None else self.__noValues)
+
+    def routeValues(self, routeCode):
+        n = self.__routeRows.get(routeCode.rstrip()) if routeCode is not None else None
+        return list(self.__routeValues[n] if n is not None else self.__noValues)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import numpy as np
+
+#Summary levels that are exported and their key columns (as in the cmrV_*Summary views)
+summaryLevels = [('element', ['element_id', 'element_feature_id'])
+                 , ('route', ['route_code'])
+                 , ('hazardzone', ['hazardzone_id', 'hazardzone_feature_id'])
+                 , ('processtype', ['processtype_name'])
+                 , ('study', [])]
+
+#Name of the manifest file in an export directory
+manifestName = 'manifest.json'
+
+def hasArrow():
+    """True if pyarrow (needed for parquet files) is installed"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+def _columnArray(values):
+    """Key columns as numpy arrays, text becomes a fixed width unicode array (NULL as empty string) so it can be memory-mapped"""
+    values = list(values)
+    if values and all(v is None or isinstance(v, (int, np.integer)) for v in values):
+        return np.array([-1 if v is None else v for v in values], dtype=np.int64)
+    text = [u'' if v is None else u'{0}'.format(v) for v in values]
+    width = max([len(t) for t in text] + [1])
+    return np.array(text, dtype='U{0}'.format(width))
+
+def summaryTables(engine):
+    """The summaries of a cmrengine as {level: (columnNames, {column: array})}, with study_id and the pivot columns"""
+    tables = {}
+    valueNames = [name for categoryId, name in engine.summaryColumns]
+    for level, keyNames in summaryLevels:
+        keys, values = engine.summaryArrays(level)
+        columns = {'study_id': np.repeat(np.int64(engine.studyId), len(values))}
+        for name in keyNames:
+            arr = np.asarray(keys[name])
+            columns[name] = arr.astype(np.int64) if arr.dtype.kind in 'iu' else _columnArray(keys[name])
+        for n, name in enumerate(valueNames):
+            columns[name] = np.ascontiguousarray(values[:, n])
+        tables[level] = (['study_id'] + keyNames + valueNames, columns)
+    return tables
+
+
+class cmrexporter:
+    """Writes the element, route, hazard zone, process type and study summaries of a study (with the valuetype
+category pivot columns) to a directory in columnar formats:
+- npy: one .npy file per column, read with np.load(mmap_mode='r') the columns are memory-mapped (zero-copy)
+- parquet: one compressed parquet file per level (requires pyarrow, skipped with a message if it is missing)
+A manifest.json in the directory lists the levels, columns, row counts and files.
+Methods:
+exportEngine(engine)
+Exports the summaries computed by a cmrengine, returns the manifest
+
+The module function readSummary(directory, level, mmap=True) reads a level back as a dict of arrays
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Formats that are written
+    formats = ['npy', 'parquet']
+    #Compression of the parquet files
+    parquetCompression = 'zstd'
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, directory, formats=None, msgFunc=None):
+        self.directory = directory
+        if formats is not None:
+            self.formats = list(formats)
+        self.__msgFunc = msgFunc
+
+    def __showMsg(self, strMsg):
+        if self.__msgFunc:
+            self.__msgFunc(strMsg)
+
+    def __writeNpy(self, level, names, columns):
+        levelDir = os.path.join(self.directory, level)
+        if not os.path.isdir(levelDir):
+            os.makedirs(levelDir)
+        files = {}
+        for name in names:
+            filename = os.path.join(levelDir, name + '.npy')
+            np.save(filename, columns[name])
+            files[name] = os.path.relpath(filename, self.directory)
+        return files
+
+    def __writeParquet(self, level, names, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrays = []
+        for name in names:
+            arr = columns[name]
+            if arr.dtype.kind == 'U':
+                #Empty strings are NULL in the cmr tables
+                arrays.append(pa.array([v if v else None for v in arr.tolist()], type=pa.string()))
+            else:
+                arrays.append(pa.array(arr))
+        filename = os.path.join(self.directory, level + '.parquet')
+        pq.write_table(pa.Table.from_arrays(arrays, names=names), filename, compression=self.parquetCompression)
+        return os.path.relpath(filename, self.directory)
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def exportEngine(self, engine):
+        """Export the summaries of a cmrengine, returns the manifest"""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        writeParquet = 'parquet' in self.formats
+        if writeParquet and not hasArrow():
+            self.__showMsg("pyarrow is not installed, parquet files are not written")
+            writeParquet = False
+        manifest = {'study_id': int(engine.studyId)
+                    , 'parameter_hash': engine.parameterHash
+                    , 'data_hash': engine.dataHash()
+                    , 'created': datetime.datetime.now().isoformat()
+                    , 'levels': {}}
+        for level, (names, columns) in sorted(summaryTables(engine).items()):
+            entry = {'rows': int(len(columns['study_id']))
+                     , 'columns': names
+                     , 'dtypes': dict((name, columns[name].dtype.str) for name in names)}
+            if 'npy' in self.formats:
+                entry['npy'] = self.__writeNpy(level, names, columns)
+            if writeParquet:
+                entry['parquet'] = self.__writeParquet(level, names, columns)
+            manifest['levels'][level] = entry
+        with open(os.path.join(self.directory, manifestName), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        self.__showMsg("Exported {0} summary levels to {1}".format(len(manifest['levels']), self.directory))
+        return manifest
+
+
+def readManifest(directory):
+    with open(os.path.join(directory, manifestName)) as f:
+        return json.load(f)
+
+def readSummary(directory, level, mmap=True, columns=None):
+    """Read a summary level of an export as {column: array}. The npy columns are memory-mapped if mmap is True
+(nothing is read until the arrays are used), otherwise the parquet file is read if there are no npy files"""
+    manifest = readManifest(directory)
+    entry = manifest['levels'][level]
+    names = columns or entry['columns']
+    if 'npy' in entry:
+        return dict((name, np.load(os.path.join(directory, entry['npy'][name]), mmap_mode='r' if mmap else None)) for name in names)
+    if 'parquet' in entry:
+        import pyarrow.parquet as pq
+        table = pq.read_table(os.path.join(directory, entry['parquet']), columns=names)
+        return dict((name, table.column(name).to_numpy()) for name in names)
+    raise Exception("The export in {0} has no files for level {1}".format(directory, level))
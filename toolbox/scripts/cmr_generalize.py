@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import bisect
+import math
+from cmr_geometry import lineLength
+
+def simplifyLine(coords, tolerance):
+    """Douglas-Peucker simplification of a polyline (list of (x, y)), the end points are always kept"""
+    n = len(coords)
+    if n < 3 or tolerance <= 0:
+        return list(coords)
+    keep = [False]*n
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = coords[first], coords[last]
+        dx, dy = x2-x1, y2-y1
+        length = math.hypot(dx, dy)
+        maxDistance, index = -1.0, None
+        for i in range(first+1, last):
+            x, y = coords[i]
+            if length > 0:
+                distance = abs(dy*(x-x1)-dx*(y-y1))/length
+            else:
+                distance = math.hypot(x-x1, y-y1)
+            if distance > maxDistance:
+                maxDistance, index = distance, i
+        if index is not None and maxDistance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [c for c, k in zip(coords, keep) if k]
+
+def quantileBreaks(values, nClasses):
+    """Upper class breaks that split the positive values in nClasses classes with about the same number of values"""
+    positive = sorted(v for v in values if v is not None and v > 0)
+    if not positive:
+        return []
+    breaks = []
+    for k in range(1, nClasses):
+        value = positive[min(int(len(positive)*k/float(nClasses)), len(positive)-1)]
+        if not breaks or value > breaks[-1]:
+            breaks.append(value)
+    return breaks
+
+def riskClass(value, breaks):
+    """0 for no risk (None or 0), otherwise 1 + the number of breaks below the value"""
+    if value is None or value <= 0:
+        return 0
+    return bisect.bisect_left(breaks, value)+1
+
+def mergeLines(lines, tolerance):
+    """Join lines (lists of (x, y)) that meet end to end where no other line ends, returns a list of
+(coords, members) where members are the indexes of the joined lines in order"""
+    def key(point):
+        return (int(round(point[0]/tolerance)), int(round(point[1]/tolerance)))
+    ends = {}
+    for n, coords in enumerate(lines):
+        for end in [0, -1]:
+            ends.setdefault(key(coords[end]), []).append(n)
+    used = [False]*len(lines)
+    merged = []
+    for first in range(len(lines)):
+        if used[first]:
+            continue
+        used[first] = True
+        coords = list(lines[first])
+        members = [first]
+        #Extend the end of the chain, then reverse and extend the other end
+        for side in range(2):
+            while True:
+                candidates = ends.get(key(coords[-1]), [])
+                if len(candidates) != 2:
+                    break
+                others = [c for c in candidates if c != members[-1]]
+                if len(others) != 1 or used[others[0]]:
+                    break
+                other = others[0]
+                line = lines[other]
+                if key(line[0]) != key(coords[-1]):
+                    line = line[::-1]
+                coords.extend(line[1:])
+                members.append(other)
+                used[other] = True
+            coords.reverse()
+            members.reverse()
+        merged.append((coords, members))
+    return merged
+
+
+class cmrgeneralizer:
+    """Simplified versions of the output segments at several scale levels for drawing results at overview scales
+Segments are classified by their risk (quantile classes of the positive values unless breaks are given, class 0 has no risk).
+At each level the lines are simplified with Douglas-Peucker using the tolerance of the level, and at merged levels
+adjacent segments with the same route and risk class are first joined into one line, so an overview draws a few
+long lines with few vertices instead of every split segment.
+Segments are (oid, parts, route_code, value) where parts is a list of polylines (lists of (x, y)).
+Methods:
+generalize(segments)
+Returns a dict level -> list of features (parts, route_code, risk_class, risk, length, n_segments, oid),
+risk is the sum of the values of the joined segments and oid is None for joined features
+
+vertexCounts
+The number of vertices of the segments and of each level after generalize
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Levels as (tolerance in map units, merge adjacent segments), a tolerance of about one pixel gives no visible change
+    #(5 m at 1:20 000, 25 m at 1:100 000, 125 m at 1:500 000, 625 m at 1:2 500 000)
+    levels = [(5.0, False), (25.0, True), (125.0, True), (625.0, True)]
+    #Number of risk classes when no breaks are given
+    nClasses = 5
+    #Line ends closer than this (map units) are joined
+    snapTolerance = 0.01
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, levels=None, breaks=None, nClasses=None):
+        if levels is not None:
+            self.levels = levels
+        if nClasses is not None:
+            self.nClasses = nClasses
+        self.breaks = breaks
+        self.vertexCounts = {}
+
+    def __simplifyParts(self, parts, tolerance):
+        return [simplifyLine(part, tolerance) for part in parts if len(part) > 1]
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def generalize(self, segments):
+        breaks = self.breaks if self.breaks is not None else quantileBreaks([s[3] for s in segments], self.nClasses)
+        classes = [riskClass(s[3], breaks) for s in segments]
+        self.breaks = breaks
+        self.vertexCounts = {0: sum(len(part) for s in segments for part in s[1])}
+        #Parts grouped by route and risk class for the merged levels
+        groups = {}
+        for n, (oid, parts, route, value) in enumerate(segments):
+            for part in parts:
+                if len(part) > 1:
+                    groups.setdefault((route, classes[n]), []).append((part, n))
+        result = {}
+        for level, (tolerance, merge) in enumerate(self.levels):
+            features = []
+            if merge:
+                for (route, cls), items in sorted(groups.items(), key=lambda g: (g[0][0] is not None, g[0])):
+                    for coords, members in mergeLines([part for part, n in items], self.snapTolerance):
+                        segmentIndexes = sorted(set(items[m][1] for m in members))
+                        risk = sum(segments[n][3] or 0.0 for n in segmentIndexes)
+                        features.append(([simplifyLine(coords, tolerance)], route, cls, risk, lineLength(coords)
+                                         , len(segmentIndexes), None))
+            else:
+                for n, (oid, parts, route, value) in enumerate(segments):
+                    simplified = self.__simplifyParts(parts, tolerance)
+                    if simplified:
+                        features.append((simplified, route, classes[n], value, sum(lineLength(p) for p in parts if len(p) > 1), 1, oid))
+            result[level+1] = features
+            self.vertexCounts[level+1] = sum(len(part) for f in features for part in f[0])
+        return result
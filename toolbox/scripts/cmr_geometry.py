@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+import math
+
+def lineLength(coords):
+    """Length of a polyline given as a list of (x, y) tuples"""
+    return sum(math.hypot(x2-x1, y2-y1) for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]))
+
+def boundingBox(coords):
+    """Returns (xmin, ymin, xmax, ymax) of a list of (x, y) tuples"""
+    xs = [c[0] for c in coords]
+    ys = [c[1] for c in coords]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def ringEdges(ring):
+    """Edges of a polygon ring, the ring is closed if the last vertex differs from the first"""
+    edges = list(zip(ring[:-1], ring[1:]))
+    if len(ring) > 2 and tuple(ring[0]) != tuple(ring[-1]):
+        edges.append((ring[-1], ring[0]))
+    return edges
+
+def pointAt(coords, position):
+    """The point at a position (edge index + fraction) along a polyline"""
+    i = int(math.floor(position))
+    if i >= len(coords)-1:
+        return tuple(coords[-1])
+    t = position-i
+    (x1, y1), (x2, y2) = coords[i], coords[i+1]
+    return (x1+t*(x2-x1), y1+t*(y2-y1))
+
+def subLine(coords, start, end):
+    """The part of a polyline between two positions (edge index + fraction)"""
+    line = [pointAt(coords, start)]
+    k = int(math.floor(start))+1
+    while k < end and k < len(coords):
+        line.append(tuple(coords[k]))
+        k += 1
+    line.append(pointAt(coords, end))
+    return line
+
+def pointAlong(coords, distance):
+    """The point at a given distance along a polyline"""
+    for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+        d = math.hypot(x2-x1, y2-y1)
+        if d > 0 and distance <= d:
+            t = distance/d
+            return (x1+t*(x2-x1), y1+t*(y2-y1))
+        distance -= d
+    return tuple(coords[-1])
+
+def segmentCrossings(p1, p2, q1, q2):
+    """Fractions along p1-p2 where it touches q1-q2 (both ends of the overlap for collinear segments)"""
+    rx, ry = p2[0]-p1[0], p2[1]-p1[1]
+    sx, sy = q2[0]-q1[0], q2[1]-q1[1]
+    qpx, qpy = q1[0]-p1[0], q1[1]-p1[1]
+    denom = rx*sy-ry*sx
+    if denom == 0:
+        rr = rx*rx+ry*ry
+        if rr == 0 or qpx*ry-qpy*rx != 0:
+            return []
+        #Collinear segments, return the ends of the overlap
+        t0 = (qpx*rx+qpy*ry)/rr
+        t1 = ((q2[0]-p1[0])*rx+(q2[1]-p1[1])*ry)/rr
+        return [t for t in (t0, t1) if 0.0 <= t <= 1.0]
+    t = (qpx*sy-qpy*sx)/denom
+    u = (qpx*ry-qpy*rx)/denom
+    if 0.0 <= t <= 1.0 and 0.0 <= u <= 1.0:
+        return [t]
+    return []
+
+def pointInPolygon(x, y, rings):
+    """Even-odd test of a point against all rings (outer rings and holes) of a polygon"""
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in ringEdges(ring):
+            if (y1 > y) != (y2 > y):
+                if x < x1+(y-y1)*(x2-x1)/(y2-y1):
+                    inside = not inside
+    return inside
+
+def pointOnBoundary(x, y, rings, tolerance):
+    """True if a point is within tolerance of an edge of any ring of a polygon"""
+    for (x1, y1), (x2, y2) in (e for ring in rings for e in ringEdges(ring)):
+        dx, dy = x2-x1, y2-y1
+        dd = dx*dx+dy*dy
+        t = 0.0 if dd == 0 else max(0.0, min(1.0, ((x-x1)*dx+(y-y1)*dy)/dd))
+        if math.hypot(x-x1-t*dx, y-y1-t*dy) <= tolerance:
+            return True
+    return False
+
+
+class cmrrtree:
+    """Static R-tree over bounding boxes, bulk loaded with the Sort-Tile-Recursive algorithm
+Methods:
+query(xmin, ymin, xmax, ymax)
+Returns the payloads of all items with a bounding box that intersects the given box
+    """
+    def __init__(self, items, nodeCapacity=16):
+        """Items is a list of (xmin, ymin, xmax, ymax, payload)"""
+        self.nodeCapacity = nodeCapacity
+        #A node is (xmin, ymin, xmax, ymax, children, payload), leaf items have children None
+        level = [(b[0], b[1], b[2], b[3], None, b[4]) for b in items]
+        self.size = len(level)
+        while len(level) > nodeCapacity:
+            level = self.__pack(level)
+        self.__root = self.__node(level) if len(level) else None
+
+    def __node(self, children):
+        return (min(c[0] for c in children), min(c[1] for c in children)
+                , max(c[2] for c in children), max(c[3] for c in children), children, None)
+
+    def __pack(self, level):
+        """Pack one level of nodes into parent nodes"""
+        cap = self.nodeCapacity
+        nNodes = int(math.ceil(len(level)/float(cap)))
+        nSlices = int(math.ceil(math.sqrt(nNodes)))
+        sliceSize = nSlices*cap
+        level = sorted(level, key=lambda n: n[0]+n[2])
+        parents = []
+        for s in range(0, len(level), sliceSize):
+            vslice = sorted(level[s:s+sliceSize], key=lambda n: n[1]+n[3])
+            for n in range(0, len(vslice), cap):
+                parents.append(self.__node(vslice[n:n+cap]))
+        return parents
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """Returns the payloads of all items that intersect the box"""
+        result = []
+        if self.__root is None:
+            return result
+        stack = [self.__root]
+        while stack:
+            node = stack.pop()
+            if node[0] > xmax or node[2] < xmin or node[1] > ymax or node[3] < ymin:
+                continue
+            if node[4] is None:
+                result.append(node[5])
+            else:
+                stack.extend(node[4])
+        return result
+
+
+class indexedGeometryBackend:
+    """Geometry backend that splits elements at zone boundaries and intersects them with hazard zones
+using R-tree indexes, so only candidate pairs are tested. It does not depend on arcpy.
+Elements are given as (oid, parts, attributes) where parts is a list of polylines (lists of (x, y)).
+Zones are given as (oid, rings, attributes) where rings is a list of rings (lists of (x, y)).
+Methods:
+splitElements(elements, zones)
+Splits the elements where they cross zone boundaries (and each other, as FeatureToLine does).
+Returns a list of segments (source_oid, part_index, start, end, coords, attributes)
+where start and end are positions (edge index + fraction) along the source part
+
+intersectElements(segments, zones)
+Returns a list of (segment_index, zone_oid, length) for every segment that lies within a zone
+(segments along a zone boundary lie within the zone, as in the Intersect tool)
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Split elements where they cross each other, like FeatureToLine does
+    splitAtElementCrossings = True
+    #Points closer than this are treated as the same point and shorter segments are dropped
+    tolerance = 1e-6
+    #Number of boundary edges per entry in the zone boundary index
+    edgeChunkSize = 32
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, splitAtElementCrossings=None, tolerance=None):
+        if splitAtElementCrossings is not None:
+            self.splitAtElementCrossings = splitAtElementCrossings
+        if tolerance is not None:
+            self.tolerance = tolerance
+        self.__zoneTree = None
+        self.__boundaryTree = None
+        self.__elementTree = None
+
+    def __edgeChunks(self, lines, key):
+        """Index entries for chunks of consecutive edges of a list of lines"""
+        items = []
+        size = self.edgeChunkSize
+        for n, edges in enumerate(lines):
+            for s in range(0, len(edges), size):
+                chunk = edges[s:s+size]
+                pts = [p for e in chunk for p in e]
+                bbox = boundingBox(pts)
+                items.append((bbox[0], bbox[1], bbox[2], bbox[3], (key(n), chunk)))
+        return items
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def indexZones(self, zones):
+        """Build the polygon index (for point queries) and the boundary index (for splitting)"""
+        polygons = []
+        boundaries = []
+        for oid, rings, attrs in zones:
+            pts = [p for ring in rings for p in ring]
+            if not pts:
+                continue
+            bbox = boundingBox(pts)
+            polygons.append((bbox[0], bbox[1], bbox[2], bbox[3], (oid, rings)))
+            boundaries.append([e for ring in rings for e in ringEdges(ring)])
+        self.__zoneTree = cmrrtree(polygons)
+        self.__boundaryTree = cmrrtree(self.__edgeChunks(boundaries, lambda n: None))
+
+    def indexElements(self, elements):
+        """Build the element edge index used for splitting elements where they cross each other"""
+        lines = []
+        keys = []
+        for oid, parts, attrs in elements:
+            for p, part in enumerate(parts):
+                lines.append(list(zip(part[:-1], part[1:])))
+                keys.append((oid, p))
+        self.__elementTree = cmrrtree(self.__edgeChunks(lines, lambda n: keys[n]))
+
+    def cutPositions(self, oid, partIndex, coords, edges=None):
+        """Positions (edge index + fraction) where a part crosses zone boundaries or other elements.
+If edges is given, only those edge indexes are examined"""
+        positions = []
+        nEdges = len(coords)-1
+        for i in (range(nEdges) if edges is None else edges):
+            p1, p2 = coords[i], coords[i+1]
+            xmin, xmax = min(p1[0], p2[0]), max(p1[0], p2[0])
+            ymin, ymax = min(p1[1], p2[1]), max(p1[1], p2[1])
+            candidates = self.__boundaryTree.query(xmin, ymin, xmax, ymax) if self.__boundaryTree else []
+            if self.splitAtElementCrossings and self.__elementTree:
+                for key, chunk in self.__elementTree.query(xmin, ymin, xmax, ymax):
+                    if key != (oid, partIndex):
+                        candidates.append((key, chunk))
+                    else:
+                        #Self intersections, but not with the edge itself or its neighbours
+                        candidates.append((key, [e for e in chunk if tuple(e[0]) not in (tuple(p1), tuple(p2))
+                                                 and tuple(e[1]) not in (tuple(p1), tuple(p2))]))
+            for key, chunk in candidates:
+                for q1, q2 in chunk:
+                    if max(q1[0], q2[0]) < xmin or min(q1[0], q2[0]) > xmax or max(q1[1], q2[1]) < ymin or min(q1[1], q2[1]) > ymax:
+                        continue
+                    for t in segmentCrossings(p1, p2, q1, q2):
+                        pos = i+t
+                        if 0.0 < pos < nEdges:
+                            positions.append(pos)
+        return positions
+
+    def piecesFromPositions(self, coords, positions):
+        """Split a part at the given positions, returns a list of (start, end, coords)"""
+        tol = self.tolerance
+        cuts = [0.0]
+        last = pointAt(coords, 0.0)
+        for pos in sorted(set(positions)):
+            pt = pointAt(coords, pos)
+            if math.hypot(pt[0]-last[0], pt[1]-last[1]) > tol:
+                cuts.append(pos)
+                last = pt
+        end = float(len(coords)-1)
+        endPt = pointAt(coords, end)
+        if len(cuts) > 1 and math.hypot(endPt[0]-last[0], endPt[1]-last[1]) <= tol:
+            cuts.pop()
+        cuts.append(end)
+        pieces = []
+        for start, stop in zip(cuts[:-1], cuts[1:]):
+            line = subLine(coords, start, stop)
+            if lineLength(line) > tol:
+                pieces.append((start, stop, line))
+        return pieces
+
+    def zonesAt(self, x, y):
+        """The oids of all zones that contains a point in ascending order, points on the boundary (within tolerance) are inside"""
+        if self.__zoneTree is None:
+            return []
+        tol = self.tolerance
+        return sorted(oid for oid, rings in self.__zoneTree.query(x-tol, y-tol, x+tol, y+tol)
+                      if pointInPolygon(x, y, rings) or pointOnBoundary(x, y, rings, tol))
+
+    def splitElements(self, elements, zones, elementIds=None):
+        """Split elements at zone boundaries, returns a list of (source_oid, part_index, start, end, coords, attributes)
+If elementIds is given only those elements are split, all elements are still used for the crossing tests"""
+        self.indexZones(zones)
+        if self.splitAtElementCrossings:
+            self.indexElements(elements)
+        segments = []
+        for oid, parts, attrs in elements:
+            if elementIds is not None and oid not in elementIds:
+                continue
+            for p, part in enumerate(parts):
+                if len(part) < 2:
+                    continue
+                positions = self.cutPositions(oid, p, part)
+                for start, stop, line in self.piecesFromPositions(part, positions):
+                    segments.append((oid, p, start, stop, line, attrs))
+        return segments
+
+    def intersectElements(self, segments, zones=None):
+        """Returns (segment_index, zone_oid, length) for every segment within a zone, sorted by segment and zone.
+Segments are split at zone boundaries, so a segment is within a zone if its midpoint is.
+A segment that runs along a zone boundary is within the zone (and within both zones of a shared boundary), as the
+boundary belongs to the polygon in the Intersect tool. The even-odd test alone would assign it arbitrarily"""
+        if zones is not None:
+            self.indexZones(zones)
+        rows = []
+        for n, segment in enumerate(segments):
+            coords = segment[4]
+            length = lineLength(coords)
+            x, y = pointAlong(coords, length/2.0)
+            for zoneOid in self.zonesAt(x, y):
+                rows.append((n, zoneOid, length))
+        return rows
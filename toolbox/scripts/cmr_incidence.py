@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_params import _text
+
+def compressIndex(major, minor, nMajor):
+    """Sort (major, minor) index pairs into compressed form, returns (indptr, indices, order) where the pairs of
+major item m are order[indptr[m]:indptr[m+1]] and their minor items indices[indptr[m]:indptr[m+1]]"""
+    major = np.asarray(major, dtype=np.int64)
+    minor = np.asarray(minor, dtype=np.int64)
+    order = np.lexsort((minor, major))
+    indptr = np.zeros(nMajor+1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(major, minlength=nMajor))
+    return indptr, minor[order], order
+
+
+class cmrincidence:
+    """Sparse element by hazard zone incidence of a study with the risk of every intersection
+The intersections (cmrT_ElementHazardZone) are stored twice in compressed form: by element (CSR) and by hazard zone (CSC),
+and the elements are grouped by route. Questions like which elements and routes a zone hits, which zones affect a route,
+or how much a zone contributes to the risk of a route are answered by slicing arrays instead of joining the views.
+Risk contributions are the pivoted summary columns of each intersection (as cmrV_ElementValueDamagesPivot).
+Ids are element_id, hazardzone_id and route_code as in the cmr database.
+Methods:
+fromEngine(engine)
+Builds the incidence from a cmrengine with the study loaded
+
+save(filename) and load(filename)
+Writes the incidence as an npz file and reads it back
+
+elementZones(elementId), zoneElements(hazardzoneId), zoneRoutes(hazardzoneId), routeElements(routeCode), routeZones(routeCode)
+Returns the ids of the related elements, hazard zones or routes
+
+zoneRisk(hazardzoneId), routeZoneRisk(routeCode)
+Returns the risk contributions of a hazard zone (per element) or of each zone on a route
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Arrays that are saved
+    arrayNames = ['elementIds', 'elementFeatureIds', 'elementRoute', 'hazardzoneIds', 'hazardzoneFeatureIds'
+                  , 'pairElement', 'pairZone', 'values'
+                  , 'csrPtr', 'csrZones', 'csrPairs'
+                  , 'cscPtr', 'cscElements', 'cscPairs'
+                  , 'routePtr', 'routeMembers']
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, studyId, arrays, routeCodes, columns, parameterHash=None, dataHash=None):
+        self.studyId = studyId
+        for name in self.arrayNames:
+            setattr(self, name, arrays[name])
+        self.routeCodes = list(routeCodes)
+        self.columns = list(columns)
+        self.parameterHash = parameterHash
+        self.dataHash = dataHash
+        self.__elementSorter = np.argsort(self.elementIds, kind='mergesort')
+        self.__zoneSorter = np.argsort(self.hazardzoneIds, kind='mergesort')
+        self.__routeIndex = dict((code, n) for n, code in enumerate(self.routeCodes))
+
+    def __find(self, ids, sorter, value, name):
+        n = np.searchsorted(ids, value, sorter=sorter)
+        if n >= len(ids) or ids[sorter[n]] != value:
+            raise Exception("Unknown {0} {1} in study {2}".format(name, value, self.studyId))
+        return sorter[n]
+
+    def __elementIndex(self, elementId):
+        return self.__find(self.elementIds, self.__elementSorter, elementId, 'element_id')
+
+    def __zoneIndex(self, hazardzoneId):
+        return self.__find(self.hazardzoneIds, self.__zoneSorter, hazardzoneId, 'hazardzone_id')
+
+    def __routeElementIndexes(self, routeCode):
+        r = self.__routeIndex.get(routeCode)
+        if r is None:
+            raise Exception("Unknown route {0} in study {1}".format(routeCode, self.studyId))
+        return self.routeMembers[self.routePtr[r]:self.routePtr[r+1]]
+
+    def __routePairs(self, routeCode):
+        """Positions of the pairs of all elements on a route"""
+        elements = self.__routeElementIndexes(routeCode)
+        if len(elements) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.csrPairs[self.csrPtr[e]:self.csrPtr[e+1]] for e in elements])
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    @classmethod
+    def fromEngine(cls, engine):
+        keys, values = engine.summaryArrays('pair', rounded=False)
+        nElements, nZones, nRoutes = len(engine.elementIds), len(engine.hazardzoneIds), len(engine.routeCodes)
+        a = {'elementIds': engine.elementIds
+             , 'elementFeatureIds': engine.elementFeatureIds
+             , 'elementRoute': engine.elementRoute
+             , 'hazardzoneIds': engine.hazardzoneIds
+             , 'hazardzoneFeatureIds': engine.hazardzoneFeatureIds
+             , 'pairElement': engine.pairElement
+             , 'pairZone': engine.pairZone
+             , 'values': values}
+        a['csrPtr'], a['csrZones'], a['csrPairs'] = compressIndex(engine.pairElement, engine.pairZone, nElements)
+        a['cscPtr'], a['cscElements'], a['cscPairs'] = compressIndex(engine.pairZone, engine.pairElement, nZones)
+        a['routePtr'], a['routeMembers'], order = compressIndex(engine.elementRoute, np.arange(nElements), nRoutes)
+        columns = [name for categoryId, name in engine.summaryColumns]
+        return cls(engine.studyId, a, engine.routeCodes, columns, engine.parameterHash, engine.dataHash())
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            arrays = dict((name, data[name]) for name in cls.arrayNames)
+            codes = data['routeCodes'].tolist()
+            isNull = data['routeIsNull']
+            routeCodes = [None if isNull[n] else code for n, code in enumerate(codes)]
+            columns = data['columns'].tolist()
+            studyId = int(data['studyId'])
+            parameterHash = str(data['parameterHash']) or None
+            dataHash = str(data['dataHash']) or None
+        return cls(studyId, arrays, routeCodes, columns, parameterHash, dataHash)
+
+    def save(self, filename):
+        arrays = dict((name, getattr(self, name)) for name in self.arrayNames)
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, studyId=np.array(self.studyId)
+                                , routeCodes=_text(self.routeCodes)
+                                , routeIsNull=np.array([code is None for code in self.routeCodes], dtype=bool)
+                                , columns=_text(self.columns)
+                                , parameterHash=_text([self.parameterHash])[0]
+                                , dataHash=_text([self.dataHash])[0]
+                                , **arrays)
+        return filename
+
+    def elementZones(self, elementId):
+        """hazardzone_ids of the zones that intersect an element"""
+        e = self.__elementIndex(elementId)
+        return self.hazardzoneIds[self.csrZones[self.csrPtr[e]:self.csrPtr[e+1]]]
+
+    def zoneElements(self, hazardzoneId):
+        """element_ids of the elements a hazard zone hits"""
+        z = self.__zoneIndex(hazardzoneId)
+        return self.elementIds[self.cscElements[self.cscPtr[z]:self.cscPtr[z+1]]]
+
+    def zoneRoutes(self, hazardzoneId):
+        """route_codes of the routes a hazard zone hits"""
+        z = self.__zoneIndex(hazardzoneId)
+        routes = np.unique(self.elementRoute[self.cscElements[self.cscPtr[z]:self.cscPtr[z+1]]])
+        return [self.routeCodes[r] for r in routes]
+
+    def routeElements(self, routeCode):
+        """element_ids of the elements on a route"""
+        return self.elementIds[self.__routeElementIndexes(routeCode)]
+
+    def routeZones(self, routeCode):
+        """hazardzone_ids of the zones that affect a route"""
+        return self.hazardzoneIds[np.unique(self.pairZone[self.__routePairs(routeCode)])]
+
+    def zoneRisk(self, hazardzoneId):
+        """Risk contributions of a hazard zone: (element_ids, values) with one row of summary columns per element hit"""
+        z = self.__zoneIndex(hazardzoneId)
+        pairs = self.cscPairs[self.cscPtr[z]:self.cscPtr[z+1]]
+        return self.elementIds[self.pairElement[pairs]], self.values[pairs]
+
+    def routeZoneRisk(self, routeCode):
+        """Risk contributions of each zone to a route: (hazardzone_ids, values) with one row of summary columns per zone"""
+        pairs = self.__routePairs(routeCode)
+        zones, index = np.unique(self.pairZone[pairs], return_inverse=True)
+        index = index.ravel()
+        sums = np.zeros((len(zones), self.values.shape[1]))
+        for n in range(self.values.shape[1]):
+            sums[:, n] = np.bincount(index, weights=self.values[pairs, n], minlength=len(zones))
+        return self.hazardzoneIds[zones], sums
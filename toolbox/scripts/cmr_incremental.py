@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from cmr_geometry import boundingBox, cmrrtree
+
+def featureBox(parts):
+    """Bounding box of all parts of a feature, None if the feature has no points"""
+    pts = [p for part in parts for p in part]
+    return boundingBox(pts) if pts else None
+
+def fingerprint(parts, attrs=None, prefix=None, decimals=6):
+    """md5 hex digest of a geometry (a list of parts with (x, y) tuples) and its attributes.
+Coordinates are rounded to the given number of decimals, so noise below that precision is not a change"""
+    md5 = hashlib.md5()
+    if prefix is not None:
+        md5.update(repr(prefix).encode('utf-8'))
+    fmt = "{0:.%df},{1:.%df};" % (decimals, decimals)
+    for part in parts:
+        md5.update(("".join(fmt.format(x, y) for x, y in part) + "|").encode('utf-8'))
+    for key in sorted(attrs or {}):
+        md5.update("{0}={1};".format(key, repr(attrs[key])).encode('utf-8'))
+    return md5.hexdigest()
+
+
+class cmrchangeset:
+    """The changes in the input features of a study since the fingerprints of the previous run were stored
+Methods:
+matchSegments(segments)
+Matches new segments of the affected elements with the segments of the previous run.
+Returns (oids, removedOids) where oids holds the previous object id of each unchanged segment (None for new segments)
+
+resetRows(studyId) and fingerprintRows(studyId, segments, segmentOids)
+Rows for the staging tables cmrT_ImportResetFeatures and cmrT_ImportFingerprint read by cmrSP_upsertResults
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Feature types in cmrT_FeatureFingerprint
+    elementType = 'E'
+    zoneType = 'Z'
+    segmentType = 'S'
+    #Fields of cmrT_FeatureFingerprint (and the staging table cmrT_ImportFingerprint)
+    fingerprintFields = ['study_id', 'feature_type', 'feature_id', 'source_feature_id', 'fingerprint', 'xmin', 'ymin', 'xmax', 'ymax']
+    #Fields of the staging table cmrT_ImportResetFeatures
+    resetFields = ['study_id', 'feature_type', 'feature_id']
+    #Number of decimals of the coordinates in the fingerprints
+    decimals = 6
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, previous, elements, zones, includeElementCrossings=True):
+        """previous holds the rows of cmrT_FeatureFingerprint for the study (fields as in fingerprintFields without study_id).
+elements and zones are (oid, parts, attributes) as read for the geometry backend.
+If includeElementCrossings is True elements near changed elements are affected as well (they may be split by them)"""
+        self.oldElements = {}
+        self.oldZones = {}
+        self.oldSegments = {}
+        for featureType, featureId, sourceId, fp, xmin, ymin, xmax, ymax in previous:
+            bbox = (xmin, ymin, xmax, ymax) if xmin is not None else None
+            featureType = featureType.strip()
+            if featureType == self.elementType:
+                self.oldElements[featureId] = (fp, bbox)
+            elif featureType == self.zoneType:
+                self.oldZones[featureId] = (fp, bbox)
+            elif featureType == self.segmentType:
+                self.oldSegments[featureId] = (fp, sourceId)
+        self.elementPrints = self.__fingerprints(elements)
+        self.zonePrints = self.__fingerprints(zones)
+        self.addedElements, self.changedElements, self.removedElements = self.__diff(self.oldElements, self.elementPrints)
+        self.addedZones, self.changedZones, self.removedZones = self.__diff(self.oldZones, self.zonePrints)
+        self.affectedElements = self.__affected(includeElementCrossings)
+
+    def __fingerprints(self, features):
+        return dict((oid, (fingerprint(parts, attrs, decimals=self.decimals), featureBox(parts))) for oid, parts, attrs in features)
+
+    def __diff(self, old, new):
+        """Returns the sets of added, changed and removed feature ids"""
+        added = set(oid for oid in new if oid not in old)
+        removed = set(oid for oid in old if oid not in new)
+        changed = set(oid for oid in new if oid in old and old[oid][0] != new[oid][0])
+        return added, changed, removed
+
+    def __affected(self, includeElementCrossings):
+        """Elements that must be split and intersected again: new and changed elements and all elements
+that come near the new or previous extent of a changed zone (or element)"""
+        boxes = [self.zonePrints[oid][1] for oid in self.addedZones | self.changedZones]
+        boxes += [self.oldZones[oid][1] for oid in self.changedZones | self.removedZones]
+        if includeElementCrossings:
+            boxes += [self.elementPrints[oid][1] for oid in self.addedElements | self.changedElements]
+            boxes += [self.oldElements[oid][1] for oid in self.changedElements | self.removedElements]
+        tree = cmrrtree([b + (None,) for b in boxes if b is not None])
+        affected = self.addedElements | self.changedElements
+        for oid, (fp, bbox) in self.elementPrints.items():
+            if oid not in affected and bbox is not None and tree.query(*bbox):
+                affected.add(oid)
+        return affected
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def isEmpty(self):
+        """True if nothing has changed since the previous run"""
+        return not (self.addedElements or self.changedElements or self.removedElements
+                    or self.addedZones or self.changedZones or self.removedZones)
+
+    def summary(self):
+        return "Elements: {0} added, {1} changed, {2} removed. Hazard zones: {3} added, {4} changed, {5} removed. {6} elements affected".format(
+            len(self.addedElements), len(self.changedElements), len(self.removedElements)
+            , len(self.addedZones), len(self.changedZones), len(self.removedZones), len(self.affectedElements))
+
+    def segmentFingerprint(self, segment):
+        """Fingerprint of a segment (source_oid, part_index, start, end, coords, attributes) from the geometry backend"""
+        return fingerprint([segment[4]], segment[5], prefix=segment[0], decimals=self.decimals)
+
+    def previousSegments(self):
+        """Object ids of the previous segments of affected and removed elements"""
+        sources = self.affectedElements | self.removedElements
+        return [oid for oid, (fp, sourceId) in self.oldSegments.items() if sourceId in sources]
+
+    def matchSegments(self, segments):
+        """Returns (oids, removedOids), the previous object id for each segment (None if new) and the previous segments that are gone"""
+        candidates = {}
+        for oid in sorted(self.previousSegments()):
+            candidates.setdefault(self.oldSegments[oid][0], []).append(oid)
+        oids = []
+        for segment in segments:
+            matches = candidates.get(self.segmentFingerprint(segment))
+            oids.append(matches.pop(0) if matches else None)
+        removedOids = sorted(oid for matches in candidates.values() for oid in matches)
+        return oids, removedOids
+
+    def resetRows(self, studyId):
+        """Features whose stored state is replaced: changed and removed elements and zones and all previous segments of affected elements"""
+        rows = [(studyId, self.elementType, oid) for oid in sorted(self.changedElements | self.removedElements)]
+        rows += [(studyId, self.zoneType, oid) for oid in sorted(self.changedZones | self.removedZones)]
+        rows += [(studyId, self.segmentType, oid) for oid in sorted(self.previousSegments())]
+        return rows
+
+    def fingerprintRows(self, studyId, segments, segmentOids):
+        """Fingerprints of the new and changed elements and zones and of the given segments (with their object ids)"""
+        rows = []
+        for featureType, prints, oids in [(self.elementType, self.elementPrints, self.addedElements | self.changedElements)
+                                          , (self.zoneType, self.zonePrints, self.addedZones | self.changedZones)]:
+            for oid in sorted(oids):
+                fp, bbox = prints[oid]
+                rows.append([studyId, featureType, oid, None, fp] + list(bbox or (None, None, None, None)))
+        for segment, oid in zip(segments, segmentOids):
+            bbox = featureBox([segment[4]])
+            rows.append([studyId, self.segmentType, oid, segment[0], self.segmentFingerprint(segment)] + list(bbox))
+        return rows
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+def cpuTime():
+    """User and system cpu time of the process in seconds (os.times works on windows and unix, unlike time.clock)"""
+    t = os.times()
+    return t[0]+t[1]
+
+def _windowsMemory():
+    """(current, peak) working set in bytes using GetProcessMemoryInfo"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD)
+                    , ('PageFaultCount', wintypes.DWORD)
+                    , ('PeakWorkingSetSize', ctypes.c_size_t)
+                    , ('WorkingSetSize', ctypes.c_size_t)
+                    , ('QuotaPeakPagedPoolUsage', ctypes.c_size_t)
+                    , ('QuotaPagedPoolUsage', ctypes.c_size_t)
+                    , ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t)
+                    , ('QuotaNonPagedPoolUsage', ctypes.c_size_t)
+                    , ('PagefileUsage', ctypes.c_size_t)
+                    , ('PeakPagefileUsage', ctypes.c_size_t)]
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None, None
+    return int(counters.WorkingSetSize), int(counters.PeakWorkingSetSize)
+
+def _unixMemory():
+    """(current, peak) resident set size in bytes, current is None where /proc is missing"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kilobytes on linux and in bytes on mac
+    peak = int(peak) if sys.platform == 'darwin' else int(peak)*1024
+    current = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return current, peak
+
+def processMemory():
+    """(current, peak) memory of the process in bytes, (None, None) if it cannot be determined"""
+    try:
+        if os.name == 'nt':
+            return _windowsMemory()
+        return _unixMemory()
+    except Exception:
+        return None, None
+
+def _megabytes(value):
+    return None if value is None else round(value/1048576.0, 1)
+
+
+class cmrspan:
+    """A timed stage of a run, used as a context manager (see cmrinstrument.span).
+Set rows (and any other attributes with set) while the stage runs"""
+    def __init__(self, instrument, name, attributes):
+        self.__instrument = instrument
+        self.name = name
+        self.rows = None
+        self.attributes = dict(attributes)
+        self.dbCalls = 0
+        self.dbSeconds = 0.0
+        self.wallSeconds = None
+        self.cpuSeconds = None
+        self.error = None
+
+    def __enter__(self):
+        self.started = datetime.datetime.now()
+        self.__memoryStart = processMemory()[0]
+        self.__cpu = cpuTime()
+        self.__wall = time.time()
+        self.__instrument._enter(self)
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.wallSeconds = time.time()-self.__wall
+        self.cpuSeconds = cpuTime()-self.__cpu
+        self.memory, self.peakMemory = processMemory()
+        if excType is not None:
+            self.error = "{0}: {1}".format(excType.__name__, excValue)
+        self.__instrument._exit(self)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def addDbCall(self, seconds):
+        self.dbCalls += 1
+        self.dbSeconds += seconds
+
+    def asDict(self):
+        memoryDelta = None
+        if self.memory is not None and self.__memoryStart is not None:
+            memoryDelta = self.memory-self.__memoryStart
+        return {'name': self.name
+                , 'started': self.started.isoformat()
+                , 'wall_seconds': self.wallSeconds
+                , 'cpu_seconds': self.cpuSeconds
+                , 'rows': self.rows
+                , 'rows_per_second': self.rows/self.wallSeconds if self.rows and self.wallSeconds else None
+                , 'db_calls': self.dbCalls
+                , 'db_seconds': self.dbSeconds
+                , 'memory_mb': _megabytes(self.memory)
+                , 'memory_delta_mb': _megabytes(memoryDelta)
+                , 'peak_memory_mb': _megabytes(self.peakMemory)
+                , 'error': self.error
+                , 'attributes': self.attributes}
+
+
+class cmrinstrumentedconnection:
+    """Wraps an ArcSDESQLExecute connection and records the round trip time of every call in the current span"""
+    def __init__(self, sdeConn, instrument):
+        self.__sdeConn = sdeConn
+        self.__instrument = instrument
+
+    def __call(self, method, *args):
+        tic = time.time()
+        try:
+            return getattr(self.__sdeConn, method)(*args)
+        finally:
+            self.__instrument.addDbCall(time.time()-tic)
+
+    def execute(self, strSQL):
+        return self.__call('execute', strSQL)
+
+    def startTransaction(self):
+        return self.__call('startTransaction')
+
+    def commitTransaction(self):
+        return self.__call('commitTransaction')
+
+    def rollbackTransaction(self):
+        return self.__call('rollbackTransaction')
+
+    def __getattr__(self, name):
+        return getattr(self.__sdeConn, name)
+
+
+class cmrinstrument:
+    """Records spans (stages) of a run with wall and cpu time, row counts, database round trips and memory use,
+and writes them as a json run report.
+Peak memory is the peak of the process when the span ended (the peak working set on windows, max rss on unix)
+Methods:
+start(**metadata)
+Starts a new run, spans and metadata of a previous run are discarded
+
+span(name, **attributes)
+Returns a context manager that records a stage, e.g. with instrument.span('intersect') as span: ... span.rows = n
+
+connection(sdeConn)
+Wraps a database connection so that round trips are recorded in the current span
+
+finish(status='ok', error=None)
+Ends the run
+
+report() and writeReport(filename)
+Returns the run report as a dict or writes it as json
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Version of the report format
+    reportVersion = 1
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, msgFunc=None):
+        self.__msgFunc = msgFunc
+        self.start()
+
+    def __showMsg(self, strMsg):
+        if self.__msgFunc:
+            self.__msgFunc(strMsg)
+
+    def _enter(self, span):
+        self.__active.append(span)
+
+    def _exit(self, span):
+        if span in self.__active:
+            self.__active.remove(span)
+        self.spans.append(span)
+        strMsg = "Processing time: {0:.2f} s (cpu {1:.2f} s".format(span.wallSeconds, span.cpuSeconds)
+        if span.rows is not None:
+            strMsg += ", {0} rows".format(span.rows)
+        if span.dbCalls:
+            strMsg += ", {0} database calls in {1:.2f} s".format(span.dbCalls, span.dbSeconds)
+        if span.peakMemory is not None:
+            strMsg += ", peak memory {0:.0f} MB".format(span.peakMemory/1048576.0)
+        self.__showMsg(strMsg + ")")
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def start(self, **metadata):
+        self.metadata = dict(metadata)
+        self.spans = []
+        self.__active = []
+        self.__started = datetime.datetime.now()
+        self.__wall = time.time()
+        self.__cpu = cpuTime()
+        self.__finished = None
+        self.status = 'running'
+        self.error = None
+
+    def span(self, name, **attributes):
+        return cmrspan(self, name, attributes)
+
+    def addDbCall(self, seconds):
+        """Record a database round trip in the innermost active span (calls outside spans are only counted in the totals)"""
+        if self.__active:
+            self.__active[-1].addDbCall(seconds)
+        else:
+            self.metadata['db_calls_outside_spans'] = self.metadata.get('db_calls_outside_spans', 0)+1
+
+    def connection(self, sdeConn):
+        if not sdeConn or isinstance(sdeConn, cmrinstrumentedconnection):
+            return sdeConn
+        return cmrinstrumentedconnection(sdeConn, self)
+
+    def finish(self, status='ok', error=None):
+        self.status = status
+        self.error = error
+        self.__finished = (time.time()-self.__wall, cpuTime()-self.__cpu)
+
+    def report(self):
+        wall, cpu = self.__finished or (time.time()-self.__wall, cpuTime()-self.__cpu)
+        memory, peak = processMemory()
+        spans = [s.asDict() for s in self.spans]
+        return {'report_version': self.reportVersion
+                , 'started': self.__started.isoformat()
+                , 'status': self.status
+                , 'error': self.error
+                , 'wall_seconds': wall
+                , 'cpu_seconds': cpu
+                , 'db_calls': sum(s['db_calls'] for s in spans)
+                , 'db_seconds': sum(s['db_seconds'] for s in spans)
+                , 'peak_memory_mb': _megabytes(peak)
+                , 'host': platform.node()
+                , 'pid': os.getpid()
+                , 'python': platform.python_version()
+                , 'platform': platform.platform()
+                , 'metadata': self.metadata
+                , 'spans': spans}
+
+    def writeReport(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        return filename
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+import math
+import multiprocessing
+import numpy as np
+
+def splitNormal(rs, mean, posErr, negErr, size):
+    """Draws from a split normal distribution with standard deviation posErr above and negErr below the mean"""
+    z = rs.standard_normal(size)
+    return mean+z*np.where(z > 0, posErr, negErr)
+
+def frequencyFactor(rs, sigmaUp, sigmaDown, norm, size):
+    """Draws factors on the event frequency from a split lognormal distribution with log standard deviation sigmaUp above
+and sigmaDown below 1. norm (see frequencyFactorNorm) scales the draws to an expected factor of exactly 1"""
+    z = rs.standard_normal(size)
+    return np.exp(z*np.where(z > 0, sigmaUp, sigmaDown))/norm
+
+def frequencyFactorNorm(sigmaUp, sigmaDown):
+    """E[exp(z*sigma)] of the split lognormal, exp(sigmaUp^2/2)*Phi(sigmaUp)+exp(sigmaDown^2/2)*Phi(-sigmaDown)"""
+    phi = lambda x: 0.5*(1.0+math.erf(x/math.sqrt(2.0)))
+    return np.array([math.exp(up*up/2.0)*phi(up)+math.exp(down*down/2.0)*phi(-down)
+                     for up, down in zip(np.ravel(sigmaUp), np.ravel(sigmaDown))]).reshape(np.shape(sigmaUp))
+
+def damageFromSeverity(u, damage_prob, damage_max, damage_exponent):
+    """The damage function f(x) = damage_max*((x+damage_prob-1)/damage_prob)^damage_exponent for a uniform severity u.
+The expected damage is damage_avg = damage_prob*damage_max/(damage_exponent+1)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        damage = damage_max*np.power((u+damage_prob-1.0)/damage_prob, damage_exponent)
+    return np.where(u > 1.0-damage_prob, damage, 0.0)
+
+def _simulateChunks(model, chunks):
+    """Simulate a list of (chunkIndex, firstSample, nSamples), runs in a worker process.
+Returns the study losses of every chunk and the route histograms, sums and sums of squares over all chunks"""
+    nRoutes, nColumns, nBins = model['nRoutes'], model['nColumns'], model['nBins']
+    hist = np.zeros(nRoutes*nColumns*(nBins+1), dtype=np.int64)
+    routeSum = np.zeros((nRoutes, nColumns))
+    routeSumSq = np.zeros((nRoutes, nColumns))
+    study = []
+    for chunkIndex, firstSample, nSamples in chunks:
+        losses = _simulateChunk(model, chunkIndex, nSamples)
+        study.append((firstSample, losses.sum(axis=1)))
+        routeSum += losses.sum(axis=0)
+        routeSumSq += (losses**2).sum(axis=0)
+        #Histogram bin 0 holds zero losses, the other bins are log spaced around the expected loss of each route
+        with np.errstate(divide='ignore'):
+            pos = (np.log10(losses)-model['logLower'])/model['binWidth']
+        bins = np.where(losses > 0, np.clip(np.floor(np.where(np.isfinite(pos), pos, 0.0)), 0, nBins-1)+1, 0).astype(np.int64)
+        cell = np.arange(nRoutes*nColumns).reshape(1, nRoutes, nColumns)
+        hist += np.bincount((cell*(nBins+1)+bins).ravel(), minlength=len(hist))
+    return study, hist, routeSum, routeSumSq
+
+def _simulateChunk(model, chunkIndex, nSamples):
+    """Losses (nSamples x nRoutes x nColumns) of one chunk, the random stream only depends on the seed and the chunk index"""
+    rs = np.random.RandomState([model['seed'], chunkIndex])
+    nRoutes, nColumns = model['nRoutes'], model['nColumns']
+    losses = np.zeros(nSamples*nRoutes*nColumns)
+    #Element values are drawn once per sample for every (elementtype, valuetype), so errors are correlated along routes
+    nValues = len(model['valueMean'])
+    if model['sampleValueErrors']:
+        values = np.maximum(splitNormal(rs, model['valueMean'], model['valuePosErr'], model['valueNegErr'], (nSamples, nValues)), 0.0)
+    else:
+        values = np.tile(model['valueMean'], (nSamples, 1))
+    values = np.hstack((values, np.ones((nSamples, 1))))
+    #Pairs are processed in blocks of whole hazard zones (sorted by zone), a block starts at the first zone
+    #that starts in the next run of pairsPerBlock pairs, so a zone with many pairs is a block of its own
+    pairsPerBlock = max(1, int(model['valuesPerChunk']//max(nSamples, 1)))
+    order = model['pairOrder']
+    nPairs = len(order)
+    zoneStart = np.nonzero(np.concatenate(([True], np.diff(model['pairZone'][order]) != 0)))[0] if nPairs else np.zeros(0, dtype=np.int64)
+    blockStart = zoneStart[np.unique(zoneStart//pairsPerBlock, return_index=True)[1]]
+    for start, end in zip(blockStart, np.append(blockStart[1:], nPairs)):
+        pairs = order[start:end]
+        #Return periods are drawn once per sample for every hazard zone of the block
+        blockZones, zoneIndex = np.unique(model['pairZone'][pairs], return_inverse=True)
+        if model['sampleFrequencyErrors']:
+            freqFactor = frequencyFactor(rs, model['freqSigmaUp'][blockZones], model['freqSigmaDown'][blockZones]
+                                         , model['freqNorm'][blockZones], (nSamples, len(blockZones)))[:, zoneIndex.ravel()]
+        else:
+            freqFactor = np.ones((nSamples, 1))
+        #Number of events for each sample and pair within the timeframe
+        lam = model['pairFrequency'][pairs]*model['timeframe']*freqFactor
+        counts = rs.poisson(lam)
+        sIdx, pIdx = np.nonzero(counts)
+        n = counts[sIdx, pIdx]
+        evSample = np.repeat(sIdx, n)
+        evPair = np.repeat(pairs[pIdx], n)
+        nEvents = len(evPair)
+        if nEvents == 0:
+            continue
+        #One severity per event shared by all value types, and one draw for the thinning of route events
+        severity = rs.random_sample(nEvents)
+        thinning = rs.random_sample(nEvents)
+        #Expand events into the value type rows of their pair
+        cnt = model['rowCount'][evPair]
+        rowEvent = np.repeat(np.arange(nEvents), cnt)
+        offset = np.arange(len(rowEvent))-np.repeat(np.cumsum(cnt)-cnt, cnt)
+        row = np.repeat(model['rowStart'][evPair], cnt)+offset
+        damage = np.where(model['rowFixed'][row], 1.0, damageFromSeverity(severity[rowEvent], model['rowProb'][row]
+                                                                          , model['rowMax'][row], model['rowExponent'][row]))
+        damage = np.where(np.isfinite(damage), damage, 0.0)
+        #Route event rows only count for the share of events that is not a co-occurrence on the same route
+        counted = np.where(model['rowRoute'][row], thinning[rowEvent] < model['pairRouteRatio'][evPair[rowEvent]], True)
+        sample = evSample[rowEvent]
+        loss = model['rowWeight'][row]*values[sample, model['rowValue'][row]]*damage*counted
+        cell = (sample*nRoutes+model['rowRouteIndex'][row])*nColumns+model['rowColumn'][row]
+        losses += np.bincount(cell, weights=loss, minlength=len(losses))
+    return losses.reshape(nSamples, nRoutes, nColumns)
+
+
+class cmrmontecarlo:
+    """Monte Carlo simulation of losses within a timeframe, an alternative to the analytic error terms of cmrSP_resultSummary
+For every sample the number of events of each element hazard zone pair is drawn from a Poisson distribution
+(event_frequency * timeframe). Every event gets a uniform severity that is shared by all value types and gives
+the damage through the damage function, so the expected damage equals damage_avg. Rows that use the route event
+frequency only count the share route_event_frequency/event_frequency of the events (co-occurring events on the same route).
+Element values (value_mean +/- value_PosErr/value_NegErr) and return periods (event_frequency +/- freq_error_interval)
+are drawn once per sample, so their errors are correlated along routes and within the study. The frequency of a hazard
+zone is scaled by a split lognormal factor with an expected value of 1, where a return period of
+event_frequency/(1+freq_interval_minus/event_frequency) (or *(1+freq_interval_plus/event_frequency)) is one
+standard deviation, so the expected losses do not change when the errors are sampled.
+Samples are simulated in chunks with a random stream per chunk (seeded with [seed, chunk]), so results do not
+depend on the number of worker processes. Study losses are kept for every sample, route losses are summarized
+in log spaced histograms so memory does not grow with the number of samples.
+Methods:
+run(nSamples, workers=1)
+Returns a dict with study losses per sample and percentiles, route means, standard deviations and percentiles.
+The model is compiled for every run, so changes of the public properties apply to the next run
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Samples per chunk (at most, chunks are smaller if there are many routes)
+    samplesPerChunk = 1000
+    #Approximate number of array items (samples x pairs or samples x routes x columns) per chunk
+    valuesPerChunk = 4000000
+    #Number of histogram bins per route and column and the range (decades around the expected loss) they cover
+    histogramBins = 200
+    histogramDecades = 8
+    #Draw element values and return periods with their errors (if False only events and severities are random)
+    sampleValueErrors = True
+    sampleFrequencyErrors = True
+    #Percentiles reported by run
+    percentiles = [5, 25, 50, 75, 95, 99]
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, engine, timeframe=1, seed=None):
+        """engine is a cmrengine with the study loaded, timeframe is the number of years simulated in each sample"""
+        self.engine = engine
+        self.timeframe = timeframe
+        self.seed = seed if seed is not None else np.random.randint(0, 2**31-1)
+        self.columns = [name for categoryId, name in engine.summaryColumns]
+        self.routeCodes = list(engine.routeCodes)
+
+    def __compileModel(self):
+        """Arrays describing pairs and their value type rows, the model is passed to the worker processes"""
+        e = self.engine
+        c = e.parameterCombos()
+        rows = e.elementValueDamages()
+        pair = rows['pair']
+        combo = rows['combo']
+        flags = c['flags'][combo]
+        useEvent, useRoute = flags[:, 0], flags[:, 1]
+        #H = ISNULL(use_route_event_frequency*route_event_frequency, use_element_event_frequency*event_frequency)
+        isRoute = ~np.isnan(useRoute)
+        weight = np.where(isRoute, useRoute, useEvent)
+        columnIndex = dict((categoryId, n) for n, (categoryId, name) in enumerate(e.summaryColumns))
+        column = np.array([columnIndex.get(int(x), -1) for x in rows['valuetype_category_id']], dtype=np.int64)
+        keep = ~np.isnan(weight) & (column >= 0)
+        #Element value draws are indexed by (elementtype, valuetype), the fixed value types use the last column (always 1)
+        free = ~c['fixed']
+        evKey = c['elementtype']*len(e.valuetypeIds)+c['valuetype']
+        evKeys, evFirst, evIndex = np.unique(evKey[free], return_index=True, return_inverse=True)
+        comboValue = np.zeros(len(c['fixed']), dtype=np.int64)+len(evKeys)
+        comboValue[np.nonzero(free)[0]] = evIndex.ravel()
+        freeCombos = np.nonzero(free)[0][evFirst]
+
+        #Rows sorted by pair, so the rows of a pair can be found with start and count
+        idx = np.nonzero(keep)[0]
+        idx = idx[np.argsort(pair[idx], kind='mergesort')]
+        nPairs = len(e.pairElement)
+        rowCount = np.bincount(pair[idx], minlength=nPairs)
+        pe, pz = e.pairElement, e.pairZone
+        eventFrequency = rows['event_frequency']
+        pairFrequency = np.zeros(nPairs)
+        pairRouteFrequency = np.zeros(nPairs)
+        pairFrequency[pair] = eventFrequency
+        pairRouteFrequency[pair] = rows['route_event_frequency']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(pairFrequency > 0, pairRouteFrequency/pairFrequency, 0.0)
+        returnPeriod = e.hazardzoneFrequency
+        #Log standard deviations of the frequency factor, a shorter return period (freq_interval_minus) is a higher frequency
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigmaUp = np.log1p(np.where(returnPeriod > 0, np.nan_to_num(e.hazardzoneFreqMinus)/returnPeriod, 0.0))
+            sigmaDown = np.log1p(np.where(returnPeriod > 0, np.nan_to_num(e.hazardzoneFreqPlus)/returnPeriod, 0.0))
+        sigmaUp = np.where(np.isfinite(sigmaUp), np.maximum(sigmaUp, 0.0), 0.0)
+        sigmaDown = np.where(np.isfinite(sigmaDown), np.maximum(sigmaDown, 0.0), 0.0)
+        model = {'seed': self.seed
+                 , 'timeframe': float(self.timeframe)
+                 , 'nRoutes': len(self.routeCodes)
+                 , 'nColumns': len(self.columns)
+                 , 'nBins': self.histogramBins
+                 , 'valuesPerChunk': self.valuesPerChunk
+                 , 'sampleValueErrors': self.sampleValueErrors
+                 , 'sampleFrequencyErrors': self.sampleFrequencyErrors
+                 , 'valueMean': c['value_mean'][freeCombos]
+                 , 'valuePosErr': c['value_PosErr'][freeCombos]
+                 , 'valueNegErr': c['value_NegErr'][freeCombos]
+                 , 'freqSigmaUp': sigmaUp
+                 , 'freqSigmaDown': sigmaDown
+                 , 'freqNorm': frequencyFactorNorm(sigmaUp, sigmaDown)
+                 , 'pairFrequency': np.where(np.isfinite(pairFrequency), pairFrequency, 0.0)
+                 , 'pairZone': pz
+                 , 'pairOrder': np.argsort(pz, kind='mergesort')
+                 , 'pairRouteRatio': np.where(np.isfinite(ratio), ratio, 0.0)
+                 , 'rowStart': np.concatenate(([0], np.cumsum(rowCount)[:-1])).astype(np.int64)
+                 , 'rowCount': rowCount
+                 , 'rowWeight': (weight*rows['E_scaling'])[idx]
+                 , 'rowRoute': isRoute[idx]
+                 , 'rowValue': comboValue[combo[idx]]
+                 , 'rowFixed': c['fixed'][combo[idx]]
+                 , 'rowProb': c['damage_prob'][combo[idx]]
+                 , 'rowMax': c['damage_max'][combo[idx]]
+                 , 'rowExponent': c['damage_exponent'][combo[idx]]
+                 , 'rowRouteIndex': e.elementRoute[pe[pair[idx]]]
+                 , 'rowColumn': column[idx]
+                 }
+        #Histogram range around the expected loss of each route and column
+        expected = self.expectedLosses()
+        with np.errstate(divide='ignore'):
+            center = np.log10(np.where(expected > 0, expected, 1.0))
+        model['logLower'] = center-self.histogramDecades/2.0
+        model['binWidth'] = float(self.histogramDecades)/self.histogramBins
+        return model
+
+    def __chunks(self, nSamples):
+        """Split the samples in chunks of (chunkIndex, firstSample, nSamples)"""
+        nCells = max(len(self.routeCodes)*len(self.columns), 1)
+        size = max(1, min(self.samplesPerChunk, self.valuesPerChunk//nCells))
+        return [(n, start, min(size, nSamples-start)) for n, start in enumerate(range(0, nSamples, size))]
+
+    def __histogramPercentiles(self, model, hist, nSamples):
+        """Percentiles (nRoutes x nColumns x nPercentiles) from the route histograms, interpolated within the log spaced bins"""
+        nCells = hist.shape[0]*hist.shape[1]
+        flat = hist.reshape(nCells, -1)
+        cum = np.cumsum(flat, axis=1)
+        cells = np.arange(nCells)
+        result = np.zeros((nCells, len(self.percentiles)))
+        logLower = model['logLower'].ravel()
+        for k, pct in enumerate(self.percentiles):
+            target = pct/100.0*nSamples
+            #First bin where the cumulative count reaches the target, bin 0 is zero loss
+            b = np.argmax(cum >= target-1e-9, axis=1)
+            before = np.where(b > 0, cum[cells, np.maximum(b-1, 0)], 0)
+            count = flat[cells, b]
+            frac = np.clip((target-before)/np.maximum(count, 1).astype(np.float64), 0.0, 1.0)
+            logValue = logLower+(b-1+frac)*model['binWidth']
+            result[:, k] = np.where(b > 0, 10.0**logValue, 0.0)
+        return result.reshape(hist.shape[0], hist.shape[1], len(self.percentiles))
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def expectedLosses(self):
+        """The expected loss within the timeframe for each route and column (risk * timeframe, not rounded)"""
+        e = self.engine
+        rows = e.elementValueDamages()
+        risk = np.where(np.isnan(rows['risk']), 0.0, rows['risk'])
+        route = e.elementRoute[e.pairElement[rows['pair']]]
+        expected = np.zeros((len(self.routeCodes), len(self.columns)))
+        for n, (categoryId, name) in enumerate(e.summaryColumns):
+            mask = rows['valuetype_category_id'] == categoryId
+            expected[:, n] = np.bincount(route[mask], weights=risk[mask], minlength=len(self.routeCodes))
+        return expected*self.timeframe
+
+    def run(self, nSamples, workers=1):
+        """Simulate nSamples timeframes, using a pool of worker processes if workers > 1"""
+        model = self.__compileModel()
+        chunks = self.__chunks(nSamples)
+        nTasks = max(1, min(int(workers), len(chunks)))
+        tasks = [chunks[n::nTasks] for n in range(nTasks)]
+        if nTasks > 1:
+            pool = multiprocessing.Pool(processes=nTasks)
+            try:
+                results = pool.map(_simulateChunksTask, [(model, t) for t in tasks])
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = [_simulateChunks(model, tasks[0])]
+        study = np.zeros((nSamples, len(self.columns)))
+        hist = np.zeros((len(self.routeCodes), len(self.columns), self.histogramBins+1), dtype=np.int64)
+        routeSum = np.zeros((len(self.routeCodes), len(self.columns)))
+        routeSumSq = np.zeros((len(self.routeCodes), len(self.columns)))
+        for chunkLosses, h, s, sq in results:
+            for firstSample, losses in chunkLosses:
+                study[firstSample:firstSample+len(losses)] = losses
+            hist += h.reshape(hist.shape)
+            routeSum += s
+            routeSumSq += sq
+        routeMean = routeSum/max(nSamples, 1)
+        routeStd = np.sqrt(np.maximum(routeSumSq/max(nSamples, 1)-routeMean**2, 0.0))
+        return {'columns': self.columns
+                , 'routeCodes': self.routeCodes
+                , 'timeframe': self.timeframe
+                , 'seed': self.seed
+                , 'nSamples': nSamples
+                , 'percentiles': list(self.percentiles)
+                , 'study': study
+                , 'studyMean': study.mean(axis=0)
+                , 'studyPercentiles': np.percentile(study, self.percentiles, axis=0).T
+                , 'studyExpected': self.expectedLosses().sum(axis=0)
+                , 'routeMean': routeMean
+                , 'routeStd': routeStd
+                , 'routePercentiles': self.__histogramPercentiles(model, hist, nSamples)
+                , 'routeExpected': self.expectedLosses()}
+
+def _simulateChunksTask(args):
+    """Helper for the pool"""
+    return _simulateChunks(*args)
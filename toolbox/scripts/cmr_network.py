@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+import heapq
+import hashlib
+import numpy as np
+from cmr_geometry import indexedGeometryBackend, lineLength
+
+#Travel speeds (km/h) per element type code, element types with None (e.g. railways) are not part of the road graph
+defaultSpeeds = {'EV': 80.0, 'RV': 70.0, 'FV': 60.0, 'KV': 50.0, 'PV': 30.0, 'SV': 40.0, 'BANE': None}
+
+
+class cmrroadnetwork:
+    """Routable graph of the element polylines with a cached landmark (ALT) index for shortest paths
+The elements are split where they cross each other and the ends of the pieces are snapped to nodes (within tolerance),
+every piece is an edge with travel time = length/speed. Shortest travel times from a few landmarks (chosen farthest
+first) give lower bounds on the distance between any two nodes (triangle inequality), so A* with these bounds only
+searches near the detour. The bounds stay valid when edges are closed, so the same index answers every closure.
+The diversion time of an edge is the extra travel time (hours) between the ends of its chain (the road through the edge
+between the nearest junctions) when the edge is closed: the fastest time between the ends without the edge minus the
+fastest time with it. Elements and routes get the length weighted mean of their edges (NaN if there is no detour).
+Elements are (oid, parts, attributes) as read for the geometry backend, with elementtype_code and route_code.
+Methods:
+fromElements(elements, speeds=None, tolerance=None, landmarks=None, indexFile=None)
+Builds the graph, the landmark index is read from indexFile if it was built for the same graph (and saved there otherwise)
+
+shortestTime(source, target, closed=())
+Returns the fastest travel time (hours) between two nodes without the closed edges (inf if not connected)
+
+edgeDiversionTimes()
+Returns the diversion time of every edge
+
+diversionTimes(level='route')
+Returns a dict element oid -> diversion time, with level 'route' every element on a route gets the value of the route
+
+routeDiversionTimes()
+Returns a dict route_code -> diversion time
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Map units per km (the element geometries are assumed to be in meters)
+    unitsPerKm = 1000.0
+    #Speed (km/h) of element types that are not in the speeds
+    defaultSpeed = 50.0
+    #Ends of pieces closer than this (map units) are the same node
+    tolerance = 0.01
+    #Number of landmarks in the index
+    landmarks = 8
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, edges, nodes, speeds=None, tolerance=None, landmarks=None):
+        """edges are (oid, route_code, from_node, to_node, length, elementtype_code) and nodes (x, y) of the snapped ends"""
+        if tolerance is not None:
+            self.tolerance = tolerance
+        if landmarks is not None:
+            self.landmarks = landmarks
+        self.speeds = dict(defaultSpeeds)
+        self.speeds.update(speeds or {})
+        self.nodes = np.array(nodes, dtype=np.float64).reshape(-1, 2)
+        nNodes = len(self.nodes)
+        self.edgeElement = np.array([e[0] for e in edges], dtype=np.int64)
+        self.edgeRoute = [e[1] for e in edges]
+        self.edgeFrom = np.array([e[2] for e in edges], dtype=np.int64)
+        self.edgeTo = np.array([e[3] for e in edges], dtype=np.int64)
+        self.edgeLength = np.array([e[4] for e in edges], dtype=np.float64)
+        self.edgeTime = np.array([e[4]/self.unitsPerKm/self.__speed(e[5]) for e in edges], dtype=np.float64)
+        #Adjacency lists (both directions) as python lists for the searches
+        self.__adjacent = [[] for n in range(nNodes)]
+        for n, (u, v, t) in enumerate(zip(self.edgeFrom.tolist(), self.edgeTo.tolist(), self.edgeTime.tolist())):
+            self.__adjacent[u].append((v, t, n))
+            self.__adjacent[v].append((u, t, n))
+        self.landmarkNodes = None
+        self.landmarkTimes = None
+        self.__bounds = None
+
+    def __speed(self, elementtypeCode):
+        speed = self.speeds.get(elementtypeCode)
+        return speed if speed else self.defaultSpeed
+
+    def __dijkstra(self, source):
+        """Fastest travel time from a node to all nodes (inf where not connected)"""
+        times = [float('inf')]*len(self.nodes)
+        times[source] = 0.0
+        heap = [(0.0, source)]
+        adjacent = self.__adjacent
+        while heap:
+            t, u = heapq.heappop(heap)
+            if t > times[u]:
+                continue
+            for v, dt, n in adjacent[u]:
+                tv = t+dt
+                if tv < times[v]:
+                    times[v] = tv
+                    heapq.heappush(heap, (tv, v))
+        return times
+
+    def __setLandmarks(self, landmarkNodes, landmarkTimes):
+        self.landmarkNodes = np.asarray(landmarkNodes, dtype=np.int64)
+        self.landmarkTimes = np.asarray(landmarkTimes, dtype=np.float64).reshape(len(self.landmarkNodes), len(self.nodes))
+        #Times per node as python tuples, unreachable as -1 (bounds are only taken from landmarks that reach both nodes)
+        times = np.where(np.isfinite(self.landmarkTimes), self.landmarkTimes, -1.0)
+        self.__bounds = [tuple(column) for column in times.T.tolist()]
+
+    def __lowerBound(self, node, targetTimes):
+        best = 0.0
+        for a, b in zip(self.__bounds[node], targetTimes):
+            if a >= 0 and b >= 0:
+                d = a-b if a > b else b-a
+                if d > best:
+                    best = d
+        return best
+
+    def __chains(self):
+        """Generator of (ends, edges) for the chains of edges through nodes with two edges, ends are the end nodes
+(None for chains that return to where they started) and the edges are ordered from the first end"""
+        adjacent = self.__adjacent
+        degree = [len(a) for a in adjacent]
+        visited = [False]*len(self.edgeTime)
+        for first in range(len(visited)):
+            if visited[first]:
+                continue
+            visited[first] = True
+            u, v = int(self.edgeFrom[first]), int(self.edgeTo[first])
+            #Walk from the edge in both directions until a node without two edges is reached
+            sides = []
+            for start in [v, u]:
+                edges, node, edge = [], start, first
+                while degree[node] == 2 and node != (u if start == v else v):
+                    nextNode, dt, nextEdge = [a for a in adjacent[node] if a[2] != edge][0]
+                    if visited[nextEdge]:
+                        break
+                    visited[nextEdge] = True
+                    edges.append(nextEdge)
+                    node, edge = nextNode, nextEdge
+                sides.append((node, edges))
+            (end1, edges1), (end0, edges0) = sides
+            chain = edges0[::-1]+[first]+edges1
+            yield (None if end0 == end1 else (end0, end1)), chain
+
+    def __loopRuns(self, chain):
+        """Split a closed loop (edges in order around the loop) into runs of edges of the same route,
+returns (ends, edges) for each run, or None if the whole loop is one route"""
+        edgeFrom, edgeTo = self.edgeFrom.tolist(), self.edgeTo.tolist()
+        #Nodes around the loop, nodes[i] is where edge chain[i] starts
+        node = edgeFrom[chain[0]]
+        if len(chain) > 2 and node in (edgeFrom[chain[1]], edgeTo[chain[1]]):
+            node = edgeTo[chain[0]]
+        nodes = []
+        for n in chain:
+            nodes.append(node)
+            node = edgeTo[n] if node == edgeFrom[n] else edgeFrom[n]
+        routes = [self.edgeRoute[n] for n in chain]
+        starts = [i for i in range(len(chain)) if routes[i] != routes[i-1]]
+        if not starts:
+            return None
+        runs = []
+        for k, i in enumerate(starts):
+            j = starts[(k+1) % len(starts)]
+            positions = list(range(i, j)) if j > i else list(range(i, len(chain)))+list(range(0, j))
+            runs.append(((nodes[i], nodes[j]), [chain[m] for m in positions]))
+        return runs
+
+    def __weightedMeans(self, keys, values):
+        """Length weighted mean of the edge values per key, edges without a detour are left out"""
+        sums, weights = {}, {}
+        for key, length, value in zip(keys, self.edgeLength.tolist(), values.tolist()):
+            if value == value:
+                sums[key] = sums.get(key, 0.0)+length*value
+                weights[key] = weights.get(key, 0.0)+length
+        return dict((key, round(sums[key]/weights[key], 4)) for key in sums if weights[key] > 0)
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    @classmethod
+    def fromElements(cls, elements, speeds=None, tolerance=None, landmarks=None, indexFile=None):
+        allSpeeds = dict(defaultSpeeds)
+        allSpeeds.update(speeds or {})
+        road = [(oid, parts, attrs) for oid, parts, attrs in elements
+                if allSpeeds.get(str(attrs.get('elementtype_code') or '').rstrip().upper(), True) is not None]
+        tol = tolerance if tolerance is not None else cls.tolerance
+        #Split where the roads cross each other, so crossings become nodes
+        segments = indexedGeometryBackend(splitAtElementCrossings=True, tolerance=tol).splitElements(road, [])
+        nodeIndex = {}
+        nodes = []
+        def node(point):
+            key = (int(round(point[0]/tol)), int(round(point[1]/tol)))
+            if key not in nodeIndex:
+                nodeIndex[key] = len(nodes)
+                nodes.append(point)
+            return nodeIndex[key]
+        edges = []
+        for oid, partIndex, start, end, coords, attrs in segments:
+            u, v = node(coords[0]), node(coords[-1])
+            if u != v:
+                code = str(attrs.get('elementtype_code') or '').rstrip().upper()
+                route = attrs.get('route_code')
+                edges.append((oid, None if route is None else route.rstrip(), u, v, lineLength(coords), code))
+        network = cls(edges, nodes, speeds, tolerance, landmarks)
+        if indexFile is None or not network.loadIndex(indexFile):
+            network.buildIndex()
+            if indexFile is not None:
+                network.saveIndex(indexFile)
+        return network
+
+    def graphHash(self):
+        """sha1 of the graph (nodes, edges and travel times), identifies the landmark index"""
+        h = hashlib.sha1()
+        for arr in [self.nodes, self.edgeFrom, self.edgeTo, self.edgeTime]:
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()
+
+    def buildIndex(self):
+        """Choose the landmarks farthest first (nodes in other components are infinitely far, so every component
+gets a landmark as long as there are enough) and store the travel times from them"""
+        nNodes = len(self.nodes)
+        if nNodes == 0:
+            self.__setLandmarks([], np.zeros((0, 0)))
+            return
+        nearest = np.full(nNodes, np.inf)
+        start = np.array(self.__dijkstra(0))
+        candidate = int(np.argmax(np.where(np.isfinite(start), start, -1.0)))
+        landmarkNodes, landmarkTimes = [], []
+        for k in range(min(self.landmarks, nNodes)):
+            times = np.array(self.__dijkstra(candidate))
+            landmarkNodes.append(candidate)
+            landmarkTimes.append(times)
+            nearest = np.minimum(nearest, times)
+            nearest[candidate] = -1.0
+            candidate = int(np.argmax(nearest))
+            if nearest[candidate] <= 0:
+                break
+        self.__setLandmarks(landmarkNodes, landmarkTimes)
+
+    def saveIndex(self, filename):
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, graphHash=np.array(self.graphHash()), landmarkNodes=self.landmarkNodes
+                                , landmarkTimes=self.landmarkTimes)
+        return filename
+
+    def loadIndex(self, filename):
+        """Read the landmark index if it was built for this graph, returns False if it is missing or outdated"""
+        import os
+        if not os.path.exists(filename):
+            return False
+        with np.load(filename) as data:
+            if str(data['graphHash']) != self.graphHash():
+                return False
+            self.__setLandmarks(data['landmarkNodes'], data['landmarkTimes'])
+        return True
+
+    def shortestTime(self, source, target, closed=()):
+        """A* search with the landmark bounds, the edges in closed (edge indexes) are skipped"""
+        if self.__bounds is None:
+            self.buildIndex()
+        closed = set(closed)
+        targetTimes = self.__bounds[target]
+        adjacent = self.__adjacent
+        times = {source: 0.0}
+        heap = [(self.__lowerBound(source, targetTimes), 0.0, source)]
+        while heap:
+            f, t, u = heapq.heappop(heap)
+            if u == target:
+                return t
+            if t > times[u]:
+                continue
+            for v, dt, n in adjacent[u]:
+                if n in closed:
+                    continue
+                tv = t+dt
+                if tv < times.get(v, float('inf')):
+                    times[v] = tv
+                    heapq.heappush(heap, (tv+self.__lowerBound(v, targetTimes), tv, v))
+        return float('inf')
+
+    def edgeDiversionTimes(self):
+        """Extra travel time (hours) between the ends of the chain of each edge when the edge is closed, NaN if the edge
+is a bridge of the graph. Edges are taken chain by chain (between nodes that are not on a plain road with two edges):
+traffic through a chain enters and leaves at its ends, and a closed edge blocks the whole chain, so one search
+between the ends without the chain gives the time around it (around) and the extra time is around minus the
+fastest time with the chain open, min(total, around) where total is the time along the chain.
+Closed loops are split where the route changes, a loop of a single route is searched edge by edge"""
+        edgeTime = self.edgeTime.tolist()
+        result = np.full(len(edgeTime), np.nan)
+        for ends, chain in self.__chains():
+            runs = [(ends, chain)] if ends is not None else self.__loopRuns(chain)
+            if runs is None:
+                for n in chain:
+                    detour = self.shortestTime(int(self.edgeFrom[n]), int(self.edgeTo[n]), (n,))
+                    if detour < float('inf'):
+                        result[n] = max(detour-edgeTime[n], 0.0)
+                continue
+            for (start, end), edges in runs:
+                around = self.shortestTime(start, end, edges)
+                if around == float('inf'):
+                    continue
+                total = sum(edgeTime[n] for n in edges)
+                result[edges] = max(around-total, 0.0)
+        return result
+
+    def routeDiversionTimes(self, edgeTimes=None):
+        edgeTimes = self.edgeDiversionTimes() if edgeTimes is None else edgeTimes
+        means = self.__weightedMeans(self.edgeRoute, edgeTimes)
+        means.pop(None, None)
+        return means
+
+    def diversionTimes(self, level='route'):
+        """Diversion time per element oid, by 'route' (the same for every element of a route, as the model expects)
+or by 'element'. Elements without a route code get their own value, elements without a detour are left out"""
+        if level not in ['route', 'element']:
+            raise Exception("Diversion times are computed by route or element, not {0}".format(level))
+        edgeTimes = self.edgeDiversionTimes()
+        result = self.__weightedMeans(self.edgeElement.tolist(), edgeTimes)
+        if level == 'route':
+            routes = self.routeDiversionTimes(edgeTimes)
+            for oid, route in zip(self.edgeElement.tolist(), self.edgeRoute):
+                if route in routes:
+                    result[oid] = routes[route]
+        return result
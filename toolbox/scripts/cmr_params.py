@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Compiled parameter packs for the CICERO Multirisk risk engine
+
+Usage: python cmr_params.py cmrGeo.sde cmr_parameters.npz
+
+The parameter tables (cmrT_ProcessType, cmrT_ElementType, cmrT_ValueType with cmrT_ValueTypeCalculation,
+cmrT_ElementValue and cmrT_DamageFunction) are joined once into dense arrays indexed by element type, process type
+and value type, and stamped with a hash of their content. The pack is stored as one npz file.
+"""
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from cmr_engine import cmrengine, damageFunctionStats, toFloatArray, toIntArray
+
+#Tables that are compiled into a pack
+parameterTableNames = ['processtype', 'elementtype', 'valuetype', 'elementvalue', 'damagefunction']
+#Arrays holding text, they are stored as unicode arrays
+textArrays = ['processtypeNames', 'elementtypeCodes', 'elementcategoryNames', 'valuetypeNames', 'valuetypeCategoryNames']
+
+def _text(values):
+    return np.array([u'' if v is None else u'{0}'.format(v) for v in values], dtype=np.str_ if sys.version_info[0] > 2 else np.unicode_)
+
+def _number(value):
+    """A float for the content hash, NULL and nan are both None"""
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class cmrparameterpack:
+    """The joined model parameters as dense arrays
+Processtypes, element types and value types keep the order of the parameter tables (the hard coded frequency
+value types of cmrengine are appended). Element values are [elementtype, valuetype] arrays and damage functions
+are [processtype, valuetype] arrays with hasValue and hasDamage telling which combinations exist.
+hash is a sha1 of the parameter content (independent of row order), so it only changes when a parameter
+that the engine uses is edited.
+Methods:
+fromTables(tables)
+Compiles a pack from parameter table rows (as selected by cmrengine.fetchParameterTables)
+
+fromSde(sdeConn)
+Compiles a pack from the parameter tables in the cmr database
+
+save(filename) and load(filename)
+Writes the pack as an npz file and reads it back (the hash is verified)
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Version of the pack layout, part of the hash
+    packVersion = 1
+    #Names of the arrays in a pack
+    arrayNames = ['processtypeIds', 'processtypeNames', 'eventWidth', 'frequencySizeFactor', 'cooccurrenceFactor'
+                  , 'elementtypeIds', 'elementtypeCodes', 'elementcategoryIds', 'elementcategoryNames'
+                  , 'valuetypeIds', 'valuetypeNames', 'valuetypeCategoryIds', 'valuetypeCategoryNames', 'valuetypeFlags'
+                  , 'hasValue', 'value_mean', 'value_PosErr', 'value_NegErr'
+                  , 'hasDamage', 'fixedDamage', 'damage_prob', 'damage_max', 'damage_exponent', 'V', 'V_PosErr', 'V_NegErr']
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, arrays):
+        for name in self.arrayNames:
+            setattr(self, name, arrays[name])
+        self.hash = self.__contentHash()
+
+    def __contentHash(self):
+        """sha1 of the parameters keyed by ids, sorted so the order of the table rows does not matter"""
+        pt = [int(x) for x in self.processtypeIds]
+        et = [int(x) for x in self.elementtypeIds]
+        vt = [int(x) for x in self.valuetypeIds]
+        content = {'version': self.packVersion
+                   , 'processtype': sorted([pt[n], self.processtypeNames[n], _number(self.eventWidth[n])
+                                            , _number(self.frequencySizeFactor[n]), _number(self.cooccurrenceFactor[n])]
+                                           for n in range(len(pt)))
+                   , 'elementtype': sorted([et[n], self.elementtypeCodes[n], int(self.elementcategoryIds[n])
+                                            , self.elementcategoryNames[n]] for n in range(len(et)))
+                   , 'valuetype': sorted([vt[n], self.valuetypeNames[n], int(self.valuetypeCategoryIds[n]), self.valuetypeCategoryNames[n]]
+                                         + [_number(x) for x in self.valuetypeFlags[n]] for n in range(len(vt)))
+                   , 'elementvalue': sorted([et[i], vt[j], _number(self.value_mean[i, j]), _number(self.value_PosErr[i, j])
+                                             , _number(self.value_NegErr[i, j])] for i, j in zip(*np.nonzero(self.hasValue)))
+                   , 'damagefunction': sorted([pt[i], vt[j], bool(self.fixedDamage[i, j]), _number(self.damage_prob[i, j])
+                                               , _number(self.damage_max[i, j]), _number(self.damage_exponent[i, j])]
+                                              for i, j in zip(*np.nonzero(self.hasDamage)))}
+        strContent = json.dumps(content, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(strContent.encode('utf-8')).hexdigest()
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    @classmethod
+    def fromTables(cls, tables):
+        """Join the parameter tables the way cmrV_ElementValue and cmrV_DamageFunction do"""
+        a = {}
+        #Process types
+        ptRows = [r for r in tables['processtype']]
+        a['processtypeIds'] = toIntArray([r[0] for r in ptRows])
+        a['processtypeNames'] = _text([r[1] for r in ptRows])
+        eventWidth = toFloatArray([r[2] for r in ptRows])
+        a['frequencySizeFactor'] = toFloatArray([r[3] for r in ptRows])
+        a['cooccurrenceFactor'] = toFloatArray([r[4] for r in ptRows])
+        with np.errstate(divide='ignore'):
+            #If both width and frequency_size_factor is NULL this will still be NULL
+            a['eventWidth'] = np.where(np.isnan(eventWidth), 1.0/a['frequencySizeFactor'], eventWidth)
+        ptIndex = dict((pid, n) for n, pid in enumerate(a['processtypeIds']))
+
+        #Element types
+        etRows = [r for r in tables['elementtype']]
+        a['elementtypeIds'] = toIntArray([r[0] for r in etRows])
+        a['elementtypeCodes'] = _text([r[1] for r in etRows])
+        a['elementcategoryIds'] = toIntArray([r[2] for r in etRows])
+        a['elementcategoryNames'] = _text([r[3] for r in etRows])
+        etIndex = dict((eid, n) for n, eid in enumerate(a['elementtypeIds']))
+
+        #Value types including the hard coded frequency value types
+        vtRows = [r for r in tables['valuetype']] + [list(r) for r in cmrengine.fixedValueTypes]
+        a['valuetypeIds'] = toIntArray([r[0] for r in vtRows])
+        a['valuetypeNames'] = _text([r[1] for r in vtRows])
+        a['valuetypeCategoryIds'] = toIntArray([r[2] for r in vtRows])
+        a['valuetypeCategoryNames'] = _text([r[9] for r in vtRows])
+        a['valuetypeFlags'] = np.array([toFloatArray(r[3:9]) for r in vtRows]).reshape(len(vtRows), 6)
+        vtIndex = dict((vid, n) for n, vid in enumerate(a['valuetypeIds']))
+        nEt, nPt, nVt = len(etRows), len(ptRows), len(vtRows)
+
+        #Element values, the hard coded ones have value 1 and no errors for every element type
+        evRows = [r for r in tables['elementvalue'] if r[0] in etIndex and r[1] in vtIndex]
+        for fixed in cmrengine.fixedValueTypes:
+            evRows += [[eid, fixed[0], 1, 0, 0] for eid in a['elementtypeIds']]
+        a['hasValue'] = np.zeros((nEt, nVt), dtype=bool)
+        for name in ['value_mean', 'value_PosErr', 'value_NegErr']:
+            a[name] = np.zeros((nEt, nVt))
+        for r in evRows:
+            i, j = etIndex[r[0]], vtIndex[r[1]]
+            a['hasValue'][i, j] = True
+            a['value_mean'][i, j], a['value_PosErr'][i, j], a['value_NegErr'][i, j] = toFloatArray(r[2:5])
+
+        #Damage functions, the hard coded ones have average 1 and no errors for every process type
+        dfPams = np.zeros((nPt, nVt, 3))
+        dfPams[:, :, 0:2] = 1
+        a['hasDamage'] = np.zeros((nPt, nVt), dtype=bool)
+        for r in tables['damagefunction']:
+            if r[0] in ptIndex and r[1] in vtIndex:
+                i, j = ptIndex[r[0]], vtIndex[r[1]]
+                a['hasDamage'][i, j] = True
+                dfPams[i, j] = toFloatArray(r[2:5])
+        fixedColumns = np.zeros(nVt, dtype=bool)
+        fixedColumns[[vtIndex[fixed[0]] for fixed in cmrengine.fixedValueTypes]] = True
+        a['fixedDamage'] = ~a['hasDamage'] & fixedColumns[np.newaxis, :]
+        a['hasDamage'] = a['hasDamage'] | a['fixedDamage']
+        a['damage_prob'], a['damage_max'], a['damage_exponent'] = dfPams[:, :, 0], dfPams[:, :, 1], dfPams[:, :, 2]
+        V, V_PosErr, V_NegErr = damageFunctionStats(a['damage_prob'], a['damage_max'], a['damage_exponent'])
+        a['V'] = np.where(a['fixedDamage'], 1.0, V)
+        a['V_PosErr'] = np.where(a['fixedDamage'], 0.0, V_PosErr)
+        a['V_NegErr'] = np.where(a['fixedDamage'], 0.0, V_NegErr)
+        return cls(a)
+
+    @classmethod
+    def fromSde(cls, sdeConn):
+        return cls.fromTables(cmrengine.fetchParameterTables(sdeConn))
+
+    @classmethod
+    def load(cls, filename):
+        """Read a pack written with save, raises an exception if the content does not match the stored hash"""
+        with np.load(filename) as data:
+            arrays = dict((name, data[name]) for name in cls.arrayNames)
+            storedHash = str(data['hash'])
+        pack = cls(arrays)
+        if pack.hash != storedHash:
+            raise Exception("The parameter pack {0} is corrupt or from another version (hash {1}, expected {2})".format(
+                filename, pack.hash, storedHash))
+        return pack
+
+    def save(self, filename):
+        """Write the pack as an npz file, returns the filename"""
+        arrays = dict((name, getattr(self, name)) for name in self.arrayNames)
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, hash=np.array(self.hash), **arrays)
+        return filename
+
+    def text(self, name):
+        """A text array as a list of strings"""
+        return [u'{0}'.format(x) for x in getattr(self, name).tolist()]
+
+
+class cmrresultcache:
+    """Summary arrays of engines stored as npz files, keyed by the parameter pack hash and a hash of the study data.
+An edit of a parameter (or of the study) gives new keys, so stale results are never returned and
+results computed with other parameters remain available.
+Methods:
+get(engine, level)
+Returns (keys, values) as cmrengine.summaryArrays(level), None if not cached
+
+put(engine, level, keys, values)
+Stores summary arrays
+    """
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def __filename(self, engine, level):
+        key = hashlib.sha1("{0}:{1}:{2}:{3}".format(engine.parameterHash, engine.dataHash(), engine.studyId, level).encode('utf-8'))
+        return os.path.join(self.directory, "{0}_{1}.npz".format(level, key.hexdigest()))
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def get(self, engine, level):
+        filename = self.__filename(engine, level)
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        with np.load(filename) as data:
+            keyNames = [str(x) for x in data['keyNames'].tolist()]
+            keys = {}
+            for n, name in enumerate(keyNames):
+                arr = data['key{0}'.format(n)]
+                if arr.dtype.kind == 'U':
+                    isNull = data['null{0}'.format(n)]
+                    arr = [None if isNull[i] else x for i, x in enumerate(arr.tolist())]
+                keys[name] = arr
+            values = data['values']
+        self.hits += 1
+        return keys, values
+
+    def put(self, engine, level, keys, values):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        keyNames = sorted(keys)
+        arrays = {'keyNames': _text(keyNames), 'values': np.asarray(values)}
+        for n, name in enumerate(keyNames):
+            arr = np.asarray(keys[name]) if not isinstance(keys[name], list) else None
+            if arr is not None and arr.dtype.kind in 'iuf':
+                arrays['key{0}'.format(n)] = arr
+            else:
+                arrays['key{0}'.format(n)] = _text(keys[name])
+                arrays['null{0}'.format(n)] = np.array([x is None for x in keys[name]], dtype=bool)
+        filename = self.__filename(engine, level)
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+        return filename
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    import arcpy
+    pack = cmrparameterpack.fromSde(arcpy.ArcSDESQLExecute(sys.argv[1]))
+    pack.save(sys.argv[2])
+    print("Parameter pack {0} written to {1}".format(pack.hash, sys.argv[2]))
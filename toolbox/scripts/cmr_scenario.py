@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from cmr_engine import cmrengine, damageFunctionStats, roundDecimal, routeEventFrequency
+
+#Attributes that can be overridden in a scenario
+zoneAttributes = ['event_frequency']
+elementAttributes = ['aadt_passenger', 'aadt_goods', 'diversion_time']
+valueParameters = ['value_mean', 'value_PosErr', 'value_NegErr']
+damageParameters = ['damage_prob', 'damage_max', 'damage_exponent']
+
+
+class cmrscenario:
+    """What-if scenarios (e.g. mitigations) on top of a study, evaluated as deltas to the baseline
+A scenario is a dict of overrides:
+{'hazardzone': {hazardzone_id: {'event_frequency': value}}
+ , 'element': {element_id: {'aadt_passenger': value, 'aadt_goods': value, 'diversion_time': value}}
+ , 'parameters': {('damage_prob', processtype_id, valuetype_id): value, ('value_mean', elementtype_id, valuetype_id): value}}
+(parameter names as in cmr_sweep: value_mean, value_PosErr, value_NegErr, damage_prob, damage_max, damage_exponent).
+Only the element hazard zone pairs that a scenario touches are evaluated again: the pairs of the changed zones
+(their route event frequencies are adjusted for cooccurring events again from all pairs of the zone), the pairs of the
+changed elements and the pairs of the element types and process types with changed parameters. The change of their
+risk is added to the baseline sums of the elements, routes and the study.
+Methods:
+evaluate(scenario)
+Returns {'element': ..., 'route': ..., 'study': ...} where each level is a dict with keys, base, scenario and delta
+arrays (rounded as the summary views), the element level only holds the elements that changed
+
+evaluateMany(scenarios, level='study')
+Returns (base, scenarios, deltas) arrays with one row per scenario for the study or the routes
+    """
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, engine):
+        """engine is a cmrengine with the study (baseline) loaded"""
+        self.engine = engine
+        self.columns = [name for categoryId, name in engine.summaryColumns]
+        self.routeCodes = list(engine.routeCodes)
+        e = engine
+        keys, self.__pairValues = e.summaryArrays('pair', rounded=False)
+        self.__routeEventFrequency = e.pairFrequencies()['route_event_frequency']
+        nElements, nRoutes = len(e.elementIds), len(self.routeCodes)
+        self.__baseElement = self.__sum(e.pairElement, self.__pairValues, nElements)
+        self.__baseRoute = self.__sum(e.elementRoute, self.__baseElement, nRoutes)
+        self.__baseStudy = self.__pairValues.sum(axis=0).reshape(1, len(self.columns))
+        #Pairs of each zone and each element (sorted, so they can be found with searchsorted)
+        self.__zoneOrder = np.argsort(e.pairZone, kind='mergesort')
+        self.__elementOrder = np.argsort(e.pairElement, kind='mergesort')
+        self.__elementIndex = dict((int(eid), n) for n, eid in enumerate(e.elementIds))
+        self.__zoneIndex = dict((int(zid), n) for n, zid in enumerate(e.hazardzoneIds))
+        self.__elementtypeIndex = dict((int(x), n) for n, x in enumerate(e.elementtypeIds))
+        self.__processtypeIndex = dict((int(x), n) for n, x in enumerate(e.processtypeIds))
+        self.__valuetypeIndex = dict((int(x), n) for n, x in enumerate(e.valuetypeIds))
+
+    def __sum(self, index, values, n):
+        sums = np.zeros((n, values.shape[1]))
+        for c in range(values.shape[1]):
+            sums[:, c] = np.bincount(index, weights=values[:, c], minlength=n)
+        return sums
+
+    def __pairsOf(self, order, keys, items):
+        """Positions of the pairs whose key (pairZone or pairElement) is one of items"""
+        items = np.asarray(sorted(items), dtype=np.int64)
+        sortedKeys = keys[order]
+        start = np.searchsorted(sortedKeys, items, side='left')
+        end = np.searchsorted(sortedKeys, items, side='right')
+        if len(items) == 0 or (end-start).sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([order[a:b] for a, b in zip(start, end)])
+
+    def __lookup(self, index, key, name):
+        if int(key) not in index:
+            raise Exception("Unknown {0} {1} in the scenario".format(name, key))
+        return index[int(key)]
+
+    def __scenarioPack(self, parameters):
+        """The parameter pack with the overrides applied, and the changed element types and process types"""
+        from cmr_params import cmrparameterpack
+        pack = self.engine.parameterPack
+        if not parameters:
+            return pack, set(), set()
+        arrays = dict((name, getattr(pack, name)) for name in pack.arrayNames)
+        for name in valueParameters + damageParameters + ['V', 'V_PosErr', 'V_NegErr']:
+            arrays[name] = arrays[name].copy()
+        elementtypes, processtypes = set(), set()
+        for (name, typeId, valuetypeId), value in parameters.items():
+            j = self.__lookup(self.__valuetypeIndex, valuetypeId, 'valuetype_id')
+            if name in valueParameters:
+                i = self.__lookup(self.__elementtypeIndex, typeId, 'elementtype_id')
+                if not pack.hasValue[i, j]:
+                    raise Exception("Element type {0} has no value for valuetype {1}".format(typeId, valuetypeId))
+                arrays[name][i, j] = value
+                elementtypes.add(i)
+            elif name in damageParameters:
+                i = self.__lookup(self.__processtypeIndex, typeId, 'processtype_id')
+                if not pack.hasDamage[i, j] or pack.fixedDamage[i, j]:
+                    raise Exception("Process type {0} has no damage function for valuetype {1}".format(typeId, valuetypeId))
+                arrays[name][i, j] = value
+                V, V_PosErr, V_NegErr = damageFunctionStats(arrays['damage_prob'][i, j], arrays['damage_max'][i, j]
+                                                            , arrays['damage_exponent'][i, j])
+                arrays['V'][i, j], arrays['V_PosErr'][i, j], arrays['V_NegErr'][i, j] = V, V_PosErr, V_NegErr
+                processtypes.add(i)
+            else:
+                raise Exception("Unknown parameter {0}".format(name))
+        return cmrparameterpack(arrays), elementtypes, processtypes
+
+    def __pairDelta(self, scenario):
+        """Positions of the pairs the scenario touches and the change of their pivoted risk"""
+        e = self.engine
+        zoneChanges = dict((self.__lookup(self.__zoneIndex, zid, 'hazardzone_id'), attrs)
+                           for zid, attrs in scenario.get('hazardzone', {}).items())
+        elementChanges = dict((self.__lookup(self.__elementIndex, eid, 'element_id'), attrs)
+                              for eid, attrs in scenario.get('element', {}).items())
+        for attrs, allowed in [(a, zoneAttributes) for a in zoneChanges.values()] + [(a, elementAttributes) for a in elementChanges.values()]:
+            for name in attrs:
+                if name not in allowed:
+                    raise Exception("{0} cannot be changed in a scenario".format(name))
+        pack, elementtypes, processtypes = self.__scenarioPack(scenario.get('parameters'))
+
+        zonePairs = self.__pairsOf(self.__zoneOrder, e.pairZone, zoneChanges.keys())
+        touched = [zonePairs, self.__pairsOf(self.__elementOrder, e.pairElement, elementChanges.keys())]
+        if elementtypes:
+            changed = np.zeros(len(e.elementtypeIds), dtype=bool)
+            changed[sorted(elementtypes)] = True
+            touched.append(np.nonzero(changed[e.elementElementtype[e.pairElement]])[0])
+        if processtypes:
+            changed = np.zeros(len(e.processtypeIds), dtype=bool)
+            changed[sorted(processtypes)] = True
+            touched.append(np.nonzero(changed[e.hazardzoneProcesstype[e.pairZone]])[0])
+        pairs = np.unique(np.concatenate(touched))
+        if len(pairs) == 0:
+            return pairs, np.zeros((0, len(self.columns)))
+
+        #Zone and element rows of the touched pairs with the overrides
+        zones = np.unique(e.pairZone[pairs])
+        elements = np.unique(e.pairElement[pairs])
+        zoneFrequency = e.hazardzoneFrequency.copy()
+        for z, attrs in zoneChanges.items():
+            if 'event_frequency' in attrs:
+                zoneFrequency[z] = attrs['event_frequency']
+        elementAttrs = {'aadt_passenger': e.aadtPassenger, 'aadt_goods': e.aadtGoods, 'diversion_time': e.diversionTime}
+        elementValues = dict((name, values[elements].copy()) for name, values in elementAttrs.items())
+        position = dict((int(x), n) for n, x in enumerate(elements))
+        for ei, attrs in elementChanges.items():
+            for name, value in attrs.items():
+                elementValues[name][position[ei]] = value
+
+        #Route event frequency: all pairs of a changed zone are touched, so the cooccurrence adjustment is redone
+        #for each (zone, route) of the changed zones, the other pairs keep their baseline value
+        ref = self.__routeEventFrequency[pairs].copy()
+        if len(zonePairs):
+            ptn = e.hazardzoneProcesstype[e.pairZone[zonePairs]]
+            fsf = e.frequencySizeFactor[ptn]
+            eventFrequency = np.where(np.isnan(fsf), 1.0, e.elementSize[e.pairElement[zonePairs]]*fsf)/zoneFrequency[e.pairZone[zonePairs]]
+            route = e.elementRoute[e.pairElement[zonePairs]]
+            hasRoute = np.array([self.routeCodes[r] is not None for r in route], dtype=bool)
+            zoneRef = routeEventFrequency(e.pairZone[zonePairs], np.where(hasRoute, route, -1), eventFrequency, e.cooccurrenceFactor[ptn])
+            ref[np.searchsorted(pairs, zonePairs)] = zoneRef
+
+        tables = {'element': [[int(e.elementIds[ei]), int(e.elementFeatureIds[ei]), e.elementSize[ei]
+                               , e.elementtypeCodes[e.elementElementtype[ei]], self.routeCodes[e.elementRoute[ei]]
+                               , elementValues['aadt_passenger'][n], elementValues['aadt_goods'][n], elementValues['diversion_time'][n]]
+                              for n, ei in enumerate(elements)]
+                  , 'hazardzone': [[int(e.hazardzoneIds[z]), int(e.hazardzoneFeatureIds[z]), int(e.processtypeIds[e.hazardzoneProcesstype[z]])
+                                    , zoneFrequency[z], e.hazardzoneFreqPlus[z], e.hazardzoneFreqMinus[z]] for z in zones]
+                  , 'elementhazardzone': [[int(e.elementIds[e.pairElement[p]]), int(e.hazardzoneIds[e.pairZone[p]]), ref[n]]
+                                          for n, p in enumerate(pairs)]}
+        keys, values = cmrengine(e.studyId, tables, pack).summaryArrays('pair', rounded=False)
+        return pairs, values-self.__pairValues[pairs]
+
+    def __level(self, keys, base, delta):
+        scenario = roundDecimal(base+delta)
+        base = roundDecimal(base)
+        return {'keys': keys, 'base': base, 'scenario': scenario, 'delta': scenario-base}
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def evaluate(self, scenario):
+        e = self.engine
+        pairs, delta = self.__pairDelta(scenario)
+        elements, index = np.unique(e.pairElement[pairs], return_inverse=True)
+        elementDelta = self.__sum(index.ravel(), delta, len(elements))
+        routeDelta = self.__sum(e.elementRoute[elements], elementDelta, len(self.routeCodes))
+        return {'element': self.__level({'element_id': e.elementIds[elements], 'element_feature_id': e.elementFeatureIds[elements]}
+                                        , self.__baseElement[elements], elementDelta)
+                , 'route': self.__level({'route_code': self.routeCodes}, self.__baseRoute, routeDelta)
+                , 'study': self.__level({}, self.__baseStudy, delta.sum(axis=0).reshape(1, len(self.columns)))
+                , 'pairs': len(pairs)}
+
+    def evaluateMany(self, scenarios, level='study'):
+        """Evaluate a list of scenarios, returns (base, scenario, delta) for the study (nScenarios x nColumns)
+or the routes (nScenarios x nRoutes x nColumns)"""
+        if level not in ['study', 'route']:
+            raise Exception("Scenarios can be compared by study or route, not {0}".format(level))
+        results = [self.evaluate(scenario)[level] for scenario in scenarios]
+        stack = lambda name: np.array([r[name] for r in results])
+        if level == 'study':
+            return roundDecimal(self.__baseStudy[0]), stack('scenario')[:, 0, :], stack('delta')[:, 0, :]
+        return roundDecimal(self.__baseRoute), stack('scenario'), stack('delta')
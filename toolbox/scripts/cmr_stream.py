@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+from cmr_engine import cmrengine, fetchRows, roundDecimal
+
+#Select of one chunk of intersections with the element and hazard zone attributes, in the order of the clustered
+#index of cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) so each chunk is a range seek that continues
+#where the previous ended (keyset pagination)
+sqlSelectChunk = """SELECT TOP {1} ehz.element_id, ehz.hazardzone_id, ehz.route_event_frequency
+                    , e.element_feature_id, e.element_size, e.elementtype_code, e.route_code
+                    , e.aadt_passenger, e.aadt_goods, e.diversion_time
+                    , hz.hazardzone_feature_id, hz.processtype_id, hz.event_frequency
+                    , hz.freq_error_interval_plus, hz.freq_error_interval_minus
+                    FROM cmrT_ElementHazardZone ehz
+                    INNER JOIN cmrT_Element e ON ehz.study_id=e.study_id AND ehz.element_id=e.element_id
+                    INNER JOIN cmrT_HazardZone hz ON ehz.study_id=hz.study_id AND ehz.hazardzone_id=hz.hazardzone_id
+                    WHERE ehz.study_id={0} AND (ehz.element_id>{2} OR (ehz.element_id={2} AND ehz.hazardzone_id>{3}))
+                    ORDER BY ehz.element_id, ehz.hazardzone_id"""
+
+def sdeSource(sdeConn, studyId, chunkSize):
+    """A chunk source reading the intersections of a study from the cmr database in chunks of chunkSize rows.
+The route_event_frequency stored by cmrSP_updateRouteEventFrequency is used, so chunks can be evaluated on their own.
+Chunks are ordered by element_id, so all elements before the last one of a chunk are complete"""
+    def chunks(after=None):
+        elementId, hazardzoneId = after if after is not None else (0, 0)
+        while True:
+            rows = fetchRows(sdeConn, sqlSelectChunk.format(studyId, int(chunkSize), elementId, hazardzoneId))
+            if not rows:
+                return
+            tables = {'element': dict((r[0], [r[0], r[3], r[4], r[5], r[6], r[7], r[8], r[9]]) for r in rows).values()
+                      , 'hazardzone': dict((r[1], [r[1], r[10], r[11], r[12], r[13], r[14]]) for r in rows).values()
+                      , 'elementhazardzone': [[r[0], r[1], r[2]] for r in rows]}
+            elementId, hazardzoneId = rows[-1][0], rows[-1][1]
+            yield [elementId, hazardzoneId], tables, len(rows), elementId
+            if len(rows) < chunkSize:
+                return
+    return chunks
+
+def importRowSource(importRows, parameterPack, chunkSize, ordered=False):
+    """A chunk source of import table rows (dicts, as for cmrengine.fromImportRows) with one row per element hazard zone pair.
+importRows is a list or a function returning a new iterator over the rows (it is read twice).
+The first pass sums the event frequencies per hazard zone and route, so the route event frequency of every pair
+is known when the chunks are evaluated. With ordered=True the rows are ordered by element_feature_id and elements
+are completed chunk by chunk"""
+    def iterRows():
+        return importRows() if callable(importRows) else iter(importRows)
+    pack = parameterPack
+    ptIndex = dict((int(pid), n) for n, pid in enumerate(pack.processtypeIds))
+    etCodes = set(str(code).rstrip().upper() for code in pack.text('elementtypeCodes'))
+
+    def valid(row):
+        if not row.get('event_frequency') or row['event_frequency'] <= 0 or not row.get('element_size') or row['element_size'] <= 0:
+            return False
+        pt = row.get('processtype_id') or 0
+        return pt in ptIndex and pt not in cmrengine.excludedProcesstypes and str(row.get('elementtype_code')).rstrip().upper() in etCodes
+
+    def pairFrequency(row):
+        """event_frequency of the pair as in cmrV_ElementHazardZone"""
+        n = ptIndex[row.get('processtype_id') or 0]
+        fsf = pack.frequencySizeFactor[n]
+        return (1.0 if np.isnan(fsf) else row['element_size']*fsf)/row['event_frequency'], pack.cooccurrenceFactor[n]
+
+    def routeKey(row):
+        route = row.get('route_code')
+        return None if route is None else route.rstrip()
+
+    #First pass: sum and max of the event frequencies per (hazard zone, route)
+    routeZones = {}
+    for row in iterRows():
+        route = routeKey(row)
+        if route is None or not valid(row):
+            continue
+        freq, cof = pairFrequency(row)
+        s = routeZones.setdefault((row['hazardzone_feature_id'], route), [0.0, 0.0, cof])
+        s[0] += freq
+        s[1] = max(s[1], freq)
+
+    def chunks(after=None):
+        skip = after or 0
+        position = 0
+        elements, zones, pairs = {}, {}, []
+        for row in iterRows():
+            position += 1
+            if position <= skip:
+                continue
+            if valid(row):
+                eid = row['element_feature_id']
+                zid = row['hazardzone_feature_id']
+                if eid not in elements:
+                    elements[eid] = [eid, eid, row['element_size'], row.get('elementtype_code'), row.get('route_code')
+                                     , row.get('aadt_passenger') or 0, row.get('aadt_goods') or 0, row.get('diversion_time') or 0]
+                if zid not in zones:
+                    zones[zid] = [zid, zid, row.get('processtype_id') or 0, row['event_frequency']
+                                  , row.get('freq_interval_plus') or 0, row.get('freq_interval_minus') or 0]
+                route = routeKey(row)
+                ref = 0.0
+                if route is not None:
+                    freq, cof = pairFrequency(row)
+                    freqSum, freqMax, cof = routeZones[(zid, route)]
+                    if freqSum > 0:
+                        ref = (freqMax+(1-cof)*(freqSum-freqMax))*freq/freqSum
+                pairs.append([eid, zid, ref])
+            if position-skip >= chunkSize:
+                yield position, {'element': elements.values(), 'hazardzone': zones.values(), 'elementhazardzone': pairs} \
+                    , position-skip, (max(elements) if ordered and elements else None)
+                skip = position
+                elements, zones, pairs = {}, {}, []
+        if position > skip:
+            yield position, {'element': elements.values(), 'hazardzone': zones.values(), 'elementhazardzone': pairs} \
+                , position-skip, None
+    return chunks
+
+
+class cmrstream:
+    """Evaluates the element, route and study summaries of a study chunk by chunk in bounded memory
+A chunk source (sdeSource or importRowSource) yields chunks of intersections with the element and hazard zone
+attributes. Each chunk is evaluated by a cmrengine with the compiled parameter pack, and the unrounded partial
+sums are merged per element, route and study (rounded as the summary views when the study is complete).
+Completed elements are appended to elements.csv in the directory, so memory only holds the routes and the elements
+of the current chunk. After every chunk a checkpoint is written, and a run that is interrupted continues from the
+last checkpoint when it is started again.
+Methods:
+run(source, resume=True)
+Evaluates all chunks of the source, returns {'route': (keys, values), 'study': (keys, values), 'elements': n}
+(with 'element': (keys, values) as well if there is no directory)
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Files in the directory
+    checkpointName = 'checkpoint.json'
+    elementName = 'elements.csv'
+    #Write a checkpoint after this many chunks
+    checkpointEvery = 1
+    checkpointVersion = 1
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, studyId, parameterPack, directory=None, msgFunc=None):
+        self.studyId = studyId
+        self.parameterPack = parameterPack
+        self.directory = directory
+        self.columns = [name for categoryId, name in cmrengine.summaryColumns]
+        self.__msgFunc = msgFunc
+
+    def __showMsg(self, strMsg):
+        if self.__msgFunc:
+            self.__msgFunc(strMsg)
+
+    def __path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __newState(self):
+        return {'version': self.checkpointVersion
+                , 'study_id': self.studyId
+                , 'parameter_hash': self.parameterPack.hash
+                , 'after': None
+                , 'chunks': 0
+                , 'rows': 0
+                , 'elements': 0
+                , 'element_offset': 0
+                , 'pending': []
+                , 'route': []
+                , 'study': None
+                , 'complete': False}
+
+    def __readCheckpoint(self):
+        """The state of an interrupted run of the same study and parameters, None if there is none"""
+        if self.directory is None or not os.path.exists(self.__path(self.checkpointName)):
+            return None
+        with open(self.__path(self.checkpointName)) as f:
+            state = json.load(f)
+        if state.get('version') != self.checkpointVersion or state.get('study_id') != self.studyId \
+                or state.get('parameter_hash') != self.parameterPack.hash:
+            self.__showMsg("Checkpoint in {0} is from another study or parameter version, starting over".format(self.directory))
+            return None
+        return state
+
+    def __writeCheckpoint(self, state):
+        """Replace the checkpoint (written to a temporary file first so a crash never leaves a partial checkpoint)"""
+        filename = self.__path(self.checkpointName)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(state, f)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+
+    def __writeElements(self, f, rows):
+        for elementId, featureId, sums in rows:
+            values = roundDecimal(np.asarray(sums))
+            f.write(",".join([str(self.studyId), str(int(elementId)), str(int(featureId))] + [repr(float(v)) for v in values]) + "\n")
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def run(self, source, resume=True):
+        state = self.__readCheckpoint() if resume else None
+        if state is None:
+            state = self.__newState()
+        elif state['complete']:
+            self.__showMsg("Study {0} was already streamed to {1}".format(self.studyId, self.directory))
+        else:
+            self.__showMsg("Resuming study {0} after {1} chunks ({2} rows)".format(self.studyId, state['chunks'], state['rows']))
+
+        nColumns = len(self.columns)
+        pending = dict((r[0], (r[1], np.array(r[2]))) for r in state['pending'])
+        routes = dict((r[0], np.array(r[1])) for r in state['route'])
+        study = np.array(state['study']) if state['study'] is not None else np.zeros(nColumns)
+        elementFile = None
+        finished = []
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            elementPath = self.__path(self.elementName)
+            if state['element_offset'] and os.path.exists(elementPath):
+                #Drop elements written after the last checkpoint, they are written again
+                elementFile = open(elementPath, 'r+b')
+                elementFile.truncate(state['element_offset'])
+                elementFile.close()
+                elementFile = open(elementPath, 'a')
+            else:
+                elementFile = open(elementPath, 'w')
+                elementFile.write(",".join(['study_id', 'element_id', 'element_feature_id'] + self.columns) + "\n")
+        try:
+            chunks = [] if state['complete'] else source(state['after'])
+            for key, tables, nRows, completeBelow in chunks:
+                engine = cmrengine(self.studyId, tables, self.parameterPack)
+                keys, values = engine.summaryArrays('element', rounded=False)
+                for n in range(len(values)):
+                    elementId = int(keys['element_id'][n])
+                    if elementId in pending:
+                        pending[elementId][1][:] += values[n]
+                    else:
+                        pending[elementId] = (int(keys['element_feature_id'][n]), values[n].copy())
+                keys, values = engine.summaryArrays('route', rounded=False)
+                for n, code in enumerate(keys['route_code']):
+                    if code in routes:
+                        routes[code] += values[n]
+                    else:
+                        routes[code] = values[n].copy()
+                keys, values = engine.summaryArrays('study', rounded=False)
+                if len(values):
+                    study += values[0]
+                #Elements before completeBelow get no more rows
+                done = sorted(eid for eid in pending if completeBelow is not None and eid < completeBelow)
+                rows = [(eid,) + pending.pop(eid) for eid in done]
+                if elementFile is not None:
+                    self.__writeElements(elementFile, rows)
+                else:
+                    finished += rows
+                state['after'] = key
+                state['chunks'] += 1
+                state['rows'] += nRows
+                state['elements'] += len(rows)
+                self.__showMsg("Chunk {0}: {1} rows, {2} elements completed".format(state['chunks'], nRows, len(rows)))
+                if elementFile is not None and state['chunks'] % self.checkpointEvery == 0:
+                    elementFile.flush()
+                    state['element_offset'] = elementFile.tell()
+                    state['pending'] = [[eid, fid, sums.tolist()] for eid, (fid, sums) in pending.items()]
+                    state['route'] = [[code, sums.tolist()] for code, sums in routes.items()]
+                    state['study'] = study.tolist()
+                    self.__writeCheckpoint(state)
+
+            #The remaining elements are complete when the source is exhausted
+            rows = [(eid,) + pending.pop(eid) for eid in sorted(pending)]
+            if elementFile is not None:
+                self.__writeElements(elementFile, rows)
+                elementFile.flush()
+                state['element_offset'] = elementFile.tell()
+            else:
+                finished += rows
+            state['elements'] += len(rows)
+            state['pending'] = []
+            state['route'] = [[code, sums.tolist()] for code, sums in routes.items()]
+            state['study'] = study.tolist()
+            state['complete'] = True
+            if self.directory is not None:
+                self.__writeCheckpoint(state)
+        finally:
+            if elementFile is not None:
+                elementFile.close()
+
+        codes = sorted(routes, key=lambda code: (code is None, code))
+        result = {'route': ({'route_code': codes}, roundDecimal(np.array([routes[c] for c in codes]).reshape(len(codes), nColumns)))
+                  , 'study': ({}, roundDecimal(study.reshape(1, nColumns)) if state['rows'] else np.zeros((0, nColumns)))
+                  , 'elements': state['elements']}
+        if self.directory is None:
+            finished.sort()
+            result['element'] = ({'element_id': np.array([r[0] for r in finished], dtype=np.int64)
+                                  , 'element_feature_id': np.array([r[1] for r in finished], dtype=np.int64)}
+                                 , roundDecimal(np.array([r[2] for r in finished]).reshape(len(finished), nColumns)))
+        self.__showMsg("Streamed {0} rows in {1} chunks, {2} elements".format(state['rows'], state['chunks'], state['elements']))
+        return result
+
+
+def readElements(directory):
+    """The element summaries written by cmrstream as (keys, values)"""
+    data = np.loadtxt(os.path.join(directory, cmrstream.elementName), delimiter=',', skiprows=1, ndmin=2)
+    return {'element_id': data[:, 1].astype(np.int64), 'element_feature_id': data[:, 2].astype(np.int64)}, data[:, 3:]
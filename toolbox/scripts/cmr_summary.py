@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import itertools
+from collections import OrderedDict
+import numpy as np
+from cmr_engine import groupIndex
+
+#Grouping flags of cmrSP_resultSummary
+summaryFlags = ['route', 'elementtype', 'valuetype', 'hazardzone', 'processtype']
+#Columns of the result summary, as returned by cmrSP_resultSummary
+summaryColumns = ['study_id', 'timeframe', 'hazardzone_feature_id', 'valuetype_category_id', 'valuetype_category_name'
+                  , 'elementtype_code', 'route_code', 'processtype_name', 'valuetype_name', 'n', 'annual_frequency'
+                  , 'timeframe_frequency', 'risk', 'E_PosErr', 'E_NegErr', 'V_PosErr', 'V_NegErr']
+#Sums of the finest cells, all other groupings are sums of these
+cellSums = ['n', 'H', 'risk', 'E_PosErr2', 'E_NegErr2', 'HEV_PosErr', 'HEV_NegErr']
+
+def _sortKey(value):
+    """Sort NULL first, as sql server does"""
+    return (value is not None, value)
+
+
+class cmrsummarycube:
+    """All groupings of cmrSP_resultSummary for one study and timeframe, computed in one pass
+The element value damage rows of an engine are reduced once to cells by (hazardzone, elementtype, route, processtype,
+valuetype). The error terms of cmrSP_resultSummary only need sums within a group (sums of squares for E errors,
+sums of H and H*E*V_PosErr/V_NegErr for V errors), so every combination of the five grouping flags is a rollup
+of the cells instead of a new pass over the rows.
+Methods:
+rows(route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False)
+Returns the rows of cmrSP_resultSummary with the given flags (columns as in summaryColumns)
+    """
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, engine, timeframe=1):
+        self.studyId = engine.studyId
+        self.timeframe = timeframe
+        self.__engine = engine
+        self.__cells = self.__reduceCells()
+        self.__groupings = {}
+        for flags in itertools.product([False, True], repeat=len(summaryFlags)):
+            self.__groupings[flags] = self.__rollup(dict(zip(summaryFlags, flags)))
+
+    def __reduceCells(self):
+        """Sums per (hazardzone, elementtype, route, processtype, valuetype) cell of the element value damage rows"""
+        e = self.__engine
+        rows = e.elementValueDamages()
+        pair = rows['pair']
+        keys = {'hazardzone': e.pairZone[pair]
+                , 'elementtype': e.elementElementtype[e.pairElement[pair]]
+                , 'route': e.elementRoute[e.pairElement[pair]]
+                , 'processtype': e.hazardzoneProcesstype[e.pairZone[pair]]
+                , 'valuetype': rows['valuetype']}
+        #NULL terms are ignored by SUM in sql server
+        H = np.where(np.isnan(rows['H']), 0.0, rows['H'])
+        risk = H*rows['E']*rows['V']
+        terms = {'n': np.ones(len(pair))
+                 , 'H': H
+                 , 'risk': risk
+                 , 'E_PosErr2': (H*rows['E_PosErr']*rows['V'])**2
+                 , 'E_NegErr2': (H*rows['E_NegErr']*rows['V'])**2
+                 , 'HEV_PosErr': H*rows['E']*rows['V_PosErr']
+                 , 'HEV_NegErr': H*rows['E']*rows['V_NegErr']}
+        order = ['hazardzone', 'elementtype', 'route', 'processtype', 'valuetype']
+        cells = {}
+        if len(pair) == 0:
+            for name in order:
+                cells[name] = np.zeros(0, dtype=np.int64)
+            for name in cellSums:
+                cells[name] = np.zeros(0)
+            return cells
+        group, first = groupIndex(*[keys[name] for name in order])
+        for name in order:
+            cells[name] = np.asarray(keys[name])[first]
+        for name in cellSums:
+            cells[name] = np.bincount(group, weights=np.where(np.isnan(terms[name]), 0.0, terms[name]), minlength=len(first))
+        return cells
+
+    def __rollup(self, flags):
+        """Arrays of the summary for one combination of flags"""
+        cells = self.__cells
+        nCells = len(cells['valuetype'])
+        zero = np.zeros(nCells, dtype=np.int64)
+        #The inner grouping (errorCTE) keeps processtype and valuetype, hazardzone, elementtype and route are optional
+        outer = [cells[name] if flags[name] else zero for name in ['hazardzone', 'elementtype', 'route']]
+        inner = outer + [cells['processtype'], cells['valuetype']]
+        if nCells == 0:
+            return {'first': zero, 'cells': cells, 'sums': dict((name, np.zeros(0)) for name in ['n', 'H', 'risk', 'E_PosErr', 'E_NegErr', 'V_PosErr', 'V_NegErr'])}
+        group, first = groupIndex(*inner)
+        sums = dict((name, np.bincount(group, weights=cells[name], minlength=len(first))) for name in cellSums)
+        hasRisk = sums['risk'] != 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errors = {'E_PosErr': np.sqrt(sums['E_PosErr2'])
+                      , 'E_NegErr': np.sqrt(sums['E_NegErr2'])
+                      , 'V_PosErr': np.sqrt(sums['H']*self.timeframe*sums['HEV_PosErr']**2)/(100*sums['H'])
+                      , 'V_NegErr': np.sqrt(sums['H']*self.timeframe*sums['HEV_NegErr']**2)/(100*sums['H'])}
+        for name in errors:
+            errors[name] = np.where(hasRisk, errors[name], 0.0)
+
+        #The outer grouping adds the errors of the inner groups in quadrature
+        vt = cells['valuetype'][first]
+        category = self.__engine.valuetypeCategoryIds[vt]
+        keys = [k[first] for k in outer] + [category]
+        keys.append(cells['processtype'][first] if flags['processtype'] else zero[first])
+        keys.append(vt if flags['valuetype'] else zero[first])
+        outerGroup, outerFirst = groupIndex(*keys)
+        result = {}
+        for name in ['n', 'H', 'risk']:
+            result[name] = np.bincount(outerGroup, weights=sums[name], minlength=len(outerFirst))
+        for name in errors:
+            result[name] = np.sqrt(np.bincount(outerGroup, weights=errors[name]**2, minlength=len(outerFirst)))
+        return {'first': first[outerFirst], 'cells': cells, 'sums': result}
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def rows(self, route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False):
+        """Rows of cmrSP_resultSummary for the flags, ordered as by the procedure"""
+        flags = (bool(route), bool(elementtype), bool(valuetype), bool(hazardzone), bool(processtype))
+        grouping = self.__groupings[flags]
+        e = self.__engine
+        cells = grouping['cells']
+        first = grouping['first']
+        sums = grouping['sums']
+        rows = []
+        for n, cell in enumerate(first):
+            vt = cells['valuetype'][cell]
+            rows.append([self.studyId
+                         , self.timeframe
+                         , int(e.hazardzoneFeatureIds[cells['hazardzone'][cell]]) if hazardzone else None
+                         , int(e.valuetypeCategoryIds[vt])
+                         , e.valuetypeCategoryNames[vt]
+                         , e.elementtypeCodes[cells['elementtype'][cell]] if elementtype else None
+                         , e.routeCodes[cells['route'][cell]] if route else None
+                         , e.processtypeNames[cells['processtype'][cell]] if processtype else None
+                         , e.valuetypeNames[vt] if valuetype else None
+                         , int(sums['n'][n])
+                         , float(sums['H'][n])
+                         , float(sums['H'][n]*self.timeframe)
+                         , float(sums['risk'][n])
+                         , float(sums['E_PosErr'][n])
+                         , float(sums['E_NegErr'][n])
+                         , float(sums['V_PosErr'][n])
+                         , float(sums['V_NegErr'][n])])
+        rows.sort(key=lambda r: [_sortKey(r[i]) for i in [2, 3, 5, 6, 7]])
+        return rows
+
+
+class cmrsummarycache:
+    """Least recently used cache of summary cubes keyed by study, timeframe, parameter pack hash and study data hash,
+so changing the flags is a lookup and a parameter edit gives a new key
+Methods:
+cube(engine, timeframe=1)
+Returns the cube for the engine and timeframe, computed if it is not cached
+
+resultSummary(engine, timeframe=1, **flags)
+Returns the rows of cmrSP_resultSummary from the cached cube
+    """
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__cubes = OrderedDict()
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def cube(self, engine, timeframe=1):
+        key = (engine.studyId, timeframe, engine.parameterHash, engine.dataHash())
+        cube = self.__cubes.pop(key, None)
+        if cube is None:
+            self.misses += 1
+            cube = cmrsummarycube(engine, timeframe)
+        else:
+            self.hits += 1
+        self.__cubes[key] = cube
+        while len(self.__cubes) > self.capacity:
+            self.__cubes.popitem(last=False)
+        return cube
+
+    def resultSummary(self, engine, timeframe=1, route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False):
+        return self.cube(engine, timeframe).rows(route, elementtype, valuetype, hazardzone, processtype)
+
+    def clear(self):
+        self.__cubes.clear()
+
+
+#Cache shared by all studies in the process
+defaultCache = cmrsummarycache()
+
+def resultSummary(engine, timeframe=1, route=False, elementtype=False, valuetype=False, hazardzone=False, processtype=False):
+    """Rows of cmrSP_resultSummary for a cmrengine, from the shared cache"""
+    return defaultCache.resultSummary(engine, timeframe, route, elementtype, valuetype, hazardzone, processtype)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+class cmrsweep:
+    """Evaluates route and study risk for many sets of damage function and element value parameters at once
+Risk is linear in value_mean and in damage_avg = damage_prob*damage_max/(damage_exponent+1), so the element hazard zone
+rows of the study are reduced once to a weight per (route, elementtype, processtype, valuetype) combination.
+A parameter set then only needs the products value_mean*damage_avg per combination, and all sets are evaluated
+with one matrix product per summary column. Rows are not rounded to 4 decimals as in cmrV_ElementValueDamagesPivot,
+so results for the base parameters equal the summary views within rounding.
+Methods:
+baseValues()
+Returns the current parameter values (one per item in parameterNames)
+
+sample(nSets, spread=0.25, seed=None)
+Returns a latin hypercube sample of parameter sets within +/- spread (relative) of the base values
+
+evaluate(parameterSets)
+Returns a dict with 'study' (nSets x nColumns) and 'route' (nSets x nRoutes x nColumns) risk arrays
+
+sensitivity(parameterSets, results)
+Returns standardized regression coefficients of each parameter for each result column
+
+elasticities(level='study')
+Returns the local relative sensitivity (d log risk / d log parameter) at the base values
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Number of parameter sets evaluated per matrix product (limits memory use)
+    chunkSize = 2000
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, engine):
+        """engine is a cmrengine with the study loaded"""
+        self.engine = engine
+        self.columns = [name for categoryId, name in engine.summaryColumns]
+        self.routeCodes = list(engine.routeCodes)
+        self.__compileParameters()
+        self.__compileWeights()
+
+    def __compileParameters(self):
+        """The free parameters: value_mean per (elementtype, valuetype) and damage function parameters per (processtype, valuetype)"""
+        e = self.engine
+        c = e.parameterCombos()
+        free = ~c['fixed']
+        evKeys, evIndex = np.unique(c['elementtype'][free]*len(e.valuetypeIds)+c['valuetype'][free], return_index=True)
+        dfKeys, dfIndex = np.unique(c['processtype'][free]*len(e.valuetypeIds)+c['valuetype'][free], return_index=True)
+        freeCombos = np.nonzero(free)[0]
+        evCombos = freeCombos[evIndex]
+        dfCombos = freeCombos[dfIndex]
+        names = []
+        base = []
+        for k in evCombos:
+            names.append(('value_mean', int(e.elementtypeIds[c['elementtype'][k]]), int(e.valuetypeIds[c['valuetype'][k]])))
+            base.append(c['value_mean'][k])
+        for pam in ['damage_prob', 'damage_max', 'damage_exponent']:
+            for k in dfCombos:
+                names.append((pam, int(e.processtypeIds[c['processtype'][k]]), int(e.valuetypeIds[c['valuetype'][k]])))
+                base.append(c[pam][k])
+        self.parameterNames = names
+        self.__base = np.array(base, dtype=np.float64)
+        self.__nEv = len(evCombos)
+        self.__nDf = len(dfCombos)
+        #Column of each combination in the parameter vector, -1 for the fixed value types
+        self.__comboEv = -np.ones(len(c['fixed']), dtype=np.int64)
+        self.__comboDf = -np.ones(len(c['fixed']), dtype=np.int64)
+        self.__comboEv[freeCombos] = np.searchsorted(evKeys, c['elementtype'][free]*len(e.valuetypeIds)+c['valuetype'][free])
+        self.__comboDf[freeCombos] = np.searchsorted(dfKeys, c['processtype'][free]*len(e.valuetypeIds)+c['valuetype'][free])
+
+    def __compileWeights(self):
+        """Reduce the rows of the study to weights per (route, combination) for every summary column"""
+        e = self.engine
+        rows = e.elementValueDamages()
+        weight = rows['H']*rows['E_scaling']
+        weight = np.where(np.isnan(weight), 0.0, weight)
+        route = e.elementRoute[e.pairElement[rows['pair']]]
+        nRoutes = len(self.routeCodes)
+        self.__weights = []
+        for categoryId, name in e.summaryColumns:
+            mask = rows['valuetype_category_id'] == categoryId
+            #The combinations used in this column and their weight per route
+            combos, comboIndex = np.unique(rows['combo'][mask], return_inverse=True)
+            comboIndex = comboIndex.ravel()
+            nCombos = len(combos)
+            flat = np.bincount(route[mask]*nCombos+comboIndex, weights=weight[mask], minlength=nRoutes*nCombos)
+            self.__weights.append((combos, flat.reshape(nRoutes, nCombos)))
+
+    def __toMatrix(self, parameterSets):
+        """Parameter sets as an (nSets x nParameters) array, a dict {parameterName: values} is completed with the base values"""
+        if isinstance(parameterSets, dict):
+            nSets = max([len(np.atleast_1d(v)) for v in parameterSets.values()] + [1])
+            sets = np.tile(self.__base, (nSets, 1))
+            position = dict((name, n) for n, name in enumerate(self.parameterNames))
+            for name, values in parameterSets.items():
+                if name not in position:
+                    raise Exception("Unknown parameter {0}".format(name))
+                sets[:, position[name]] = values
+            return sets
+        sets = np.atleast_2d(np.asarray(parameterSets, dtype=np.float64))
+        if sets.shape[1] != len(self.parameterNames):
+            raise Exception("Parameter sets must have {0} columns".format(len(self.parameterNames)))
+        return sets
+
+    def __comboFactors(self, sets):
+        """value_mean*damage_avg for every combination (columns) and parameter set (rows)"""
+        nEv, nDf = self.__nEv, self.__nDf
+        valueMean = sets[:, :nEv]
+        prob = sets[:, nEv:nEv+nDf]
+        dmax = sets[:, nEv+nDf:nEv+2*nDf]
+        exponent = sets[:, nEv+2*nDf:]
+        damageAvg = prob*dmax/(exponent+1.0)
+        #Append a column of ones used by the fixed value types (index -1)
+        ones = np.ones((sets.shape[0], 1))
+        valueMean = np.hstack((valueMean, ones))
+        damageAvg = np.hstack((damageAvg, ones))
+        return valueMean[:, self.__comboEv]*damageAvg[:, self.__comboDf]
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def baseValues(self):
+        return self.__base.copy()
+
+    def sample(self, nSets, spread=0.25, seed=None):
+        """Latin hypercube sample of nSets parameter sets, each parameter within base*(1-spread) and base*(1+spread).
+damage_prob is kept within [0, 1]"""
+        rs = np.random.RandomState(seed)
+        nPams = len(self.parameterNames)
+        strata = np.argsort(rs.random_sample((nSets, nPams)), axis=0)
+        u = (strata+rs.random_sample((nSets, nPams)))/float(nSets)
+        sets = self.__base*(1.0-spread+2.0*spread*u)
+        isProb = np.array([name[0] == 'damage_prob' for name in self.parameterNames], dtype=bool)
+        sets[:, isProb] = np.clip(sets[:, isProb], 0.0, 1.0)
+        return sets
+
+    def evaluate(self, parameterSets):
+        """Risk for each parameter set, returns {'study': (nSets x nColumns), 'route': (nSets x nRoutes x nColumns)}"""
+        sets = self.__toMatrix(parameterSets)
+        nSets = sets.shape[0]
+        route = np.zeros((nSets, len(self.routeCodes), len(self.columns)))
+        for start in range(0, nSets, self.chunkSize):
+            factors = self.__comboFactors(sets[start:start+self.chunkSize])
+            for n, (combos, weights) in enumerate(self.__weights):
+                route[start:start+self.chunkSize, :, n] = np.dot(factors[:, combos], weights.T)
+        return {'study': route.sum(axis=1), 'route': route}
+
+    def sensitivity(self, parameterSets, results):
+        """Standardized regression coefficients (nParameters x nOutputs) of a linear fit of results (nSets or nSets x nOutputs)
+on the parameter sets, and the coefficient of determination of the fit for each output.
+Parameters that do not vary in the sets get a coefficient of 0, outputs that do not vary (within float precision,
+e.g. the event frequencies that do not depend on any parameter) get coefficients and a coefficient of determination of 0"""
+        sets = self.__toMatrix(parameterSets)
+        y = np.asarray(results, dtype=np.float64)
+        y = y.reshape(y.shape[0], -1)
+        xStd = sets.std(axis=0)
+        yStd = y.std(axis=0)
+        #Sums of the same values in a different order differ in the last digits, so the spread of a constant output is not exactly 0
+        yStd = np.where(yStd > 1e-9*np.abs(y).max(axis=0), yStd, 0.0)
+        varying = xStd > 0
+        X = (sets[:, varying]-sets[:, varying].mean(axis=0))/xStd[varying]
+        Y = (y-y.mean(axis=0))/np.where(yStd > 0, yStd, 1.0)
+        beta = np.linalg.lstsq(X, Y, rcond=-1)[0] if X.shape[1] else np.zeros((0, Y.shape[1]))
+        src = np.zeros((len(self.parameterNames), Y.shape[1]))
+        src[varying] = beta
+        src[:, yStd == 0] = 0.0
+        residual = Y-np.dot(X, beta) if X.shape[1] else Y
+        r2 = np.where(yStd > 0, 1.0-(residual**2).mean(axis=0), 0.0)
+        return src, r2
+
+    def elasticities(self, level='study'):
+        """d log(risk) / d log(parameter) at the base values, (nParameters x nColumns) for 'study' or (nParameters x nRoutes x nColumns) for 'route'.
+Risk is proportional to value_mean, damage_prob and damage_max, so their elasticity is the share of the risk that depends on them"""
+        base = self.__base[np.newaxis, :]
+        factors = self.__comboFactors(base)[0]
+        nEv, nDf = self.__nEv, self.__nDf
+        nRoutes = len(self.routeCodes)
+        shares = np.zeros((len(self.parameterNames), nRoutes, len(self.columns)))
+        exponent = self.__base[nEv+2*nDf:]
+        for n, (combos, weights) in enumerate(self.__weights):
+            risk = weights*factors[combos]
+            total = risk.sum(axis=1) if level == 'route' else np.repeat(risk.sum(), nRoutes)
+            ev = self.__comboEv[combos]
+            df = self.__comboDf[combos]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for k in range(len(combos)):
+                    share = np.where(total > 0, risk[:, k]/total, 0.0)
+                    if ev[k] >= 0:
+                        shares[ev[k], :, n] += share
+                    if df[k] >= 0:
+                        shares[nEv+df[k], :, n] += share
+                        shares[nEv+nDf+df[k], :, n] += share
+                        shares[nEv+2*nDf+df[k], :, n] -= share*exponent[df[k]]/(exponent[df[k]]+1.0)
+        if level == 'route':
+            return shares
+        return shares.sum(axis=1)
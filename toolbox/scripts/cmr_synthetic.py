@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import io
+import math
+import os
+import re
+import numpy as np
+from cmr_engine import cmrengine
+
+#The build script with the default parameter values (POPULATE BASE TABLES)
+defaultScript = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, os.path.pardir
+                                             , 'tsql', 'cmr_build_application.sql'))
+
+def _sqlValue(token):
+    """Convert a literal from a VALUES clause"""
+    token = token.strip()
+    if token.upper() == 'NULL':
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+def sqlValues(text):
+    """Parse the tuples of a VALUES clause into lists of python values (numbers, strings and NULL)"""
+    rows = []
+    row = None
+    token = ''
+    quoted = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quoted is not None:
+            if ch == "'":
+                if text[i+1:i+2] == "'":
+                    quoted += "'"
+                    i += 1
+                else:
+                    row.append(quoted)
+                    quoted = None
+                    token = None
+            else:
+                quoted += ch
+        elif ch == "'":
+            quoted = ''
+        elif ch == '(':
+            row = []
+            token = ''
+        elif ch == ',' and row is not None:
+            if token is not None:
+                row.append(_sqlValue(token))
+            token = ''
+        elif ch == ')' and row is not None:
+            if token is not None:
+                row.append(_sqlValue(token))
+            rows.append(row)
+            row = None
+        elif row is not None and token is not None:
+            token += ch
+        i += 1
+    return rows
+
+def scriptInserts(sqlFile=None):
+    """Rows inserted into each table by the build script, as {table name: [dict(column=value)]}"""
+    with io.open(sqlFile or defaultScript, encoding='latin-1') as f:
+        script = f.read()
+    tables = {}
+    pattern = re.compile(r"INSERT INTO (?:\[dbo\]\.)?\[(\w+)\]\s*\(([^)]*)\)\s*VALUES(.*?)(?=\n\s*(?:--|SET |INSERT |GO\b)|\Z)", re.S)
+    for match in pattern.finditer(script):
+        columns = [c.strip().strip('[]') for c in match.group(2).split(',')]
+        rows = tables.setdefault(match.group(1), [])
+        for values in sqlValues(match.group(3)):
+            rows.append(dict(zip(columns, values)))
+    return tables
+
+def defaultParameterTables(sqlFile=None):
+    """The default parameter tables of the build script in the layout of cmrengine.tableColumns
+(joined the same way as the queries in cmrengine.fromSde)"""
+    t = scriptInserts(sqlFile)
+    categories = dict((r['elementcategory_id'], r['elementcategory_name']) for r in t['cmrT_ElementCategory'])
+    calculations = dict((r['valuetype_calculation_id'], r) for r in t['cmrT_ValueTypeCalculation'])
+    valueCategories = dict((r['valuetype_category_id'], r['valuetype_category_name']) for r in t['cmrT_ValueTypeCategory'])
+    tables = {}
+    tables['processtype'] = [[r[c] for c in cmrengine.tableColumns['processtype']] for r in t['cmrT_ProcessType']]
+    tables['elementtype'] = [[r['elementtype_id'], r['elementtype_code'], r['elementcategory_id'], categories[r['elementcategory_id']]]
+                             for r in t['cmrT_ElementType'] if r['elementcategory_id'] in categories]
+    tables['valuetype'] = []
+    for r in t['cmrT_ValueType']:
+        if r['valuetype_calculation_id'] in calculations and r['valuetype_category_id'] in valueCategories:
+            row = dict(r)
+            row.update(calculations[r['valuetype_calculation_id']])
+            row['valuetype_category_name'] = valueCategories[r['valuetype_category_id']]
+            tables['valuetype'].append([row[c] for c in cmrengine.tableColumns['valuetype']])
+    tables['elementvalue'] = [[r[c] for c in cmrengine.tableColumns['elementvalue']] for r in t['cmrT_ElementValue']]
+    tables['damagefunction'] = [[r[c] for c in cmrengine.tableColumns['damagefunction']] for r in t['cmrT_DamageFunction']]
+    return tables
+
+
+class cmrsynthetic:
+    """Generator of synthetic element networks and overlapping hazard zones for tests and benchmarks
+The network is laid out in square blocks, each with linesPerBlock horizontal and linesPerBlock vertical routes
+that cross each other. Routes are wiggling polylines cut into elements of verticesPerElement vertices,
+and hazard zones are irregular polygons placed near the elements of their block (zones overlap each other).
+Features are generated per block from the seed, so any block can be generated (or regenerated) independently.
+Elements and zones are (oid, parts, attributes) as read for the geometry backend, attributes are keyed by
+the cmrImportFieldMapping keys (elementtype_code, route_code, aadt_passenger, aadt_goods, diversion_time
+and processtype_id, event_frequency, freq_interval_plus, freq_interval_minus).
+Methods:
+elements(blocks=None) and zones(blocks=None)
+Returns the features of all (or the given) blocks
+
+iterBlocks(blocksPerChunk=1)
+Generator of (elements, zones) for consecutive chunks of blocks, for sizes that do not fit in memory
+
+blockExtent(block) and extent()
+Returns the bounding box (xmin, ymin, xmax, ymax) of a block or the whole network
+
+writeFeatureClasses(outputGDB, elementName, zoneName, spatialReference=None)
+Writes the network and the zones to two feature classes (requires arcpy)
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Layout of the network
+    linesPerBlock = 5
+    elementsPerRoute = 40
+    verticesPerElement = 4
+    elementLength = 150.0
+    #Amplitude of the sideways wiggle of the routes (relative to the distance between routes)
+    wiggle = 0.15
+    #Number of hazard zones per element and the range of zone radii
+    zonesPerElement = 0.25
+    zoneRadius = (30.0, 400.0)
+    zoneVertices = (8, 24)
+    #Element types with their share of the routes and the ranges of aadt_passenger and aadt_goods
+    elementTypes = [('EV', 0.10, (8000, 20000), (800, 3000))
+                    , ('RV', 0.15, (3000, 10000), (300, 1500))
+                    , ('FV', 0.35, (500, 4000), (50, 500))
+                    , ('KV', 0.30, (100, 1500), (10, 150))
+                    , ('BANE', 0.10, (2000, 8000), (500, 2000))]
+    #Range of diversion_time per route (hours)
+    diversionTime = (0.1, 3.0)
+    #Process types with their share of the zones, and the event frequencies (return periods) of the zones
+    processTypes = [(3, 0.35), (10, 0.20), (13, 0.15), (20, 0.25), (100, 0.05)]
+    eventFrequencies = [10, 50, 100, 300, 1000, 5000]
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, nElements, seed=0):
+        self.nElements = int(nElements)
+        self.seed = int(seed)
+        self.routeLength = self.elementsPerRoute*self.elementLength
+        self.elementsPerBlock = 2*self.linesPerBlock*self.elementsPerRoute
+        self.zonesPerBlock = int(round(self.elementsPerBlock*self.zonesPerElement))
+        self.nBlocks = int(math.ceil(self.nElements/float(self.elementsPerBlock)))
+        self.nColumns = max(int(math.ceil(math.sqrt(self.nBlocks))), 1)
+
+    def __random(self, block, stream):
+        """Separate random streams per block for elements and zones"""
+        return np.random.RandomState([self.seed, block, stream])
+
+    def __routeLines(self, block, rs):
+        """Vertex coordinates (nRoutes x nVertices x 2) of the routes of a block"""
+        xmin, ymin, xmax, ymax = self.blockExtent(block)
+        k = self.linesPerBlock
+        nVertices = self.elementsPerRoute*(self.verticesPerElement-1)+1
+        spacing = self.routeLength/k
+        along = np.linspace(0.0, self.routeLength, nVertices)
+        #Small jitter along the route, but the ends stay on the block boundary
+        step = self.routeLength/(nVertices-1)
+        jitter = rs.uniform(-0.25, 0.25, (2*k, nVertices))*step
+        jitter[:, 0] = jitter[:, -1] = 0.0
+        along = along+jitter
+        #A smooth sideways wiggle (a detrended random walk)
+        walk = np.cumsum(rs.normal(0.0, 1.0, (2*k, nVertices)), axis=1)
+        walk -= np.linspace(0.0, 1.0, nVertices)*walk[:, -1:]
+        scale = np.abs(walk).max(axis=1)[:, np.newaxis]
+        side = self.wiggle*spacing*walk/np.where(scale > 0, scale, 1.0)
+        offset = (np.arange(k)+0.5)*spacing
+        lines = np.zeros((2*k, nVertices, 2))
+        #Horizontal routes
+        lines[:k, :, 0] = xmin+along[:k]
+        lines[:k, :, 1] = ymin+offset[:, np.newaxis]+side[:k]
+        #Vertical routes
+        lines[k:, :, 0] = xmin+offset[:, np.newaxis]+side[k:]
+        lines[k:, :, 1] = ymin+along[k:]
+        return lines
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def blockExtent(self, block):
+        col, row = block % self.nColumns, block // self.nColumns
+        xmin, ymin = col*self.routeLength, row*self.routeLength
+        return (xmin, ymin, xmin+self.routeLength, ymin+self.routeLength)
+
+    def extent(self):
+        nRows = int(math.ceil(self.nBlocks/float(self.nColumns)))
+        return (0.0, 0.0, min(self.nBlocks, self.nColumns)*self.routeLength, nRows*self.routeLength)
+
+    def blockElements(self, block):
+        """The elements of a block, element oids are numbered consecutively over the blocks starting at 1"""
+        rs = self.__random(block, 0)
+        lines = self.__routeLines(block, rs)
+        nRoutes = lines.shape[0]
+        shares = np.array([t[1] for t in self.elementTypes])
+        types = rs.choice(len(self.elementTypes), nRoutes, p=shares/shares.sum())
+        u = rs.random_sample((nRoutes, 3))
+        n = self.verticesPerElement-1
+        elements = []
+        for r in range(nRoutes):
+            code, share, aadtPassenger, aadtGoods = self.elementTypes[types[r]]
+            attrs = {'elementtype_code': code
+                     , 'route_code': "{0}{1}".format(code, block*nRoutes+r+1)
+                     , 'aadt_passenger': int(aadtPassenger[0]+u[r, 0]*(aadtPassenger[1]-aadtPassenger[0]))
+                     , 'aadt_goods': int(aadtGoods[0]+u[r, 1]*(aadtGoods[1]-aadtGoods[0]))
+                     , 'diversion_time': round(float(self.diversionTime[0]+u[r, 2]*(self.diversionTime[1]-self.diversionTime[0])), 2)}
+            coords = lines[r].tolist()
+            for e in range(self.elementsPerRoute):
+                oid = block*self.elementsPerBlock+r*self.elementsPerRoute+e+1
+                if oid > self.nElements:
+                    return elements
+                elements.append((oid, [[tuple(p) for p in coords[e*n:e*n+n+1]]], dict(attrs)))
+        return elements
+
+    def blockZones(self, block):
+        """The hazard zones of a block (placed near the vertices of its elements), zone oids are numbered consecutively over the blocks.
+The last block may be partly empty, it gets zones in proportion to its elements"""
+        rs = self.__random(block, 1)
+        lines = self.__routeLines(block, self.__random(block, 0))
+        nBlockElements = max(0, min(self.elementsPerBlock, self.nElements-block*self.elementsPerBlock))
+        nZones = self.zonesPerBlock if nBlockElements == self.elementsPerBlock else int(round(nBlockElements*self.zonesPerElement))
+        #Vertices of the elements that exist (elements are generated route by route)
+        n = self.verticesPerElement-1
+        routeVertices = np.clip(nBlockElements-np.arange(lines.shape[0])*self.elementsPerRoute, 0, self.elementsPerRoute)*n
+        routeVertices = np.where(routeVertices > 0, routeVertices+1, 0)
+        vertices = lines[np.arange(lines.shape[1])[np.newaxis, :] < routeVertices[:, np.newaxis]]
+        if nZones == 0 or len(vertices) == 0:
+            return []
+        centers = vertices[rs.randint(0, len(vertices), nZones)]
+        radius = rs.uniform(self.zoneRadius[0], self.zoneRadius[1], nZones)
+        centers = centers+rs.normal(0.0, 1.0, (nZones, 2))*radius[:, np.newaxis]*0.5
+        shares = np.array([t[1] for t in self.processTypes])
+        types = rs.choice(len(self.processTypes), nZones, p=shares/shares.sum())
+        frequencies = rs.choice(self.eventFrequencies, nZones)
+        zones = []
+        for z in range(nZones):
+            m = rs.randint(self.zoneVertices[0], self.zoneVertices[1]+1)
+            angles = np.sort(rs.uniform(0.0, 2*math.pi, m))
+            r = radius[z]*(0.7+0.3*rs.random_sample(m))
+            ring = [(float(centers[z, 0]+a*math.cos(t)), float(centers[z, 1]+a*math.sin(t))) for t, a in zip(angles, r)]
+            ring.append(ring[0])
+            frequency = int(frequencies[z])
+            attrs = {'processtype_id': self.processTypes[types[z]][0]
+                     , 'event_frequency': frequency
+                     , 'freq_interval_plus': frequency
+                     , 'freq_interval_minus': frequency//2}
+            zones.append((block*self.zonesPerBlock+z+1, [ring], attrs))
+        return zones
+
+    def elements(self, blocks=None):
+        features = []
+        for block in (range(self.nBlocks) if blocks is None else blocks):
+            features.extend(self.blockElements(block))
+        return features
+
+    def zones(self, blocks=None):
+        features = []
+        for block in (range(self.nBlocks) if blocks is None else blocks):
+            features.extend(self.blockZones(block))
+        return features
+
+    def iterBlocks(self, blocksPerChunk=1):
+        for start in range(0, self.nBlocks, blocksPerChunk):
+            blocks = range(start, min(start+blocksPerChunk, self.nBlocks))
+            yield self.elements(blocks), self.zones(blocks)
+
+    def writeFeatureClasses(self, outputGDB, elementName='synthetic_elements', zoneName='synthetic_zones', spatialReference=None):
+        """Write the elements (polylines) and zones (polygons) to feature classes with fields named as the
+default cmrImportFieldMapping, returns the paths of the two feature classes"""
+        import arcpy
+        elementFields = [('elementtype_code', 'TEXT', 10), ('route_code', 'TEXT', 10), ('aadt_passenger', 'LONG', None)
+                         , ('aadt_goods', 'LONG', None), ('diversion_time', 'DOUBLE', None)]
+        zoneFields = [('processtype_id', 'LONG', None), ('event_frequency', 'LONG', None)
+                      , ('freq_interval_plus', 'LONG', None), ('freq_interval_minus', 'LONG', None)]
+        paths = []
+        for name, geometryType, fields in [(elementName, "POLYLINE", elementFields), (zoneName, "POLYGON", zoneFields)]:
+            arcpy.CreateFeatureclass_management(outputGDB, name, geometryType, "#", "DISABLED", "DISABLED", spatialReference)
+            path = os.path.join(outputGDB, name)
+            for fldName, fldType, fldLength in fields:
+                arcpy.AddField_management(path, fldName, fldType, "#", "#", fldLength if fldLength else "#")
+            paths.append(path)
+        elementNames = [f[0] for f in elementFields]
+        zoneNames = [f[0] for f in zoneFields]
+        with arcpy.da.InsertCursor(paths[0], ["SHAPE@"] + elementNames) as elementCursor:
+            with arcpy.da.InsertCursor(paths[1], ["SHAPE@"] + zoneNames) as zoneCursor:
+                for elements, zones in self.iterBlocks():
+                    for oid, parts, attrs in elements:
+                        shape = arcpy.Polyline(arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in part]) for part in parts]), spatialReference)
+                        elementCursor.insertRow([shape] + [attrs[k] for k in elementNames])
+                    for oid, rings, attrs in zones:
+                        shape = arcpy.Polygon(arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in ring]) for ring in rings]), spatialReference)
+                        zoneCursor.insertRow([shape] + [attrs[k] for k in zoneNames])
+        return paths[0], paths[1]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import math
+import multiprocessing
+import os
+import sys
+from cmr_geometry import cmrrtree
+from cmr_incremental import featureBox
+
+def _tileTask(task):
+    """Split and intersect the elements owned by one tile (executed in a worker process)"""
+    tileIndex, backendClass, settings, elements, zones, ownedIds = task
+    backend = backendClass()
+    for key, value in settings.items():
+        setattr(backend, key, value)
+    segments = backend.splitElements(elements, zones, ownedIds)
+    rows = backend.intersectElements(segments, zones)
+    return tileIndex, segments, rows
+
+
+class cmrtiler:
+    """Splits elements at zone boundaries and intersects them with hazard zones tile by tile in parallel worker processes,
+using a geometry backend (e.g. cmr_geometry.indexedGeometryBackend).
+The extent is partitioned into square tiles and every element is owned by the tile that holds the center of its
+bounding box. A tile is processed with its own elements plus all zones and elements that come near them (the halo),
+so elements are never cut at tile seams and the segments are identical to those of a single pass.
+The segments of all tiles are merged back in the order of the input elements, so object ids (element_feature_ids)
+are unique and assigned exactly as in a single pass, and element_size totals are exact.
+Methods:
+tiles(elements, zones)
+Returns a list of (tileIndex, elements, zones, ownedIds) with the features each tile needs
+
+run(elements, zones)
+Returns (segments, intersections) as splitElements and intersectElements of the backend would for the whole extent.
+Intersections are (segment_index, zone_oid, length) sorted by segment and zone
+    """
+    #######################################
+    ###        PUBLIC PROPERTIES        ###
+    #######################################
+    #Backend attributes that are passed on to the backends in the workers
+    backendSettings = ['splitAtElementCrossings', 'tolerance', 'edgeChunkSize']
+
+    ########################################
+    ###          PRIVATE METHODS         ###
+    ########################################
+    def __init__(self, backend, tileSize, workers=None):
+        """backend is the geometry backend, tileSize is the side of the tiles in map units.
+workers is the number of worker processes (default the number of cpus, 1 processes the tiles in this process)"""
+        if tileSize is None or tileSize <= 0:
+            raise Exception("The tile size must be a positive number!")
+        self.backend = backend
+        self.tileSize = float(tileSize)
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.nTiles = 0
+
+    def __settings(self):
+        return dict((key, getattr(self.backend, key)) for key in self.backendSettings if hasattr(self.backend, key))
+
+    def __runTasks(self, tasks):
+        """Process the tiles, in a pool of workers if there is more than one worker and tile"""
+        nWorkers = max(1, min(int(self.workers), len(tasks)))
+        #Daemonic processes (e.g. the workers of cmr_batch) cannot start a pool of their own
+        if nWorkers == 1 or multiprocessing.current_process().daemon:
+            return [_tileTask(task) for task in tasks]
+        #When started from within ArcGIS the executable is not python, so workers must be started with python explicitly
+        if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+        pool = multiprocessing.Pool(processes=nWorkers)
+        try:
+            results = list(pool.imap_unordered(_tileTask, tasks))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    ########################################
+    ###          PUBLIC METHODS          ###
+    ########################################
+    def tiles(self, elements, zones):
+        """Partition the elements into tiles, returns (tileIndex, elements, zones, ownedIds) for every tile with elements"""
+        boxes = [featureBox(parts) for oid, parts, attrs in elements]
+        valid = [b for b in boxes if b is not None]
+        if not valid:
+            self.nTiles = 0
+            return []
+        xmin = min(b[0] for b in valid)
+        ymin = min(b[1] for b in valid)
+        nColumns = int(math.floor((max(b[2] for b in valid)-xmin)/self.tileSize))+1
+        #Owner tile of each element, from the center of its bounding box
+        owned = {}
+        for n, b in enumerate(boxes):
+            if b is None:
+                continue
+            col = int(math.floor(((b[0]+b[2])/2.0-xmin)/self.tileSize))
+            row = int(math.floor(((b[1]+b[3])/2.0-ymin)/self.tileSize))
+            owned.setdefault(row*nColumns+col, []).append(n)
+        elementTree = cmrrtree([b + (n,) for n, b in enumerate(boxes) if b is not None])
+        zoneBoxes = [featureBox(rings) for oid, rings, attrs in zones]
+        zoneTree = cmrrtree([b + (n,) for n, b in enumerate(zoneBoxes) if b is not None])
+        tiles = []
+        for tileIndex in sorted(owned):
+            members = owned[tileIndex]
+            #The halo is the extent of the owned elements, everything that may cut or contain them is within it
+            halo = (min(boxes[n][0] for n in members), min(boxes[n][1] for n in members)
+                    , max(boxes[n][2] for n in members), max(boxes[n][3] for n in members))
+            tileElements = [elements[n] for n in sorted(elementTree.query(*halo))]
+            tileZones = [zones[n] for n in sorted(zoneTree.query(*halo))]
+            tiles.append((tileIndex, tileElements, tileZones, set(elements[n][0] for n in members)))
+        self.nTiles = len(tiles)
+        return tiles
+
+    def run(self, elements, zones):
+        """Split and intersect tile by tile, returns (segments, intersections) in single pass order"""
+        settings = self.__settings()
+        tasks = [(tileIndex, self.backend.__class__, settings, tileElements, tileZones, ownedIds)
+                 for tileIndex, tileElements, tileZones, ownedIds in self.tiles(elements, zones)]
+        position = dict((oid, n) for n, (oid, parts, attrs) in enumerate(elements))
+        keyed = []
+        for tileIndex, segments, rows in self.__runTasks(tasks):
+            zonesOf = {}
+            for n, zoneOid, length in rows:
+                zonesOf.setdefault(n, []).append((zoneOid, length))
+            for n, segment in enumerate(segments):
+                #Segments are ordered as in a single pass: by element, part and position along the part
+                keyed.append(((position[segment[0]], segment[1], segment[2]), segment, zonesOf.get(n, [])))
+        keyed.sort(key=lambda k: k[0])
+        segments = []
+        intersections = []
+        for n, (key, segment, segmentZones) in enumerate(keyed):
+            segments.append(segment)
+            for zoneOid, length in sorted(segmentZones):
+                intersections.append((n, zoneOid, length))
+        return segments, intersections
@@ -0,0 +1,176 @@
+/*
+NOTE: Run this script on a test copy of the cmr database (created with cmr_build_application.sql), not in production.
+
+Measures how long it takes to reset (cmrSP_setStudyArea) and import (cmrSP_importResults) one study
+as the number of studies stored in the database grows.
+Synthetic studies named cmr_benchmark_<n> are imported the same way as real studies (import table and cmrSP_importResults),
+then a probe study of the same size is imported and reset @repeats times for every @step stored studies.
+The benchmark studies are deleted at the end unless @cleanup = 0.
+*/
+
+USE cmrGeo --THIS DATABASE MUST EXIST, if not the script will be executed in the database you are currently sitting in...
+GO
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+
+/********************************************************
+--Fill the import table with a synthetic study
+*********************************************************/
+--Every element intersects @zones_per_element of the @zones hazard zones (@zones_per_element must be less than @zones),
+--elements are grouped 40 by 40 into routes. At most 1000000 rows (the square of cmrT_Tally) per study
+CREATE PROCEDURE #cmrSP_benchmarkImportRows
+	@study_id INT
+	, @elements INT
+	, @zones INT
+	, @zones_per_element INT
+AS
+	SET NOCOUNT ON
+	;WITH numbers AS (
+		SELECT TOP (@elements*@zones_per_element) i = ROW_NUMBER() OVER (ORDER BY (SELECT NULL))-1
+		FROM cmrT_Tally a CROSS JOIN cmrT_Tally b
+	), pairs AS (
+		SELECT i
+			, e = i/@zones_per_element+1
+			, z = ((i/@zones_per_element)*7+(i%@zones_per_element)*131)%@zones+1
+		FROM numbers
+	)
+	INSERT cmrT_ImportIntersectionTable (study_id, element_feature_id, elementtype_code, route_code
+			, aadt_passenger, aadt_goods, diversion_time, hazardzone_feature_id, processtype_id
+			, event_frequency, freq_interval_plus, freq_interval_minus, element_size)
+		SELECT @study_id
+			, e
+			, CASE e%4 WHEN 0 THEN 'EV' WHEN 1 THEN 'RV' WHEN 2 THEN 'FV' ELSE 'KV' END
+			, 'R'+CAST(e/40 AS VARCHAR(9))
+			, 1000+e%5000
+			, 100+e%500
+			, 1.0+(e/40)%3
+			, z
+			, CASE z%4 WHEN 0 THEN 3 WHEN 1 THEN 10 WHEN 2 THEN 13 ELSE 20 END
+			, CASE z%3 WHEN 0 THEN 100 WHEN 1 THEN 300 ELSE 1000 END
+			, 0
+			, 0
+			, 10.0+e%90
+		FROM pairs
+RETURN 0
+GO
+
+/********************************************************
+--Run the benchmark
+*********************************************************/
+SET NOCOUNT ON
+DECLARE @max_studies INT = 200          --Number of stored studies at the end
+DECLARE @step INT = 25                  --Measure every @step stored studies
+DECLARE @repeats INT = 3                --Imports and resets of the probe study per measurement
+DECLARE @elements INT = 2000            --Elements per study
+DECLARE @zones INT = 400                --Hazard zones per study
+DECLARE @zones_per_element INT = 3      --Intersections per element
+DECLARE @cleanup BIT = 1                --Delete the benchmark studies at the end
+
+DECLARE @stored INT = 0
+DECLARE @repeat INT
+DECLARE @n INT
+DECLARE @study_id INT
+DECLARE @probe_id INT
+DECLARE @name VARCHAR(50)
+DECLARE @tic DATETIME2
+DECLARE @import_ms INT
+DECLARE @reset_ms INT
+
+--Result sets of the procedures are kept here instead of being returned
+CREATE TABLE #procResults (study_id INT, [message] VARCHAR(255))
+CREATE TABLE #importResults (retcode INT, [message] VARCHAR(255))
+CREATE TABLE #timings (stored_studies INT, stored_intersections BIGINT, [repeat] INT, import_ms INT, reset_ms INT)
+
+INSERT #procResults EXEC cmrSP_setStudyArea @study_id=@probe_id OUTPUT, @study_name='cmr_benchmark_probe'
+	, @hazardzone_dataset_filepath='benchmark', @element_dataset_filepath='benchmark'
+
+WHILE @stored <= @max_studies
+BEGIN
+	--Measure the probe study
+	SET @repeat = 1
+	WHILE @repeat <= @repeats
+	BEGIN
+		EXEC #cmrSP_benchmarkImportRows @study_id=@probe_id, @elements=@elements, @zones=@zones, @zones_per_element=@zones_per_element
+		SET @tic = SYSDATETIME()
+		INSERT #importResults EXEC cmrSP_importResults @study_id=@probe_id
+		SET @import_ms = DATEDIFF(ms, @tic, SYSDATETIME())
+		IF EXISTS (SELECT * FROM #importResults WHERE retcode > 0)
+			BREAK
+
+		SET @tic = SYSDATETIME()
+		INSERT #procResults EXEC cmrSP_setStudyArea @study_id=@probe_id, @study_name='cmr_benchmark_probe'
+			, @hazardzone_dataset_filepath='benchmark', @element_dataset_filepath='benchmark', @reset=1
+		SET @reset_ms = DATEDIFF(ms, @tic, SYSDATETIME())
+
+		INSERT #timings (stored_studies, stored_intersections, [repeat], import_ms, reset_ms)
+			SELECT @stored, COUNT_BIG(*), @repeat, @import_ms, @reset_ms FROM cmrT_ElementHazardZone
+		SET @repeat = @repeat+1
+	END
+	IF EXISTS (SELECT * FROM #importResults WHERE retcode > 0)
+		BREAK
+	DELETE FROM #procResults
+	print 'Measured with '+CAST(@stored AS VARCHAR(10))+' stored studies'
+
+	--Store @step more studies
+	SET @n = 0
+	WHILE @n < @step AND @stored < @max_studies
+	BEGIN
+		SET @stored = @stored+1
+		SET @study_id = NULL
+		SET @name = 'cmr_benchmark_'+CAST(@stored AS VARCHAR(10))
+		INSERT #procResults EXEC cmrSP_setStudyArea @study_id=@study_id OUTPUT, @study_name=@name
+			, @hazardzone_dataset_filepath='benchmark', @element_dataset_filepath='benchmark'
+		EXEC #cmrSP_benchmarkImportRows @study_id=@study_id, @elements=@elements, @zones=@zones, @zones_per_element=@zones_per_element
+		INSERT #importResults EXEC cmrSP_importResults @study_id=@study_id
+		IF EXISTS (SELECT * FROM #importResults WHERE retcode > 0)
+			BREAK
+		SET @n = @n+1
+	END
+	IF @n = 0 OR EXISTS (SELECT * FROM #importResults WHERE retcode > 0)
+		BREAK
+	DELETE FROM #procResults
+	DELETE FROM #importResults
+END
+
+--The messages of a failed import (the timings up to the failure are still shown)
+IF EXISTS (SELECT * FROM #importResults WHERE retcode > 0)
+	SELECT * FROM #importResults WHERE retcode > 0
+
+--Timings per number of stored studies
+SELECT stored_studies
+	, stored_intersections = MAX(stored_intersections)
+	, import_ms_min = MIN(import_ms)
+	, import_ms_avg = AVG(import_ms)
+	, reset_ms_min = MIN(reset_ms)
+	, reset_ms_avg = AVG(reset_ms)
+FROM #timings
+GROUP BY stored_studies
+ORDER BY stored_studies
+
+--Delete the benchmark studies
+IF @cleanup = 1
+BEGIN
+	DECLARE benchmarkStudies CURSOR LOCAL FAST_FORWARD FOR
+		SELECT study_id, study_name FROM cmrT_StudyArea WHERE study_name LIKE 'cmr[_]benchmark[_]%'
+	OPEN benchmarkStudies
+	FETCH NEXT FROM benchmarkStudies INTO @study_id, @name
+	WHILE @@FETCH_STATUS = 0
+	BEGIN
+		INSERT #procResults EXEC cmrSP_setStudyArea @study_id=@study_id, @study_name=@name
+			, @hazardzone_dataset_filepath='benchmark', @element_dataset_filepath='benchmark', @reset=1
+		DELETE FROM cmrT_StudyArea WHERE study_id=@study_id
+		FETCH NEXT FROM benchmarkStudies INTO @study_id, @name
+	END
+	CLOSE benchmarkStudies
+	DEALLOCATE benchmarkStudies
+END
+
+DROP TABLE #procResults
+DROP TABLE #importResults
+DROP TABLE #timings
+SET NOCOUNT OFF
+GO
+DROP PROCEDURE #cmrSP_benchmarkImportRows
+GO
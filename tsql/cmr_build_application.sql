@@ -65,9 +65,14 @@ PRIMARY KEY CLUSTERED (N) WITH FILLFACTOR = 100
 GO
 SET NOCOUNT OFF
 
+/****** Object:  Sequence [dbo].[cmrS_ImportIntersectionTable_OBJECTID] ******/
+--Allocates the OBJECTID of imported rows, concurrent imports (e.g. a batch of studies loaded in parallel) never get the same id
+CREATE SEQUENCE [dbo].[cmrS_ImportIntersectionTable_OBJECTID] AS [int] START WITH 1 INCREMENT BY 1 MINVALUE 1 CYCLE CACHE 1000
+GO
+
 /****** Object:  Table [dbo].[cmrT_ImportIntersectionTable] ******/
 CREATE TABLE [dbo].[cmrT_ImportIntersectionTable](
-	[OBJECTID] [int] NOT NULL,
+	[OBJECTID] [int] NOT NULL CONSTRAINT [DF_cmrT_ImportIntersectionTable_OBJECTID] DEFAULT (NEXT VALUE FOR [dbo].[cmrS_ImportIntersectionTable_OBJECTID]),
 	[study_id] [int] NOT NULL,
 	[element_feature_id] [int] NOT NULL,
 	[elementtype_code] [char](10) NOT NULL,
@@ -84,6 +89,60 @@ CREATE TABLE [dbo].[cmrT_ImportIntersectionTable](
 ) ON [PRIMARY]
 GO
 
+CREATE CLUSTERED INDEX [IX_cmrT_ImportIntersectionTable_study_id] ON [dbo].[cmrT_ImportIntersectionTable]
+	(
+		[study_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
+CREATE UNIQUE NONCLUSTERED INDEX [IX_cmrT_ImportIntersectionTable_OBJECTID] ON [dbo].[cmrT_ImportIntersectionTable]
+	(
+		[OBJECTID] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
+/****** Object:  Table [dbo].[cmrT_ImportResetFeatures] ******/
+CREATE TABLE [dbo].[cmrT_ImportResetFeatures](
+	[study_id] [int] NOT NULL,
+	[feature_type] [char](1) NOT NULL,
+	[feature_id] [int] NOT NULL
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_ImportResetFeatures'
+	, @value=N'Staging table for incremental imports: features (E element, Z hazard zone, S output segment) whose stored results are replaced by cmrSP_upsertResults'
+GO
+
+CREATE CLUSTERED INDEX [IX_cmrT_ImportResetFeatures_study_id] ON [dbo].[cmrT_ImportResetFeatures]
+	(
+		[study_id] ASC,
+		[feature_type] ASC,
+		[feature_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
+/****** Object:  Table [dbo].[cmrT_ImportFingerprint] ******/
+CREATE TABLE [dbo].[cmrT_ImportFingerprint](
+	[study_id] [int] NOT NULL,
+	[feature_type] [char](1) NOT NULL,
+	[feature_id] [int] NOT NULL,
+	[source_feature_id] [int] NULL,
+	[fingerprint] [char](32) NOT NULL,
+	[xmin] [float] NULL,
+	[ymin] [float] NULL,
+	[xmax] [float] NULL,
+	[ymax] [float] NULL
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_ImportFingerprint'
+	, @value=N'Staging table for new rows in cmrT_FeatureFingerprint, moved by cmrSP_importResults and cmrSP_upsertResults'
+GO
+
+CREATE CLUSTERED INDEX [IX_cmrT_ImportFingerprint_study_id] ON [dbo].[cmrT_ImportFingerprint]
+	(
+		[study_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
 /****** Object:  Table [dbo].[cmrT_ProcessType] ******/
 CREATE TABLE [dbo].[cmrT_ProcessType](
 	[processtype_id] [int] NOT NULL,
@@ -209,7 +268,7 @@ CREATE TABLE [dbo].[cmrT_Element](
 	[aadt_passenger] [int] NOT NULL,
 	[aadt_goods] [int] NOT NULL,
 	[diversion_time] [decimal](38,8) NOT NULL,
- CONSTRAINT [PK_cmrT_Element] PRIMARY KEY CLUSTERED 
+ CONSTRAINT [PK_cmrT_Element] PRIMARY KEY NONCLUSTERED 
 	(
 		[element_id] ASC
 	),
@@ -250,7 +309,7 @@ CREATE TABLE [dbo].[cmrT_HazardZone](
 	[event_frequency] [int] NOT NULL,
 	[freq_error_interval_plus] [int] NOT NULL,
 	[freq_error_interval_minus] [int] NOT NULL,
- CONSTRAINT [PK_cmrT_HazardZone] PRIMARY KEY CLUSTERED 
+ CONSTRAINT [PK_cmrT_HazardZone] PRIMARY KEY NONCLUSTERED 
 	(
 		[hazardzone_id] ASC
 	),
@@ -335,15 +394,129 @@ GO
 *********************************************************/
 /****** Object:  Table [dbo].[cmrT_ElementHazardZone]    Script Date: 12/20/2012 18:01:26 ******/
 CREATE TABLE [dbo].[cmrT_ElementHazardZone](
+	[study_id] [int] NOT NULL,
 	[element_id] [int] NOT NULL,
 	[hazardzone_id] [int] NOT NULL,
- CONSTRAINT [PK_cmrT_ElementHazardZone] PRIMARY KEY CLUSTERED 
+	[route_event_frequency] [float] NULL,
+ CONSTRAINT [PK_cmrT_ElementHazardZone] PRIMARY KEY NONCLUSTERED 
 (
 	[element_id] ASC,
 	[hazardzone_id] ASC
 )WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
 ) ON [PRIMARY]
 GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_ElementHazardZone'
+	, @level2name=N'study_id'
+	, @value=N'The study of the element and hazard zone (the foreign key to cmrT_Element includes it), leads the clustered index so the intersections of a study are stored together'
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_ElementHazardZone'
+	, @level2name=N'route_event_frequency'
+	, @value=N'The contribution to the route event frequency from this intersection (adjusted for cooccurring events), maintained by cmrSP_updateRouteEventFrequency'
+GO
+
+
+/****** Object:  Table [dbo].[cmrT_ElementSummary] ******/
+CREATE TABLE [dbo].[cmrT_ElementSummary](
+	[study_id] [int] NOT NULL,
+	[element_id] [int] NOT NULL,
+	[element_feature_id] [int] NOT NULL,
+	[EventFrequency] [decimal](38,4) NULL,
+	[RouteEventFrequency] [decimal](38,4) NULL,
+	[ClosureFrequency] [decimal](38,4) NULL,
+	[ClosureDuration] [decimal](38,4) NULL,
+	[RepairCosts] [money] NULL,
+	[ReopeningCosts] [money] NULL,
+	[ClosureCosts] [money] NULL,
+ CONSTRAINT [PK_cmrT_ElementSummary] PRIMARY KEY CLUSTERED 
+(
+	[study_id] ASC,
+	[element_id] ASC
+)WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_ElementSummary'
+	, @value=N'Materialized version of cmrV_ElementSummary, maintained by cmrSP_refreshResults'
+GO
+
+/****** Object:  Table [dbo].[cmrT_RouteSummary] ******/
+CREATE TABLE [dbo].[cmrT_RouteSummary](
+	[study_id] [int] NOT NULL,
+	[route_code] [varchar](10) NULL,
+	[EventFrequency] [decimal](38,4) NULL,
+	[RouteEventFrequency] [decimal](38,4) NULL,
+	[ClosureFrequency] [decimal](38,4) NULL,
+	[ClosureDuration] [decimal](38,4) NULL,
+	[RepairCosts] [money] NULL,
+	[ReopeningCosts] [money] NULL,
+	[ClosureCosts] [money] NULL,
+	[has_route] AS (CAST(CASE WHEN [route_code] IS NULL THEN 0 ELSE 1 END AS BIT)) PERSISTED NOT NULL,
+	[route_key] AS (ISNULL([route_code],'')) PERSISTED NOT NULL,
+ CONSTRAINT [PK_cmrT_RouteSummary] PRIMARY KEY CLUSTERED 
+(
+	[study_id] ASC,
+	[has_route] ASC,
+	[route_key] ASC
+)WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_RouteSummary'
+	, @value=N'Materialized version of cmrV_RouteSummary, maintained by cmrSP_refreshResults'
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_RouteSummary'
+	, @level2name=N'route_key'
+	, @value=N'route_code for the primary key, elements without a route (NULL) have the key '''' and has_route 0'
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_RouteSummary'
+	, @level2name=N'has_route'
+	, @value=N'0 for the row of the elements without a route (NULL), so it does not collide with a blank route code in the primary key'
+GO
+
+/****** Object:  Table [dbo].[cmrT_ResultInvalidation] ******/
+CREATE TABLE [dbo].[cmrT_ResultInvalidation](
+	[study_id] [int] NOT NULL,
+	[element_id] [int] NOT NULL
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_ResultInvalidation'
+	, @value=N'Queue of elements with stale rows in cmrT_ElementSummary and cmrT_RouteSummary (filled by parameter table triggers, kept only while the refresh is deferred)'
+GO
+
+/****** Object:  Table [dbo].[cmrT_FeatureFingerprint] ******/
+CREATE TABLE [dbo].[cmrT_FeatureFingerprint](
+	[study_id] [int] NOT NULL,
+	[feature_type] [char](1) NOT NULL,
+	[feature_id] [int] NOT NULL,
+	[source_feature_id] [int] NULL,
+	[fingerprint] [char](32) NOT NULL,
+	[xmin] [float] NULL,
+	[ymin] [float] NULL,
+	[xmax] [float] NULL,
+	[ymax] [float] NULL,
+ CONSTRAINT [PK_cmrT_FeatureFingerprint] PRIMARY KEY CLUSTERED 
+(
+	[study_id] ASC,
+	[feature_type] ASC,
+	[feature_id] ASC
+)WITH (PAD_INDEX  = OFF, STATISTICS_NORECOMPUTE  = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS  = ON, ALLOW_PAGE_LOCKS  = ON) ON [PRIMARY]
+) ON [PRIMARY]
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level1name=N'cmrT_FeatureFingerprint'
+	, @value=N'Fingerprints (md5 of geometry and attributes) of the input features and output segments of the last run of a study, used for incremental runs'
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_FeatureFingerprint'
+	, @level2name=N'feature_type'
+	, @value=N'E for input elements, Z for input hazard zones and S for the segments in the output feature class (feature_id is element_feature_id)'
+GO
+EXEC sys.sp_addextendedproperty @name=N'MS_Description', @level0type=N'SCHEMA', @level0name=N'dbo', @level1type=N'TABLE', @level2type=N'COLUMN'
+	, @level1name=N'cmrT_FeatureFingerprint'
+	, @level2name=N'source_feature_id'
+	, @value=N'For segments, the object id of the input element the segment was split from'
+GO
 
 
 /********************************************************
@@ -351,6 +524,30 @@ GO
 *********************************************************/
 print 'Creating table indices'
 GO
+--The study tables are clustered by study, so the rows of a study are one range of the index
+--(resetting or importing a study seeks that range instead of scanning the rows of all stored studies)
+CREATE UNIQUE CLUSTERED INDEX IX_cmrT_Element_study_id_element_id ON [dbo].[cmrT_Element]
+	(
+		[study_id] ASC,
+		[element_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
+CREATE UNIQUE CLUSTERED INDEX IX_cmrT_HazardZone_study_id_hazardzone_id ON [dbo].[cmrT_HazardZone]
+	(
+		[study_id] ASC,
+		[hazardzone_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
+CREATE UNIQUE CLUSTERED INDEX IX_cmrT_ElementHazardZone_study_id_element_id_hazardzone_id ON [dbo].[cmrT_ElementHazardZone]
+	(
+		[study_id] ASC,
+		[element_id] ASC,
+		[hazardzone_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
 CREATE NONCLUSTERED INDEX [IX_cmrT_Element_elementtype_code] ON [dbo].[cmrT_Element] 
 	(
 		[elementtype_code] ASC
@@ -363,12 +560,25 @@ CREATE NONCLUSTERED INDEX IX_cmrT_ElementType_elementtype_code ON [dbo].[cmrT_El
 	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
 GO
 
+CREATE NONCLUSTERED INDEX IX_cmrT_ElementHazardZone_hazardzone_id ON [dbo].[cmrT_ElementHazardZone]
+	(
+		[hazardzone_id] ASC
+	) INCLUDE ([route_event_frequency]) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
 CREATE NONCLUSTERED INDEX IX_cmrT_Element_route_code ON [dbo].[cmrT_Element]
 	(
 		[route_code] ASC
 	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
 GO
 
+CREATE CLUSTERED INDEX IX_cmrT_ResultInvalidation_study_id_element_id ON [dbo].[cmrT_ResultInvalidation]
+	(
+		[study_id] ASC,
+		[element_id] ASC
+	) WITH( STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+GO
+
 
 /********************************************************
 --CREATE Foreign keys
@@ -400,8 +610,9 @@ GO
 ALTER TABLE [dbo].[cmrT_Element] CHECK CONSTRAINT [FK_cmrT_Element_cmrT_StudyArea]
 GO
 
-ALTER TABLE [dbo].[cmrT_ElementHazardZone]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_ElementHazardZone_cmrT_Element] FOREIGN KEY([element_id])
-REFERENCES [dbo].[cmrT_Element] ([element_id])
+--The intersection belongs to the study of its element (references the unique index IX_cmrT_Element_study_id_element_id)
+ALTER TABLE [dbo].[cmrT_ElementHazardZone]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_ElementHazardZone_cmrT_Element] FOREIGN KEY([study_id], [element_id])
+REFERENCES [dbo].[cmrT_Element] ([study_id], [element_id])
 ON UPDATE CASCADE
 ON DELETE CASCADE
 GO
@@ -415,6 +626,30 @@ GO
 ALTER TABLE [dbo].[cmrT_ElementHazardZone] CHECK CONSTRAINT [FK_cmrT_ElementHazardZone_cmrT_HazardZone]
 GO
 
+ALTER TABLE [dbo].[cmrT_ElementSummary]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_ElementSummary_cmrT_StudyArea] FOREIGN KEY([study_id])
+REFERENCES [dbo].[cmrT_StudyArea] ([study_id])
+ON UPDATE CASCADE
+ON DELETE CASCADE
+GO
+ALTER TABLE [dbo].[cmrT_ElementSummary] CHECK CONSTRAINT [FK_cmrT_ElementSummary_cmrT_StudyArea]
+GO
+
+ALTER TABLE [dbo].[cmrT_RouteSummary]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_RouteSummary_cmrT_StudyArea] FOREIGN KEY([study_id])
+REFERENCES [dbo].[cmrT_StudyArea] ([study_id])
+ON UPDATE CASCADE
+ON DELETE CASCADE
+GO
+ALTER TABLE [dbo].[cmrT_RouteSummary] CHECK CONSTRAINT [FK_cmrT_RouteSummary_cmrT_StudyArea]
+GO
+
+ALTER TABLE [dbo].[cmrT_FeatureFingerprint]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_FeatureFingerprint_cmrT_StudyArea] FOREIGN KEY([study_id])
+REFERENCES [dbo].[cmrT_StudyArea] ([study_id])
+ON UPDATE CASCADE
+ON DELETE CASCADE
+GO
+ALTER TABLE [dbo].[cmrT_FeatureFingerprint] CHECK CONSTRAINT [FK_cmrT_FeatureFingerprint_cmrT_StudyArea]
+GO
+
 ALTER TABLE [dbo].[cmrT_ElementType]  WITH CHECK ADD  CONSTRAINT [FK_cmrT_ElementType_cmrT_ElementCategory] FOREIGN KEY([elementcategory_id])
 REFERENCES [dbo].[cmrT_ElementCategory] ([elementcategory_id])
 ON UPDATE CASCADE
@@ -485,12 +720,13 @@ AS
 		BEGIN TRANSACTION
 		BEGIN TRY
 			--Make sure the cmrT_ImportIntersectionTable does not contain intersections with zero event_frequency or zero element_size
-			DELETE FROM cmrT_ImportIntersectionTable WHERE event_frequency <= 0 OR event_frequency IS NULL
+			--(only rows of this study are touched, other studies may be importing at the same time)
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id AND (event_frequency <= 0 OR event_frequency IS NULL)
 			SELECT @nrecords = @@ROWCOUNT
 			IF @nrecords>0
 				INSERT @results
 					SELECT 0, 'Deleted '+CAST(@nrecords AS varchar(10))+' rows with zero or undefined event_frequency'
-			DELETE FROM cmrT_ImportIntersectionTable WHERE element_size <= 0 OR element_size IS NULL
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id AND (element_size <= 0 OR element_size IS NULL)
 			SELECT @nrecords = @@ROWCOUNT
 			IF @nrecords>0
 				INSERT @results
@@ -544,9 +780,11 @@ AS
 
 			--Insert intersections
 			INSERT INTO [cmrT_ElementHazardZone]
-					   ([element_id]
+					   ([study_id]
+					   ,[element_id]
 					   ,[hazardzone_id])
-			SELECT e.[element_id]
+			SELECT t.[study_id]
+				  ,e.[element_id]
 				  ,hz.[hazardzone_id]
 			FROM cmrT_ImportIntersectionTable t
 				INNER JOIN [cmrT_Element] e ON t.[study_id]=e.[study_id] AND t.[element_feature_id]=e.[element_feature_id]
@@ -555,17 +793,236 @@ AS
 
 			INSERT @results
 				SELECT 0, 'Inserted '+CAST(@@ROWCOUNT AS varchar(10))+' element hazardzone intersections into ElementHazardZone table'
+
+			--Replace the fingerprints of the study with the staged ones (if any, they are used by incremental runs)
+			DELETE FROM cmrT_FeatureFingerprint WHERE study_id=@study_id
+			INSERT INTO cmrT_FeatureFingerprint (study_id, feature_type, feature_id, source_feature_id, fingerprint, xmin, ymin, xmax, ymax)
+				SELECT study_id, feature_type, feature_id, source_feature_id, fingerprint, xmin, ymin, xmax, ymax
+				FROM cmrT_ImportFingerprint
+				WHERE study_id=@study_id
 				
-			--Delete all records from import table
-			TRUNCATE TABLE cmrT_ImportIntersectionTable
+			--Delete the records of this study from import and staging tables
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id
+			DELETE FROM cmrT_ImportFingerprint WHERE study_id=@study_id
+			DELETE FROM cmrT_ImportResetFeatures WHERE study_id=@study_id
 			--Commit
 			COMMIT TRANSACTION
+			--Refresh the materialized result tables for the study
+			DECLARE @nelements INT, @nroutes INT
+			EXEC cmrSP_refreshResults @study_id=@study_id, @nelements=@nelements OUTPUT, @nroutes=@nroutes OUTPUT
+			INSERT @results
+				SELECT 0, 'Refreshed results for '+CAST(@nelements AS varchar(10))+' elements and '+CAST(@nroutes AS varchar(10))+' routes'
 		END TRY
 		BEGIN CATCH
 			SELECT @msg = ERROR_MESSAGE()
 			INSERT @results
 				SELECT 1, @msg
-			ROLLBACK TRANSACTION
+			IF @@TRANCOUNT > 0
+				ROLLBACK TRANSACTION
+			INSERT @results
+				SELECT 1, @msg
+		END CATCH
+	END
+	SELECT * FROM @results
+	SELECT @retcode = MAX(retcode) FROM @results
+RETURN @retcode
+GO
+
+/****** Object:  StoredProcedure [dbo].[cmrSP_upsertResults]  ******/
+CREATE PROCEDURE [dbo].[cmrSP_upsertResults]
+	@study_id int
+/*
+Incremental version of cmrSP_importResults, the study is not reset before the import
+The segments staged in cmrT_ImportResetFeatures lose their intersections, and are deleted if they have no new rows in cmrT_ImportIntersectionTable
+Elements that are kept (same element_feature_id) are updated, so element_id and the rows in cmrT_ElementSummary are stable
+*/
+AS
+	SET NOCOUNT ON
+
+	DECLARE @retcode INT
+	DECLARE @nrecords INT
+	DECLARE @msg VARCHAR(255)
+	
+	DECLARE @results TABLE(retcode INT, [message] varchar(255))
+	DECLARE @routes TABLE(route_code VARCHAR(10))
+
+	--Make sure the study id exists
+	IF NOT EXISTS (SELECT * FROM cmrT_StudyArea WHERE study_id=@study_id)
+		INSERT @results VALUES(1, 'No study area exist with id '+CAST(@study_id AS varchar(10)))
+	IF NOT EXISTS (SELECT * FROM @results WHERE retcode > 0) --No errors
+	BEGIN
+		BEGIN TRANSACTION
+		BEGIN TRY
+			--Make sure the cmrT_ImportIntersectionTable does not contain intersections with zero event_frequency or zero element_size
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id AND (event_frequency <= 0 OR event_frequency IS NULL)
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id AND (element_size <= 0 OR element_size IS NULL)
+
+			--Remember the routes of the reset segments, their route summaries must be refreshed even if the segments are deleted
+			INSERT @routes (route_code)
+				SELECT DISTINCT RTRIM(e.route_code)
+				FROM cmrT_Element e
+				INNER JOIN cmrT_ImportResetFeatures r ON r.study_id=e.study_id AND r.feature_type='S' AND r.feature_id=e.element_feature_id
+				WHERE e.study_id=@study_id
+
+			--Remove the intersections of the reset segments
+			DELETE ehz FROM cmrT_ElementHazardZone ehz
+				INNER JOIN cmrT_Element e ON ehz.study_id=e.study_id AND ehz.element_id=e.element_id
+				INNER JOIN cmrT_ImportResetFeatures r ON r.study_id=e.study_id AND r.feature_type='S' AND r.feature_id=e.element_feature_id
+				WHERE ehz.study_id=@study_id AND e.study_id=@study_id
+
+			--Delete reset segments that are gone or no longer intersect any hazard zone
+			DELETE e FROM cmrT_Element e
+				INNER JOIN cmrT_ImportResetFeatures r ON r.study_id=e.study_id AND r.feature_type='S' AND r.feature_id=e.element_feature_id
+				WHERE e.study_id=@study_id
+					AND NOT EXISTS (SELECT * FROM cmrT_ImportIntersectionTable t WHERE t.study_id=e.study_id AND t.element_feature_id=e.element_feature_id)
+			SELECT @nrecords = @@ROWCOUNT
+			DELETE s FROM cmrT_ElementSummary s
+				WHERE s.study_id=@study_id AND NOT EXISTS (SELECT * FROM cmrT_Element e WHERE e.study_id=s.study_id AND e.element_id=s.element_id)
+			INSERT @results
+				SELECT 0, 'Deleted '+CAST(@nrecords AS varchar(10))+' rows from element table'
+
+			--Update changed hazard zones and insert new ones
+			UPDATE hz SET [processtype_id]=t.[processtype_id]
+					, [event_frequency]=t.[event_frequency]
+					, [freq_error_interval_plus]=t.[freq_interval_plus]
+					, [freq_error_interval_minus]=t.[freq_interval_minus]
+			FROM [cmrT_HazardZone] hz
+			INNER JOIN (SELECT DISTINCT [study_id]
+					  ,[hazardzone_feature_id]
+					  ,ISNULL([processtype_id],0) AS [processtype_id]
+					  ,ISNULL([event_frequency],0) AS [event_frequency]
+					  ,ISNULL([freq_interval_plus],0) AS [freq_interval_plus]
+					  ,ISNULL([freq_interval_minus],0) AS [freq_interval_minus]
+				FROM cmrT_ImportIntersectionTable
+				WHERE [study_id]=@study_id) t ON hz.[study_id]=t.[study_id] AND hz.[hazardzone_feature_id]=t.[hazardzone_feature_id]
+			INSERT INTO [cmrT_HazardZone]
+					   ([study_id]
+					   ,[hazardzone_feature_id]
+					   ,[processtype_id]
+					   ,[event_frequency]
+					   ,[freq_error_interval_plus]
+					   ,[freq_error_interval_minus])
+			SELECT DISTINCT [study_id]
+				  ,[hazardzone_feature_id]
+				  ,ISNULL([processtype_id],0)
+				  ,ISNULL([event_frequency],0)
+				  ,ISNULL([freq_interval_plus],0)
+				  ,ISNULL([freq_interval_minus],0)
+			FROM cmrT_ImportIntersectionTable t
+			WHERE t.[study_id]=@study_id
+				AND NOT EXISTS (SELECT * FROM [cmrT_HazardZone] hz WHERE hz.[study_id]=t.[study_id] AND hz.[hazardzone_feature_id]=t.[hazardzone_feature_id])
+			INSERT @results
+				SELECT 0, 'Inserted '+CAST(@@ROWCOUNT AS varchar(10))+' rows into hazardzone table'
+
+			--Update kept elements and insert new ones
+			UPDATE e SET [element_size]=t.[element_size]
+					, [elementtype_code]=t.[elementtype_code]
+					, [route_code]=t.[route_code]
+					, [aadt_passenger]=t.[aadt_passenger]
+					, [aadt_goods]=t.[aadt_goods]
+					, [diversion_time]=t.[diversion_time]
+			FROM [cmrT_Element] e
+			INNER JOIN (SELECT DISTINCT [study_id]
+					, [element_feature_id]
+					, [element_size]
+					, [elementtype_code]
+					, [route_code]
+					, ISNULL([aadt_passenger],0) AS [aadt_passenger]
+					, ISNULL([aadt_goods],0) AS [aadt_goods]
+					, ISNULL([diversion_time],0) AS [diversion_time]
+				FROM cmrT_ImportIntersectionTable
+				WHERE [study_id]=@study_id) t ON e.[study_id]=t.[study_id] AND e.[element_feature_id]=t.[element_feature_id]
+			INSERT INTO [cmrT_Element]
+					   ([study_id]
+					   ,[element_feature_id]
+					   ,[element_size]
+					   ,[elementtype_code]
+					   ,[route_code]
+					   ,[aadt_passenger]
+					   ,[aadt_goods]
+					   ,[diversion_time])
+			SELECT DISTINCT
+				[study_id]
+				, [element_feature_id]
+				, [element_size]
+				, [elementtype_code]
+				, [route_code]
+				, ISNULL([aadt_passenger],0)
+				, ISNULL([aadt_goods],0)
+				, ISNULL([diversion_time],0)
+			FROM cmrT_ImportIntersectionTable t
+			WHERE t.[study_id]=@study_id
+				AND NOT EXISTS (SELECT * FROM [cmrT_Element] e WHERE e.[study_id]=t.[study_id] AND e.[element_feature_id]=t.[element_feature_id])
+			INSERT @results
+				SELECT 0, 'Inserted '+CAST(@@ROWCOUNT AS varchar(10))+' rows into element table'
+
+			--Insert intersections
+			INSERT INTO [cmrT_ElementHazardZone]
+					   ([study_id]
+					   ,[element_id]
+					   ,[hazardzone_id])
+			SELECT DISTINCT t.[study_id]
+				  ,e.[element_id]
+				  ,hz.[hazardzone_id]
+			FROM cmrT_ImportIntersectionTable t
+				INNER JOIN [cmrT_Element] e ON t.[study_id]=e.[study_id] AND t.[element_feature_id]=e.[element_feature_id]
+				INNER JOIN [cmrT_HazardZone] hz ON t.[study_id]=hz.[study_id] AND t.[hazardzone_feature_id]=hz.[hazardzone_feature_id]
+			WHERE t.[study_id]=@study_id
+				AND NOT EXISTS (SELECT * FROM [cmrT_ElementHazardZone] ehz WHERE ehz.[study_id]=e.[study_id] AND ehz.[element_id]=e.[element_id] AND ehz.[hazardzone_id]=hz.[hazardzone_id])
+			INSERT @results
+				SELECT 0, 'Inserted '+CAST(@@ROWCOUNT AS varchar(10))+' element hazardzone intersections into ElementHazardZone table'
+
+			--Hazard zones without intersections are removed (as if the study was imported from scratch)
+			DELETE hz FROM cmrT_HazardZone hz
+				WHERE hz.study_id=@study_id AND NOT EXISTS (SELECT * FROM cmrT_ElementHazardZone ehz WHERE ehz.study_id=hz.study_id AND ehz.hazardzone_id=hz.hazardzone_id)
+
+			--Replace the fingerprints of the reset features with the staged ones
+			DELETE f FROM cmrT_FeatureFingerprint f
+				INNER JOIN cmrT_ImportResetFeatures r ON r.study_id=f.study_id AND r.feature_type=f.feature_type AND r.feature_id=f.feature_id
+				WHERE f.study_id=@study_id
+			DELETE f FROM cmrT_FeatureFingerprint f
+				INNER JOIN cmrT_ImportFingerprint i ON i.study_id=f.study_id AND i.feature_type=f.feature_type AND i.feature_id=f.feature_id
+				WHERE f.study_id=@study_id
+			INSERT INTO cmrT_FeatureFingerprint (study_id, feature_type, feature_id, source_feature_id, fingerprint, xmin, ymin, xmax, ymax)
+				SELECT study_id, feature_type, feature_id, source_feature_id, fingerprint, xmin, ymin, xmax, ymax
+				FROM cmrT_ImportFingerprint
+				WHERE study_id=@study_id
+
+			--Queue the imported elements for a refresh of the result tables
+			INSERT cmrT_ResultInvalidation (study_id, element_id)
+				SELECT DISTINCT e.study_id, e.element_id
+				FROM cmrT_Element e
+				INNER JOIN cmrT_ImportIntersectionTable t ON t.study_id=e.study_id AND t.element_feature_id=e.element_feature_id
+				WHERE e.study_id=@study_id
+			--Elements that were not imported may share a hazardzone and route with changed elements,
+			--so the stored route event frequencies of the study are updated (and changed elements queued)
+			EXEC cmrSP_updateRouteEventFrequency @study_id=@study_id
+
+			--Delete the records of this study from import and staging tables
+			DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id
+			DELETE FROM cmrT_ImportFingerprint WHERE study_id=@study_id
+			DELETE FROM cmrT_ImportResetFeatures WHERE study_id=@study_id
+			--Commit
+			COMMIT TRANSACTION
+			--Refresh the queued elements and their routes
+			DECLARE @nelements INT, @nroutes INT
+			EXEC cmrSP_refreshResults @nelements=@nelements OUTPUT, @nroutes=@nroutes OUTPUT
+			--Refresh the routes of the reset segments (they may have lost all their elements)
+			DELETE r FROM cmrT_RouteSummary r
+			WHERE r.study_id=@study_id AND EXISTS (SELECT * FROM @routes a WHERE a.route_code=r.route_code OR (a.route_code IS NULL AND r.route_code IS NULL))
+			INSERT cmrT_RouteSummary (study_id, route_code, EventFrequency, RouteEventFrequency
+					, ClosureFrequency, ClosureDuration, RepairCosts, ReopeningCosts, ClosureCosts)
+				SELECT s.study_id, s.route_code, s.EventFrequency, s.RouteEventFrequency
+					, s.ClosureFrequency, s.ClosureDuration, s.RepairCosts, s.ReopeningCosts, s.ClosureCosts
+				FROM cmrV_RouteSummary s
+				WHERE s.study_id=@study_id AND EXISTS (SELECT * FROM @routes a WHERE a.route_code=s.route_code OR (a.route_code IS NULL AND s.route_code IS NULL))
+			INSERT @results
+				SELECT 0, 'Refreshed results for '+CAST(@nelements AS varchar(10))+' elements and '+CAST(@nroutes AS varchar(10))+' routes'
+		END TRY
+		BEGIN CATCH
+			SELECT @msg = ERROR_MESSAGE()
+			IF @@TRANCOUNT > 0
+				ROLLBACK TRANSACTION
 			INSERT @results
 				SELECT 1, @msg
 		END CATCH
@@ -582,6 +1039,10 @@ CREATE PROCEDURE [dbo].[cmrSP_setStudyArea]
 	, @hazardzone_dataset_filepath NVARCHAR(4000)
 	, @element_dataset_filepath NVARCHAR(4000)
 	, @study_description VARCHAR(MAX) = NULL
+	, @reset BIT = 1
+/*
+With @reset=0 the results of an existing study are kept, so they can be updated incrementally with cmrSP_upsertResults
+*/
 AS
 	SET NOCOUNT ON
 	DECLARE @retcode INT
@@ -606,17 +1067,175 @@ AS
 		SELECT @retcode = 0
 	END
 	--Make sure cmr is ready to recieve data
-	--Delete all records from import table (if any)
-	TRUNCATE TABLE cmrT_ImportIntersectionTable
-	--Make sure any related data are deleted
-	DELETE FROM cmrT_ElementHazardZone WHERE EXISTS (SELECT * FROM cmrT_Element e WHERE cmrT_ElementHazardZone.element_id=e.element_id AND e.study_id=@study_id)
-	DELETE FROM cmrT_Element WHERE study_id=@study_id
-	DELETE FROM cmrT_HazardZone WHERE study_id=@study_id
+	--Delete all records of this study from import and staging tables (if any)
+	DELETE FROM cmrT_ImportIntersectionTable WHERE study_id=@study_id
+	DELETE FROM cmrT_ImportFingerprint WHERE study_id=@study_id
+	DELETE FROM cmrT_ImportResetFeatures WHERE study_id=@study_id
+	IF @reset=1
+	BEGIN
+		--Make sure any related data are deleted
+		DELETE FROM cmrT_ElementHazardZone WHERE study_id=@study_id
+		DELETE FROM cmrT_Element WHERE study_id=@study_id
+		DELETE FROM cmrT_HazardZone WHERE study_id=@study_id
+		DELETE FROM cmrT_ElementSummary WHERE study_id=@study_id
+		DELETE FROM cmrT_RouteSummary WHERE study_id=@study_id
+		DELETE FROM cmrT_ResultInvalidation WHERE study_id=@study_id
+		DELETE FROM cmrT_FeatureFingerprint WHERE study_id=@study_id
+	END
 	
 	SELECT * FROM @results
 RETURN @retcode
 GO
 
+/****** Object:  StoredProcedure [dbo].[cmrSP_updateRouteEventFrequency]  ******/
+CREATE PROCEDURE [dbo].[cmrSP_updateRouteEventFrequency]
+	@study_id INT = NULL
+	, @nchanged INT = NULL OUTPUT
+/*
+Recomputes route_event_frequency in cmrT_ElementHazardZone for all hazard zones of a study,
+or (if study_id is NULL) for the hazard zones of the elements queued in cmrT_ResultInvalidation.
+The intersections are partitioned by (hazardzone, route) once, the frequencies are reduced per partition
+and the adjusted contribution is written back to each intersection.
+Elements whose route_event_frequency changed are queued in cmrT_ResultInvalidation.
+*/
+AS
+	SET NOCOUNT ON
+	DECLARE @zones TABLE(hazardzone_id INT PRIMARY KEY)
+	DECLARE @changed TABLE(element_id INT)
+
+	IF @study_id IS NOT NULL
+		INSERT @zones (hazardzone_id)
+			SELECT hazardzone_id FROM cmrT_HazardZone WHERE study_id=@study_id
+	ELSE
+		INSERT @zones (hazardzone_id)
+			SELECT DISTINCT ehz.hazardzone_id
+			FROM cmrT_ResultInvalidation q
+			INNER JOIN cmrT_ElementHazardZone ehz ON q.element_id=ehz.element_id
+
+	--The event frequency of each intersection as in cmrV_ElementHazardZone (only valid element types and process types)
+	;WITH pairs AS (
+		SELECT ehz.element_id
+			, ehz.hazardzone_id
+			, route_code = RTRIM(e.route_code)
+			, event_frequency = ISNULL(CAST(e.element_size AS FLOAT)*pt.frequency_size_factor,1.0)/CAST(hz.event_frequency AS FLOAT)
+			, pt.event_cooccurrence_factor
+		FROM cmrT_ElementHazardZone ehz
+		INNER JOIN @zones z ON ehz.hazardzone_id=z.hazardzone_id
+		INNER JOIN cmrT_Element e ON ehz.study_id=e.study_id AND ehz.element_id=e.element_id
+		INNER JOIN cmrT_ElementType et ON e.elementtype_code=et.elementtype_code
+		INNER JOIN cmrT_ElementCategory ec ON et.elementcategory_id=ec.elementcategory_id
+		INNER JOIN cmrT_HazardZone hz ON ehz.hazardzone_id=hz.hazardzone_id
+		INNER JOIN cmrT_ProcessType pt ON hz.processtype_id=pt.processtype_id
+		WHERE pt.processtype_id<>100
+	), reduced AS ( --Sum and maximum of the frequencies within each (hazardzone, route) partition
+		SELECT element_id
+			, hazardzone_id
+			, route_code
+			, event_frequency
+			, event_frequency_sum = SUM(event_frequency) OVER (PARTITION BY hazardzone_id, route_code)
+			, event_frequency_max = MAX(event_frequency) OVER (PARTITION BY hazardzone_id, route_code)
+			, event_cooccurrence_factor = MAX(event_cooccurrence_factor) OVER (PARTITION BY hazardzone_id, route_code)
+		FROM pairs
+	), contribution AS (
+		SELECT element_id
+			, hazardzone_id
+			, route_event_frequency = CASE
+				WHEN route_code IS NULL THEN 0
+				ELSE ISNULL((event_frequency_max+(1-event_cooccurrence_factor)*(event_frequency_sum-event_frequency_max))
+					*event_frequency/NULLIF(event_frequency_sum,0),0)
+				END
+		FROM reduced
+	)
+	UPDATE ehz SET route_event_frequency=c.route_event_frequency
+	OUTPUT inserted.element_id INTO @changed (element_id)
+	FROM cmrT_ElementHazardZone ehz
+	INNER JOIN contribution c ON ehz.element_id=c.element_id AND ehz.hazardzone_id=c.hazardzone_id
+	WHERE ehz.route_event_frequency IS NULL OR ehz.route_event_frequency<>c.route_event_frequency
+
+	--Queue the elements with changed values so their results are refreshed
+	INSERT cmrT_ResultInvalidation (study_id, element_id)
+		SELECT DISTINCT e.study_id, e.element_id
+		FROM cmrT_Element e
+		INNER JOIN @changed c ON e.element_id=c.element_id
+	SELECT @nchanged = @@ROWCOUNT
+RETURN 0
+GO
+
+/****** Object:  StoredProcedure [dbo].[cmrSP_refreshResults]  ******/
+CREATE PROCEDURE [dbo].[cmrSP_refreshResults]
+	@study_id INT = NULL
+	, @nelements INT = NULL OUTPUT
+	, @nroutes INT = NULL OUTPUT
+/*
+Recomputes the rows of cmrT_ElementSummary and cmrT_RouteSummary that are queued in cmrT_ResultInvalidation
+If study_id is given, all elements of the study are refreshed
+*/
+AS
+	SET NOCOUNT ON
+	DECLARE @elements TABLE(study_id INT, element_id INT PRIMARY KEY)
+	DECLARE @routes TABLE(study_id INT, route_code VARCHAR(10))
+
+	--Update the stored route event frequencies first (elements with changed values are queued as well)
+	EXEC cmrSP_updateRouteEventFrequency @study_id=@study_id
+
+	IF @study_id IS NOT NULL
+	BEGIN
+		--Full refresh of the study
+		DELETE FROM cmrT_ElementSummary WHERE study_id=@study_id
+		DELETE FROM cmrT_RouteSummary WHERE study_id=@study_id
+		INSERT cmrT_ResultInvalidation (study_id, element_id)
+			SELECT study_id, element_id FROM cmrT_Element WHERE study_id=@study_id
+	END
+
+	--Take the queued elements and the routes they belong to
+	INSERT @elements (study_id, element_id)
+		SELECT DISTINCT study_id, element_id FROM cmrT_ResultInvalidation
+	DELETE q FROM cmrT_ResultInvalidation q INNER JOIN @elements a ON q.element_id=a.element_id
+	INSERT @routes (study_id, route_code)
+		SELECT DISTINCT e.study_id, RTRIM(e.route_code)
+		FROM cmrT_Element e
+		INNER JOIN @elements a ON e.element_id=a.element_id
+
+	--Recompute the element rows
+	DELETE r FROM cmrT_ElementSummary r INNER JOIN @elements a ON r.element_id=a.element_id
+	INSERT cmrT_ElementSummary (study_id, element_id, element_feature_id, EventFrequency, RouteEventFrequency
+			, ClosureFrequency, ClosureDuration, RepairCosts, ReopeningCosts, ClosureCosts)
+		SELECT s.study_id, s.element_id, s.element_feature_id, s.EventFrequency, s.RouteEventFrequency
+			, s.ClosureFrequency, s.ClosureDuration, s.RepairCosts, s.ReopeningCosts, s.ClosureCosts
+		FROM cmrV_ElementSummary s
+		INNER JOIN @elements a ON s.element_id=a.element_id
+	SELECT @nelements = (SELECT COUNT(*) FROM @elements)
+
+	--Recompute the route rows (a NULL route_code is a route of its own as in cmrV_RouteSummary)
+	DELETE r FROM cmrT_RouteSummary r
+	WHERE EXISTS (SELECT * FROM @routes a WHERE a.study_id=r.study_id AND (a.route_code=r.route_code OR (a.route_code IS NULL AND r.route_code IS NULL)))
+	INSERT cmrT_RouteSummary (study_id, route_code, EventFrequency, RouteEventFrequency
+			, ClosureFrequency, ClosureDuration, RepairCosts, ReopeningCosts, ClosureCosts)
+		SELECT s.study_id, s.route_code, s.EventFrequency, s.RouteEventFrequency
+			, s.ClosureFrequency, s.ClosureDuration, s.RepairCosts, s.ReopeningCosts, s.ClosureCosts
+		FROM cmrV_RouteSummary s
+		WHERE EXISTS (SELECT * FROM @routes a WHERE a.study_id=s.study_id AND (a.route_code=s.route_code OR (a.route_code IS NULL AND s.route_code IS NULL)))
+	SELECT @nroutes = (SELECT COUNT(*) FROM @routes)
+RETURN 0
+GO
+
+/****** Object:  StoredProcedure [dbo].[cmrSP_refreshQueuedResults]  ******/
+CREATE PROCEDURE [dbo].[cmrSP_refreshQueuedResults]
+/*
+Called by the parameter table triggers after they have queued the affected elements.
+Refreshes the queue with cmrSP_refreshResults within the editing statement, so the results are current when it returns.
+Bulk edits can defer the refresh by setting the first byte of CONTEXT_INFO to 0x01 (SET CONTEXT_INFO 0x01)
+and run EXEC cmrSP_refreshResults once when done (or leave the queue to the job in cmr_refresh_job.sql)
+*/
+AS
+	SET NOCOUNT ON
+	IF ISNULL(SUBSTRING(CONTEXT_INFO(),1,1),0x00)=0x01
+		RETURN 0
+	IF EXISTS (SELECT * FROM cmrT_ResultInvalidation)
+		EXEC cmrSP_refreshResults
+RETURN 0
+GO
+
 /****** Object:  StoredProcedure [dbo].[cmrSP_resultSummary] ******/
 CREATE PROCEDURE [dbo].[cmrSP_resultSummary]
 	@study_id INT
@@ -962,22 +1581,13 @@ WITH elementData AS ( --First select all relevant attributes per element
 		, hz.event_cooccurrence_factor
 		, hazardzone_event_frequency = 1.0 / hz.event_frequency
 		, event_frequency = ISNULL(e.element_size*hz.frequency_size_factor,1.0)/hz.event_frequency
+		, ehz.route_event_frequency
 		, e.aadt_passenger
 		, e.aadt_goods
 		, e.diversion_time
 	FROM dbo.cmrT_ElementHazardZone ehz
-	INNER JOIN dbo.cmrV_Element e ON ehz.element_id=e.element_id
-	INNER JOIN dbo.cmrV_HazardZone hz ON ehz.hazardzone_id=hz.hazardzone_id
-), routeData AS ( --Then summarize frequencies over hazardzone and route (needed for calculation of route frequencies when we have concurrent events)
-	SELECT hazardzone_id
-		, route_code
-			--The frequency sum
-		, SUM(event_frequency) AS event_frequency_sum
-			--An adjusted frequency that is somewhere between maximum frequency (when cooccurence factor = 1) and the sum of the frequencies (when cooccurence factor = 0)
-		, MAX(event_frequency)+(1-MAX(event_cooccurrence_factor))*(SUM(event_frequency)-MAX(event_frequency)) AS event_frequency_adj --Adjusted for concurrent events
-  FROM elementData
-  WHERE route_code IS NOT NULL
-  GROUP BY hazardzone_id, route_code
+	INNER JOIN dbo.cmrV_Element e ON ehz.study_id=e.study_id AND ehz.element_id=e.element_id
+	INNER JOIN dbo.cmrV_HazardZone hz ON ehz.study_id=hz.study_id AND ehz.hazardzone_id=hz.hazardzone_id
 ) --Now we are ready to output the attributes
 SELECT e.study_id
 	, e.element_id
@@ -996,12 +1606,14 @@ SELECT e.study_id
 	, e.event_cooccurrence_factor
 	, e.hazardzone_event_frequency --The original frequency of hazard zone
 	, e.event_frequency --The event frequency calculated for this object
-	, route_event_frequency = ISNULL(rd.event_frequency_adj*e.event_frequency/rd.event_frequency_sum,0) --The contribution to the total route event frequency from this object
+	--The contribution to the total route event frequency from this object, adjusted for concurrent events within the hazardzone
+	--(stored by cmrSP_updateRouteEventFrequency, somewhere between the maximum and the sum of the frequencies on the route).
+	--The triggers on cmrT_HazardZone and cmrT_ProcessType recompute it in the editing transaction, imports in cmrSP_refreshResults
+	, route_event_frequency = ISNULL(e.route_event_frequency,0)
 	, e.aadt_passenger
 	, e.aadt_goods
 	, e.diversion_time
 FROM elementData e
-LEFT JOIN routeData rd ON e.route_code=rd.route_code AND e.hazardzone_id=rd.hazardzone_id
 GO
 
 
@@ -1296,6 +1908,103 @@ SELECT c.study_id
 FROM cte1 c
 GO
 
+/********************************************************
+--CREATE Triggers
+*********************************************************/
+--The triggers queue the affected elements in cmrT_ResultInvalidation and refresh only those rows through
+--cmrSP_refreshQueuedResults before the editing statement returns. Bulk edits can defer the refresh with
+--SET CONTEXT_INFO 0x01 and process the queue once afterwards (EXEC cmrSP_refreshResults or the job in cmr_refresh_job.sql)
+print 'Creating triggers'
+GO
+CREATE TRIGGER [dbo].[cmrTR_DamageFunction_invalidateResults] ON [dbo].[cmrT_DamageFunction]
+AFTER INSERT, UPDATE, DELETE
+AS
+/*
+Refresh results for elements in zones with the changed process types that have a value of the changed value types
+*/
+	SET NOCOUNT ON
+	;WITH changed AS (
+		SELECT processtype_id, valuetype_id FROM inserted
+		UNION
+		SELECT processtype_id, valuetype_id FROM deleted
+	)
+	INSERT cmrT_ResultInvalidation (study_id, element_id)
+		SELECT DISTINCT e.study_id, e.element_id
+		FROM cmrT_Element e
+		INNER JOIN cmrT_ElementHazardZone ehz ON e.element_id=ehz.element_id
+		INNER JOIN cmrT_HazardZone hz ON ehz.hazardzone_id=hz.hazardzone_id
+		INNER JOIN cmrT_ElementType et ON e.elementtype_code=et.elementtype_code
+		INNER JOIN changed c ON hz.processtype_id=c.processtype_id
+		WHERE EXISTS (SELECT * FROM cmrT_ElementValue ev WHERE ev.elementtype_id=et.elementtype_id AND ev.valuetype_id=c.valuetype_id)
+	EXEC cmrSP_refreshQueuedResults
+GO
+
+CREATE TRIGGER [dbo].[cmrTR_ElementValue_invalidateResults] ON [dbo].[cmrT_ElementValue]
+AFTER INSERT, UPDATE, DELETE
+AS
+/*
+Refresh results for elements of the changed element types
+*/
+	SET NOCOUNT ON
+	;WITH changed AS (
+		SELECT elementtype_id FROM inserted
+		UNION
+		SELECT elementtype_id FROM deleted
+	)
+	INSERT cmrT_ResultInvalidation (study_id, element_id)
+		SELECT e.study_id, e.element_id
+		FROM cmrT_Element e
+		INNER JOIN cmrT_ElementType et ON e.elementtype_code=et.elementtype_code
+		INNER JOIN changed c ON et.elementtype_id=c.elementtype_id
+	EXEC cmrSP_refreshQueuedResults
+GO
+
+CREATE TRIGGER [dbo].[cmrTR_ProcessType_invalidateResults] ON [dbo].[cmrT_ProcessType]
+AFTER INSERT, UPDATE, DELETE
+AS
+/*
+Refresh results for elements in zones with the changed process types
+(all elements sharing a zone are affected by the cooccurrence factor, so the whole zone is refreshed)
+*/
+	SET NOCOUNT ON
+	;WITH changed AS (
+		SELECT processtype_id FROM inserted
+		UNION
+		SELECT processtype_id FROM deleted
+	)
+	INSERT cmrT_ResultInvalidation (study_id, element_id)
+		SELECT DISTINCT e.study_id, e.element_id
+		FROM cmrT_Element e
+		INNER JOIN cmrT_ElementHazardZone ehz ON e.element_id=ehz.element_id
+		INNER JOIN cmrT_HazardZone hz ON ehz.hazardzone_id=hz.hazardzone_id
+		INNER JOIN changed c ON hz.processtype_id=c.processtype_id
+	--The stored route event frequencies of the queued zones are recomputed even if the refresh is deferred
+	EXEC cmrSP_updateRouteEventFrequency
+	EXEC cmrSP_refreshQueuedResults
+GO
+
+CREATE TRIGGER [dbo].[cmrTR_HazardZone_invalidateResults] ON [dbo].[cmrT_HazardZone]
+AFTER UPDATE
+AS
+/*
+Refresh results for elements in zones with changed frequency or process type
+(the route event frequencies of the zones are recomputed within the edit)
+*/
+	SET NOCOUNT ON
+	IF NOT (UPDATE(event_frequency) OR UPDATE(processtype_id))
+		RETURN
+	INSERT cmrT_ResultInvalidation (study_id, element_id)
+		SELECT DISTINCT e.study_id, e.element_id
+		FROM cmrT_Element e
+		INNER JOIN cmrT_ElementHazardZone ehz ON e.element_id=ehz.element_id
+		INNER JOIN inserted i ON ehz.hazardzone_id=i.hazardzone_id
+		INNER JOIN deleted d ON i.hazardzone_id=d.hazardzone_id
+		WHERE i.event_frequency<>d.event_frequency OR i.processtype_id<>d.processtype_id
+	--The stored route event frequencies of the queued zones are recomputed even if the refresh is deferred
+	EXEC cmrSP_updateRouteEventFrequency
+	EXEC cmrSP_refreshQueuedResults
+GO
+
 /********************************************************
 --POPULATE BASE TABLES
 *********************************************************/
@@ -1530,11 +2239,11 @@ INSERT [dbo].[cmrT_Element] ([element_id], [study_id], [element_feature_id], [el
 INSERT [dbo].[cmrT_Element] ([element_id], [study_id], [element_feature_id], [element_size], [elementtype_code], [route_code], [aadt_passenger], [aadt_goods], [diversion_time]) VALUES (4, 100, 4, 100, N'EV', N'E6', 5570, 1058, 2)
 SET IDENTITY_INSERT [dbo].[cmrT_Element] OFF
 
-INSERT cmrT_ElementHazardZone (element_id, hazardzone_id) VALUES(1,1)
-INSERT cmrT_ElementHazardZone (element_id, hazardzone_id) VALUES(2,2)
-INSERT cmrT_ElementHazardZone (element_id, hazardzone_id) VALUES(3,3)
-INSERT cmrT_ElementHazardZone (element_id, hazardzone_id) VALUES(4,4)
-INSERT cmrT_ElementHazardZone (element_id, hazardzone_id) VALUES(1,4)
+INSERT cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) VALUES(100,1,1)
+INSERT cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) VALUES(100,2,2)
+INSERT cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) VALUES(100,3,3)
+INSERT cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) VALUES(100,4,4)
+INSERT cmrT_ElementHazardZone (study_id, element_id, hazardzone_id) VALUES(100,1,4)
 SET NOCOUNT OFF
 GO
 */
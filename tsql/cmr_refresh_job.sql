@@ -0,0 +1,35 @@
+/*
+Optional: creates a SQL Server Agent job that refreshes the queued results of the cmr database every minute.
+
+Edits of the parameter tables (cmrT_DamageFunction, cmrT_ElementValue, cmrT_ProcessType) and of hazard zone frequencies
+queue the affected elements in cmrT_ResultInvalidation and the triggers refresh them before the edit returns.
+Bulk edits that defer the refresh (SET CONTEXT_INFO 0x01) leave the queue to this job, which runs cmrSP_refreshResults
+in its own transaction. Without SQL Server Agent (e.g. SQL Server Express) run EXEC cmrSP_refreshResults after a
+deferred bulk edit instead. Set @database if the cmr database is not named cmrGeo.
+*/
+
+USE msdb
+GO
+SET NOCOUNT ON
+DECLARE @database SYSNAME = N'cmrGeo'
+DECLARE @job SYSNAME = N'cmr refresh results'
+
+IF EXISTS (SELECT * FROM dbo.sysjobs WHERE name=@job)
+	EXEC dbo.sp_delete_job @job_name=@job
+
+EXEC dbo.sp_add_job @job_name=@job
+	, @description=N'Recomputes the rows of cmrT_ElementSummary and cmrT_RouteSummary queued in cmrT_ResultInvalidation'
+EXEC dbo.sp_add_jobstep @job_name=@job
+	, @step_name=N'cmrSP_refreshResults'
+	, @subsystem=N'TSQL'
+	, @database_name=@database
+	, @command=N'IF EXISTS (SELECT * FROM cmrT_ResultInvalidation) EXEC cmrSP_refreshResults'
+EXEC dbo.sp_add_jobschedule @job_name=@job
+	, @name=N'Every minute'
+	, @freq_type=4 --Daily
+	, @freq_interval=1
+	, @freq_subday_type=4 --Minutes
+	, @freq_subday_interval=1
+EXEC dbo.sp_add_jobserver @job_name=@job
+SET NOCOUNT OFF
+GO